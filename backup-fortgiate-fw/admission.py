@@ -0,0 +1,196 @@
+"""Admission control for fleet mode: per-site, per-AAA-realm and per-vendor limits.
+
+Hundreds of collections starting at once mean hundreds of logins at once: enough to trip
+the rate limits (or lock out the service account) of the TACACS/RADIUS servers, and to
+saturate the WAN link of a small branch. The inventory's "limits" section caps, per site,
+AAA realm ("aaa") and vendor, how many runs collect at the same time (a counter) and how
+fast they start (a token bucket). A run is admitted only when every limit that applies
+to it has room, and takes its place in all of them at once; there are no partial holds,
+so runs never deadlock on each other. It keeps its concurrency slots until its
+collection is over (its upload does not log in anywhere).
+
+The scheduler asks instead of waiting: a worker thread skips a run that is not admitted
+and takes the next one that is, so a busy site does not hold up the rest of the fleet
+(scheduling.FleetScheduler). Asyncio tasks wait for admission before they take a session
+slot (async_engine).
+"""
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import inventory
+import metrics
+
+
+class Refusal(NamedTuple):
+    """Why a run was not admitted."""
+    limit: str                      # kind of the limit: "site", "aaa" or "vendor"
+    reason: str                     # "concurrency" or "rate"
+    retry_after: Optional[float]    # seconds until a token is due; None = until a run releases its slot
+
+
+class _Gate:
+    """The state of one limit: runs holding a slot, a token bucket, and the runs waiting for a slot."""
+
+    def __init__(self, kind: str, limit: inventory.Limit):
+        self.kind = kind
+        self.active = 0
+        self.waiters: List[Callable[[], None]] = []
+        self.limit = limit
+        self.tokens = float(self.limit.bucket)
+        self.updated = time.monotonic()
+
+    def set_limit(self, limit: inventory.Limit) -> None:
+        self.limit = limit
+        self.tokens = min(self.tokens, float(self.limit.bucket))
+
+    def refusal(self, now: float) -> Optional[Refusal]:
+        limit = self.limit
+        if limit.concurrency and self.active >= limit.concurrency:
+            return Refusal(self.kind, "concurrency", None)
+        if limit.rate:
+            self.tokens = min(float(self.limit.bucket), self.tokens + (now - self.updated) * limit.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return Refusal(self.kind, "rate", (1 - self.tokens) / limit.rate)
+        return None
+
+    def take(self) -> None:
+        self.active += 1
+        if self.limit.rate:
+            self.tokens -= 1
+
+
+class Ticket:
+    """A run's places in its limits; `release()` (once the collection is over) gives them back."""
+
+    def __init__(self, admission: "Admission", gates: List[_Gate]):
+        self._admission = admission
+        self._gates = gates
+
+    def release(self) -> None:
+        gates, self._gates = self._gates, []
+        if gates:
+            self._admission._release(gates)
+
+
+class Admission:
+    """
+    The admission limits of one app (`vendor`: its key for "vendor" limits). Thread-safe;
+    `configure()` applies new limits (inventory reload) without losing track of the runs
+    already holding slots. `on_release` callbacks are called, outside the lock, whenever a
+    run gives back its slots (a refused run may fit now).
+    """
+
+    def __init__(self, vendor: str, limits: Optional[inventory.Limits] = None):
+        self.vendor = vendor
+        self._lock = threading.Lock()
+        self._limits: inventory.Limits = {}
+        self._gates: Dict[Tuple[str, str], _Gate] = {}
+        # device name -> (first refused at, last refusal), for the wait metrics
+        self._held: Dict[str, Tuple[float, Refusal]] = {}
+        self._on_release: List[Callable[[], None]] = []
+        self.configure(limits or {})
+
+    def configure(self, limits: inventory.Limits) -> None:
+        waiters = []
+        with self._lock:
+            self._limits = limits
+            for (kind, key), gate in list(self._gates.items()):
+                limit = self._resolve(kind, key)
+                if limit is None and not gate.active:
+                    del self._gates[(kind, key)]
+                else:
+                    gate.set_limit(limit or inventory.Limit())
+                waiters += gate.waiters
+                gate.waiters = []
+        # Raised limits may admit runs now.
+        self._wake(waiters)
+
+    @property
+    def enabled(self) -> bool:
+        return any(self._limits.values())
+
+    def on_release(self, callback: Callable[[], None]) -> None:
+        self._on_release.append(callback)
+
+    def _resolve(self, kind: str, key: str) -> Optional[inventory.Limit]:
+        limits = self._limits.get(kind) or {}
+        return limits.get(key, limits.get("*"))
+
+    def _gates_for(self, device: inventory.Device) -> List[_Gate]:
+        gates = []
+        for kind, key in (("site", device.site), ("aaa", device.aaa), ("vendor", self.vendor)):
+            if key is None:
+                continue
+            gate = self._gates.get((kind, key))
+            if gate is None:
+                limit = self._resolve(kind, key)
+                if limit is None:
+                    continue
+                gate = self._gates[(kind, key)] = _Gate(kind, limit)
+            gates.append(gate)
+        return gates
+
+    def try_acquire(self, device: inventory.Device,
+                    waiter: Optional[Callable[[], None]] = None) -> Tuple[Optional[Ticket], Optional[Refusal]]:
+        """
+        Admit `device` now if all its limits have room: (ticket, None), else (None, refusal).
+        `waiter` is called once when a run releases the slot this one was refused for.
+        """
+        with self._lock:
+            now = time.monotonic()
+            gates = self._gates_for(device)
+            for gate in gates:
+                refusal = gate.refusal(now)
+                if refusal is not None:
+                    if waiter is not None and refusal.retry_after is None:
+                        gate.waiters.append(waiter)
+                    held = self._held.get(device.name)
+                    if held is None:
+                        metrics.record_admission_delayed(refusal.limit, refusal.reason)
+                    self._held[device.name] = (held[0] if held else now, refusal)
+                    metrics.set_admission_waiting(len(self._held))
+                    return None, refusal
+            for gate in gates:
+                gate.take()
+            held = self._held.pop(device.name, None)
+        if held is None:
+            metrics.observe_admission_wait("none", 0.0)
+        else:
+            metrics.set_admission_waiting(len(self._held))
+            metrics.observe_admission_wait(held[1].limit, now - held[0])
+        return Ticket(self, gates), None
+
+    def forget(self, name: str) -> None:
+        """Stop tracking the wait of `name` (removed from the inventory while held back)."""
+        with self._lock:
+            if self._held.pop(name, None) is not None:
+                metrics.set_admission_waiting(len(self._held))
+
+    async def acquire(self, device: inventory.Device) -> Ticket:
+        """Wait (on the running event loop) until `device` is admitted."""
+        loop = asyncio.get_running_loop()
+        while True:
+            released = asyncio.Event()
+            ticket, refusal = self.try_acquire(device, lambda: loop.call_soon_threadsafe(released.set))
+            if ticket is not None:
+                return ticket
+            try:
+                await asyncio.wait_for(released.wait(), refusal.retry_after)
+            except asyncio.TimeoutError:
+                pass
+
+    def _release(self, gates: List[_Gate]) -> None:
+        waiters = []
+        with self._lock:
+            for gate in gates:
+                gate.active -= 1
+                waiters += gate.waiters
+                gate.waiters = []
+        self._wake(waiters)
+
+    def _wake(self, waiters: List[Callable[[], None]]) -> None:
+        for callback in waiters + self._on_release:
+            callback()
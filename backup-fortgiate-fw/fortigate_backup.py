@@ -1,177 +1,404 @@
-"""Fortigate backup: fetch full configuration and upload to cloud or keep locally."""
-import logging
-import os
-import select
-import sys
-import time
-
-import paramiko
-
-import cloud_upload
-import metrics
-
-# Configuration
-HOST = os.environ.get("HOST")
-PORT = os.environ.get("PORT")
-USERNAME = os.environ.get("USERNAME")
-PASSWORD = os.environ.get("PASSWORD")
-backup_file = "fortigate_backup.conf"
-FW_NAME = os.environ.get("FW_NAME")
-
-USE_METRICS = os.environ.get("metrics-pushgw", "false").lower() == "true"
-PUSHGATEWAY_ADDR = os.environ.get("PUSHGATEWAY_ADDR", "pushgateway:9091")
-PUSHGATEWAY_JOB = os.environ.get("PUSHGATEWAY_JOB", "backup-fw-fortigate")
-PUSHGATEWAY_INSTANCE = os.environ.get("PUSHGATEWAY_INSTANCE", HOST or "unknown")
-
-def configure_logging() -> None:
-    level_name = os.environ.get("LOG_LEVEL", "INFO").upper()
-    level = getattr(logging, level_name, logging.INFO)
-    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
-    if level >= logging.INFO:
-        for lib in ("urllib3", "requests", "boto3", "botocore", "azure", "google"):
-            logging.getLogger(lib).setLevel(logging.WARNING)
-
-
-def get_full_configuration() -> bool:
-    """Connect to Fortigate, run show full-configuration, save to backup_file."""
-    start_time = time.time()
-    error_type = None
-
-    try:
-        print(f"Connecting to: {HOST}:{PORT}...")
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        try:
-            ssh.connect(HOST, int(PORT), USERNAME, PASSWORD, timeout=10, allow_agent=False, look_for_keys=False)
-            if USE_METRICS:
-                metrics.BACKUP_CONNECTION_SUCCESS_TOTAL.inc()
-            print("✅ The user successfully connected to: Fortigate")
-        except paramiko.AuthenticationException:
-            error_type = 'authentication_error'
-            if USE_METRICS:
-                metrics.BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
-                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='connection').set(time.time())
-            raise
-        except paramiko.SSHException:
-            error_type = 'ssh_error'
-            if USE_METRICS:
-                metrics.BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
-                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='connection').set(time.time())
-            raise
-        except Exception:
-            error_type = 'connection_error'
-            if USE_METRICS:
-                metrics.BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
-                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='connection').set(time.time())
-            raise
-
-        try:
-            shell = ssh.invoke_shell()
-            time.sleep(1)
-            shell.recv(65535)
-            print("Command:📤 show full-configuration")
-            shell.send("show full-configuration\n")
-
-            with open(backup_file, 'w') as f:
-                while True:
-                    rlist, _, _ = select.select([shell], [], [], 1)
-                    if shell in rlist:
-                        chunk = shell.recv(99999).decode(errors='replace')
-                        if "--More--" in chunk:
-                            shell.send(" ")
-                            chunk = chunk.replace("--More--", "")
-                        f.write(chunk)
-                        f.flush()
-                        if FW_NAME in chunk:
-                            break
-
-            print(f"✅ Configuration saved to: {backup_file}")
-            ssh.close()
-
-            if USE_METRICS:
-                metrics.BACKUP_CONFIGURATION_SUCCESS_TOTAL.inc()
-                metrics.BACKUP_LAST_SUCCESS_TIMESTAMP.labels(operation='configuration').set(time.time())
-                duration = time.time() - start_time
-                metrics.BACKUP_DURATION_SECONDS.labels(operation='configuration').observe(duration)
-            return True
-
-        except Exception:
-            error_type = 'configuration_error'
-            if USE_METRICS:
-                metrics.BACKUP_CONFIGURATION_FAILURE_TOTAL.labels(error_type=error_type).inc()
-                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='configuration').set(time.time())
-            raise
-
-    except Exception as e:
-        if error_type is None:
-            error_type = 'unknown_error'
-        print(f" Error: ❌ {e}")
-        return False
-
-
-def backup_data() -> bool:
-    """Upload backup file to cloud (AWS/Azure). If cloud disabled, skip and keep file locally."""
-    start_time = time.time()
-
-    if not cloud_upload.is_cloud_enabled():
-        if os.path.exists(backup_file):
-            file_path = os.path.abspath(backup_file)
-            print(f"ℹ️  Cloud upload disabled. Backup file stored locally in container:")
-            print(f"   📁 Path: {file_path}")
-        else:
-            print("⚠️  Cloud upload disabled and backup file not found.")
-        return True  # Return True since file is kept locally (not an error)
-
-    success, file_size, error_type = cloud_upload.upload_backup(backup_file, "backup-fw-fortigate")
-
-    if success:
-        if USE_METRICS:
-            metrics.BACKUP_STORAGE_CLOUD_UPLOAD_SUCCESS_TOTAL.inc()
-            metrics.BACKUP_LAST_SUCCESS_TIMESTAMP.labels(operation='storage_upload').set(time.time())
-            metrics.record_upload_success(file_size)
-            duration = time.time() - start_time
-            metrics.BACKUP_DURATION_SECONDS.labels(operation='storage_upload').observe(duration)
-        return True
-
-    if error_type:
-        if USE_METRICS:
-            metrics.BACKUP_STORAGE_CLOUD_UPLOAD_FAILURE_TOTAL.labels(error_type=error_type).inc()
-            metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation="storage_upload").set(time.time())
-    return False
-
-
-def run_backup_once() -> bool:
-    """Run a single backup cycle and push metrics (if enabled)."""
-    overall_start_time = time.time()
-
-    if USE_METRICS:
-        metrics.init_failure_gauges(aws_enabled=cloud_upload.USE_AWS, azure_enabled=cloud_upload.USE_AZURE, gcp_enabled=cloud_upload.USE_GCP)
-
-    config_success = get_full_configuration()
-    if config_success:
-        cloud_success = backup_data()
-    else:
-        print("❌ Configuration retrieval failed. Skipping cloud upload.")
-        cloud_success = False
-
-    if USE_METRICS:
-        overall_duration = time.time() - overall_start_time
-        metrics.BACKUP_DURATION_SECONDS.labels(operation="total").observe(overall_duration)
-        metrics.push_metrics(PUSHGATEWAY_ADDR, PUSHGATEWAY_JOB, PUSHGATEWAY_INSTANCE)
-    else:
-        print("ℹ️  Metrics disabled. Set metrics-pushgw=true to enable Prometheus metrics.")
-
-    return bool(config_success and cloud_success)
-
-
-if __name__ == "__main__":
-    configure_logging()
-    cronjob_enabled = os.environ.get("CRONJOB_ENABLED", "false").lower() == "true"
-    if cronjob_enabled:
-        from cronjob import run_cron_loop
-
-        run_cron_loop()
-    else:
-        success = run_backup_once()
-        sys.exit(0 if success else 1)
+"""Fortigate backup: fetch full configuration and upload to cloud or keep locally."""
+import asyncio
+import logging
+import os
+import select
+import sys
+import time
+from typing import Awaitable, Callable, Optional
+
+import paramiko
+
+import catalog
+import cloud_upload
+import inventory
+import metrics
+import metrics_flusher
+import profiling
+import retention
+import scheduling
+import ssh_session
+import tracing
+import transform
+
+# Configuration
+HOST = os.environ.get("HOST")
+PORT = os.environ.get("PORT")
+USERNAME = os.environ.get("USERNAME")
+PASSWORD = os.environ.get("PASSWORD")
+DEVICE_NAME = os.environ.get("DEVICE_NAME", HOST or "unknown")
+backup_file = "fortigate_backup.conf"
+FW_NAME = os.environ.get("FW_NAME")
+
+USE_METRICS = os.environ.get("metrics-pushgw", "false").lower() == "true"
+PUSHGATEWAY_ADDR = os.environ.get("PUSHGATEWAY_ADDR", "pushgateway:9091")
+PUSHGATEWAY_JOB = os.environ.get("PUSHGATEWAY_JOB", "backup-fw-fortigate")
+PUSHGATEWAY_INSTANCE = os.environ.get("PUSHGATEWAY_INSTANCE", HOST or "unknown")
+
+def env_device() -> inventory.Device:
+    """The device configured through HOST/PORT/USERNAME/PASSWORD/FW_NAME."""
+    return inventory.Device(DEVICE_NAME, HOST, int(PORT or 22), USERNAME, PASSWORD, prompt=FW_NAME)
+
+
+def backup_path(device: inventory.Device) -> str:
+    """Local backup file of an inventory device: `backup_file` with the device name appended."""
+    base, ext = os.path.splitext(backup_file)
+    return f"{base}_{inventory.safe_name(device.name)}{ext}"
+
+
+def configure_logging() -> None:
+    level_name = os.environ.get("LOG_LEVEL", "INFO").upper()
+    level = getattr(logging, level_name, logging.INFO)
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if level >= logging.INFO:
+        for lib in ("urllib3", "requests", "boto3", "botocore", "azure", "google"):
+            logging.getLogger(lib).setLevel(logging.WARNING)
+
+
+def get_full_configuration(device: inventory.Device, backup_file: str) -> bool:
+    """Connect to Fortigate, run show full-configuration, save to backup_file."""
+    start_time = time.time()
+    error_type = None
+    session = None
+
+    try:
+        print(f"Connecting to: {device.host}:{device.port}...")
+
+        try:
+            session = ssh_session.acquire(device.name, device.host, device.port, device.username, device.password,
+                                          timeout=10, on_phase=metrics.observe_phase if USE_METRICS else None)
+            if USE_METRICS:
+                metrics.BACKUP_CONNECTION_SUCCESS_TOTAL.inc()
+            print("✅ The user successfully connected to: Fortigate")
+        except paramiko.AuthenticationException:
+            error_type = 'authentication_error'
+            if USE_METRICS:
+                metrics.BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='connection').set(time.time())
+            raise
+        except paramiko.SSHException:
+            error_type = 'ssh_error'
+            if USE_METRICS:
+                metrics.BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='connection').set(time.time())
+            raise
+        except Exception:
+            error_type = 'connection_error'
+            if USE_METRICS:
+                metrics.BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='connection').set(time.time())
+            raise
+
+        try:
+            shell_start = time.perf_counter()
+            with tracing.span("shell_ready"):
+                shell = session.open_shell()
+                time.sleep(1)
+                shell.recv(65535)
+            shell_ready = time.perf_counter() - shell_start
+
+            with tracing.span("command", command="show full-configuration") as command_span:
+                print("Command:📤 show full-configuration")
+                shell.send("show full-configuration\n")
+
+                command_sent = time.perf_counter()
+                first_byte = None
+                received = lines = 0
+                idle_wait = write_time = 0.0
+                # Prompts can arrive split across two reads.
+                pager = ssh_session.StreamMatcher("--More--")
+                end = ssh_session.StreamMatcher(device.prompt)
+                with transform.open_backup(backup_file, "fortios") as f:
+                    while True:
+                        wait_start = time.perf_counter()
+                        rlist, _, _ = select.select([shell], [], [], 1)
+                        if shell in rlist:
+                            data = shell.recv(99999)
+                            if first_byte is None:
+                                first_byte = time.perf_counter()
+                            received += len(data)
+                            chunk = data.decode(errors='replace')
+                            if pager.feed(chunk):
+                                shell.send(" ")
+                            write_start = time.perf_counter()
+                            f.write(data)
+                            f.flush()
+                            write_time += time.perf_counter() - write_start
+                            lines += data.count(b"\n")
+                            if end.feed(chunk):
+                                break
+                        else:
+                            # No output within the select timeout: time spent waiting for the end prompt.
+                            idle_wait += time.perf_counter() - wait_start
+                transfer_end = time.perf_counter()
+                # Pager prompts are stripped, and the file hashed, by the transform stages inside the writes
+                # (their times are span attributes too: normalize_seconds, hash_seconds, ...).
+                command_span.set_attributes(bytes=received, lines=lines, end_detect_wait_seconds=idle_wait,
+                                            sha256=f.digests()['sha256'])
+
+            print(f"✅ Configuration saved to: {backup_file}")
+            shell.close()
+            session.release()
+
+            if USE_METRICS:
+                metrics.observe_phase('shell_ready', shell_ready)
+                metrics.observe_phase('first_byte', first_byte - command_sent)
+                metrics.observe_phase('end_detect_wait', idle_wait)
+                metrics.observe_phase('write', write_time)
+                metrics.record_transfer(received, lines, transfer_end - first_byte)
+                metrics.BACKUP_CONFIGURATION_SUCCESS_TOTAL.inc()
+                metrics.BACKUP_LAST_SUCCESS_TIMESTAMP.labels(operation='configuration').set(time.time())
+                duration = time.time() - start_time
+                metrics.BACKUP_DURATION_SECONDS.labels(operation='configuration').observe(duration)
+            return True
+
+        except Exception:
+            error_type = 'configuration_error'
+            if USE_METRICS:
+                metrics.BACKUP_CONFIGURATION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='configuration').set(time.time())
+            raise
+
+    except Exception as e:
+        if error_type is None:
+            error_type = 'unknown_error'
+        tracing.set_attribute("error_type", error_type)
+        print(f" Error: ❌ {e}")
+        if session is not None:
+            session.release(healthy=False)
+        return False
+
+
+async def get_full_configuration_async(device: inventory.Device, backup_file: str) -> bool:
+    """get_full_configuration() for the asyncio engine (SCHEDULER_ENGINE=asyncio): over asyncssh, on the event loop."""
+    start_time = time.time()
+    error_type = None
+    session = None
+
+    try:
+        print(f"Connecting to: {device.host}:{device.port}...")
+
+        try:
+            session = await ssh_session.acquire_async(device.name, device.host, device.port, device.username,
+                                                      device.password, timeout=10,
+                                                      on_phase=metrics.observe_phase if USE_METRICS else None)
+            if USE_METRICS:
+                metrics.BACKUP_CONNECTION_SUCCESS_TOTAL.inc()
+            print("✅ The user successfully connected to: Fortigate")
+        except paramiko.AuthenticationException:
+            error_type = 'authentication_error'
+            if USE_METRICS:
+                metrics.BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='connection').set(time.time())
+            raise
+        except paramiko.SSHException:
+            error_type = 'ssh_error'
+            if USE_METRICS:
+                metrics.BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='connection').set(time.time())
+            raise
+        except Exception:
+            error_type = 'connection_error'
+            if USE_METRICS:
+                metrics.BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='connection').set(time.time())
+            raise
+
+        try:
+            shell_start = time.perf_counter()
+            with tracing.span("shell_ready"):
+                shell = await session.open_shell()
+                await asyncio.sleep(1)
+                await shell.recv(65535, timeout=1)
+            shell_ready = time.perf_counter() - shell_start
+
+            with tracing.span("command", command="show full-configuration") as command_span:
+                print("Command:📤 show full-configuration")
+                shell.send("show full-configuration\n")
+
+                command_sent = time.perf_counter()
+                first_byte = None
+                received = lines = 0
+                idle_wait = write_time = 0.0
+                pager = ssh_session.StreamMatcher("--More--")
+                end = ssh_session.StreamMatcher(device.prompt)
+                f = transform.open_backup(backup_file, "fortios")
+                try:
+                    while True:
+                        wait_start = time.perf_counter()
+                        data = await shell.recv(99999, timeout=1)
+                        if data is None:
+                            idle_wait += time.perf_counter() - wait_start
+                            continue
+                        if first_byte is None:
+                            first_byte = time.perf_counter()
+                        received += len(data)
+                        chunk = data.decode(errors='replace')
+                        if pager.feed(chunk):
+                            shell.send(" ")
+                        write_start = time.perf_counter()
+                        f.write(data)
+                        write_time += time.perf_counter() - write_start
+                        lines += data.count(b"\n")
+                        if end.feed(chunk):
+                            break
+                finally:
+                    # Closing may run the transform stages of the whole file (offload): not on the loop.
+                    await asyncio.to_thread(f.close)
+                transfer_end = time.perf_counter()
+                command_span.set_attributes(bytes=received, lines=lines, end_detect_wait_seconds=idle_wait,
+                                            sha256=f.digests()['sha256'])
+
+            print(f"✅ Configuration saved to: {backup_file}")
+            shell.close()
+            session.release()
+
+            if USE_METRICS:
+                metrics.observe_phase('shell_ready', shell_ready)
+                metrics.observe_phase('first_byte', first_byte - command_sent)
+                metrics.observe_phase('end_detect_wait', idle_wait)
+                metrics.observe_phase('write', write_time)
+                metrics.record_transfer(received, lines, transfer_end - first_byte)
+                metrics.BACKUP_CONFIGURATION_SUCCESS_TOTAL.inc()
+                metrics.BACKUP_LAST_SUCCESS_TIMESTAMP.labels(operation='configuration').set(time.time())
+                duration = time.time() - start_time
+                metrics.BACKUP_DURATION_SECONDS.labels(operation='configuration').observe(duration)
+            return True
+
+        except Exception:
+            error_type = 'configuration_error'
+            if USE_METRICS:
+                metrics.BACKUP_CONFIGURATION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation='configuration').set(time.time())
+            raise
+
+    except Exception as e:
+        if error_type is None:
+            error_type = 'unknown_error'
+        tracing.set_attribute("error_type", error_type)
+        print(f" Error: ❌ {e}")
+        if session is not None:
+            session.release(healthy=False)
+        return False
+
+
+def backup_data(device: inventory.Device, backup_file: str) -> bool:
+    """Upload backup file to cloud (AWS/Azure). If cloud disabled, skip and keep file locally."""
+    start_time = time.time()
+
+    if not cloud_upload.is_cloud_enabled():
+        if os.path.exists(backup_file):
+            file_path = os.path.abspath(backup_file)
+            print(f"ℹ️  Cloud upload disabled. Backup file stored locally in container:")
+            print(f"   📁 Path: {file_path}")
+        else:
+            print("⚠️  Cloud upload disabled and backup file not found.")
+        return True  # Return True since file is kept locally (not an error)
+
+    upload_start = time.perf_counter()
+    success, file_size, error_type = cloud_upload.upload_backup(backup_file, "backup-fw-fortigate", device=device.name)
+
+    if success:
+        if USE_METRICS:
+            metrics.BACKUP_STORAGE_CLOUD_UPLOAD_SUCCESS_TOTAL.inc()
+            metrics.BACKUP_LAST_SUCCESS_TIMESTAMP.labels(operation='storage_upload').set(time.time())
+            metrics.record_upload_success(file_size)
+            duration = time.time() - start_time
+            metrics.BACKUP_DURATION_SECONDS.labels(operation='storage_upload').observe(duration)
+            metrics.observe_phase('upload', time.perf_counter() - upload_start)
+        return True
+
+    if error_type:
+        tracing.set_attribute("error_type", error_type)
+        if USE_METRICS:
+            metrics.BACKUP_STORAGE_CLOUD_UPLOAD_FAILURE_TOTAL.labels(error_type=error_type).inc()
+            metrics.BACKUP_LAST_FAILURE_TIMESTAMP.labels(operation="storage_upload").set(time.time())
+    return False
+
+
+def run_backup_once(device: inventory.Device = None) -> bool:
+    """
+    Run a single backup cycle and record its metrics (pushed in the background unless served over HTTP).
+    Backs up the env-configured device to `backup_file`, or the given inventory device to its own file.
+    """
+    success = scheduling.run_stages(backup_stages(device))
+    if success and retention.RETENTION_ENABLED and cloud_upload.is_cloud_enabled():
+        # Once per run here; fleet mode prunes on RETENTION_SCHEDULE instead (retention.start_scheduled).
+        retention.run_retention()
+    return success
+
+
+@profiling.profiled_stages("fortigate_backup", upload_prefix="backup-fw-fortigate")
+def backup_stages(device: inventory.Device = None,
+                  collect: Optional[Callable[[inventory.Device, str], Awaitable[bool]]] = None) -> scheduling.Stages:
+    """
+    run_backup_once() in stages, for the fleet scheduler: collects, yields "store", then
+    uploads and records the metrics. The scheduler may run the "store" part on another
+    thread (SCHEDULER_STORE_WORKERS). Returns whether the run succeeded.
+    With `collect` (get_full_configuration_async), yields collect(device, path) for the
+    asyncio engine to await, and continues with the result it is sent.
+    """
+    if device is None:
+        device, path = env_device(), backup_file
+    else:
+        path = backup_path(device)
+    path = transform.output_path(path)
+    with tracing.span("backup_run", device=device.name) as run_span:
+        overall_start_time = time.time()
+
+        if USE_METRICS:
+            metrics.init_failure_gauges(aws_enabled=cloud_upload.USE_AWS, azure_enabled=cloud_upload.USE_AZURE, gcp_enabled=cloud_upload.USE_GCP)
+
+        with tracing.span("collect"):
+            if collect is None:
+                config_success = get_full_configuration(device, path)
+            else:
+                config_success = yield collect(device, path)
+        durations = {"configuration": time.time() - overall_start_time}
+        backup_size = os.path.getsize(path) if config_success and os.path.exists(path) else 0
+        yield "store"
+        if config_success:
+            upload_start_time = time.time()
+            with tracing.span("store"):
+                cloud_success = backup_data(device, path)
+            durations["storage_upload"] = time.time() - upload_start_time
+        else:
+            print("❌ Configuration retrieval failed. Skipping cloud upload.")
+            cloud_success = False
+
+        if USE_METRICS:
+            overall_duration = time.time() - overall_start_time
+            metrics.BACKUP_DURATION_SECONDS.labels(operation="total").observe(overall_duration)
+            durations["total"] = overall_duration
+            if not metrics.is_serving():
+                # Pushed from a background thread: a slow Pushgateway must not hold up the run.
+                metrics_flusher.start(PUSHGATEWAY_ADDR, PUSHGATEWAY_JOB, PUSHGATEWAY_INSTANCE)
+            metrics_flusher.submit(metrics_flusher.RunSample(
+                device=device.name,
+                success=bool(config_success and cloud_success),
+                durations=durations,
+                bytes_uploaded=backup_size if cloud_success and cloud_upload.is_cloud_enabled() else 0,
+                timestamp=time.time(),
+            ))
+        else:
+            print("ℹ️  Metrics disabled. Set metrics-pushgw=true to enable Prometheus metrics.")
+
+        run_span.set_attributes(success=bool(config_success and cloud_success), bytes=backup_size)
+
+    return bool(config_success and cloud_success)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    catalog.enable("fortigate")
+    cronjob_enabled = os.environ.get("CRONJOB_ENABLED", "false").lower() == "true"
+    if cronjob_enabled:
+        from cronjob import run_cron_loop
+
+        if USE_METRICS:
+            # Long-running process: let Prometheus scrape us instead of pushing every cycle.
+            metrics.start_metrics_server()
+        run_cron_loop()
+    else:
+        success = run_backup_once()
+        sys.exit(0 if success else 1)
@@ -1,8 +1,25 @@
 """Prometheus metrics and Pushgateway push logic for Fortigate backup."""
+import json
 import os
 import re
+import threading
+from socketserver import ThreadingMixIn
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
 import requests
-from prometheus_client import CollectorRegistry, Gauge, Counter, Histogram, push_to_gateway
+from prometheus_client import CollectorRegistry, Gauge, Counter, Histogram, make_wsgi_app, push_to_gateway, write_to_textfile
+from prometheus_client.parser import text_string_to_metric_families
+
+import run_history
+
+# Where push mode keeps the last pushed values so the next run can continue the counters
+# without scraping Pushgateway. Default: .metrics_state_<job>_<instance>.prom in the working dir.
+METRICS_STATE_FILE = os.environ.get('METRICS_STATE_FILE')
+# Long-running (cron) mode serves the registry here for Prometheus to scrape instead of pushing.
+METRICS_HTTP_ADDR = os.environ.get('METRICS_HTTP_ADDR', '0.0.0.0')
+METRICS_HTTP_PORT = int(os.environ.get('METRICS_HTTP_PORT', '8000'))
 
 registry = CollectorRegistry()
 
@@ -20,15 +37,167 @@ _total_bytes_uploaded_accumulator = 0
 BACKUP_LAST_SUCCESS_TIMESTAMP = Gauge('backup_last_success_timestamp', 'Unix timestamp of last successful backup', ['operation'], registry=registry)
 BACKUP_LAST_FAILURE_TIMESTAMP = Gauge('backup_last_failure_timestamp', 'Unix timestamp of last failed backup', ['operation'], registry=registry)
 
+# Per-phase timings with sub-second buckets (connect, handshake, auth, transfer, upload, ...)
+BACKUP_PHASE_DURATION_SECONDS = Histogram('backup_phase_duration_seconds', 'Duration of each backup phase in seconds', ['phase'], registry=registry, buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300])
+BACKUP_TRANSFER_BYTES_TOTAL = Counter('backup_transfer_bytes_total', 'Total configuration bytes received from devices', registry=registry)
+BACKUP_TRANSFER_LINES_TOTAL = Counter('backup_transfer_lines_total', 'Total configuration lines received from devices', registry=registry)
+BACKUP_TRANSFER_RATE_BYTES_PER_SECOND = Gauge('backup_transfer_rate_bytes_per_second', 'Rate of the last configuration transfer in bytes per second', registry=registry)
+BACKUP_TRANSFORM_BYTES_TOTAL = Counter('backup_transform_bytes_total', 'Bytes passed into each transform stage (normalize, redact, compress, hash, write)', ['stage'], registry=registry)
+BACKUP_TRANSFORM_SECONDS_TOTAL = Counter('backup_transform_seconds_total', 'Time spent in each transform stage', ['stage'], registry=registry)
+BACKUP_OFFLOAD_TASKS_TOTAL = Counter('backup_offload_tasks_total', 'CPU-heavy tasks (transform, XML validation) by where they ran: process (worker pool) or inline', ['task', 'mode'], registry=registry)
+BACKUP_OFFLOAD_SECONDS_TOTAL = Counter('backup_offload_seconds_total', 'Time callers spent on CPU-heavy tasks, including the hand-over to a worker process', ['task', 'mode'], registry=registry)
+
+# Per-device series: a fleet run records every device into this one registry.
+BACKUP_DEVICE_RUNS_TOTAL = Counter('backup_device_runs_total', 'Total number of backup runs per device', ['device', 'result'], registry=registry)
+BACKUP_DEVICE_LAST_RUN_TIMESTAMP = Gauge('backup_device_last_run_timestamp', 'Unix timestamp of the last backup run per device', ['device'], registry=registry)
+BACKUP_DEVICE_LAST_DURATION_SECONDS = Gauge('backup_device_last_duration_seconds', 'Duration of the last backup run per device in seconds', ['device', 'operation'], registry=registry)
+BACKUP_DEVICE_BYTES_UPLOADED_TOTAL = Counter('backup_device_bytes_uploaded_total', 'Total bytes uploaded to cloud storage per device', ['device'], registry=registry)
+
+# Background Pushgateway flusher (metrics_flusher.py)
+BACKUP_METRICS_PUSH_QUEUE_DEPTH = Gauge('backup_metrics_push_queue_depth', 'Run samples waiting to be pushed', registry=registry)
+BACKUP_METRICS_SAMPLES_DROPPED_TOTAL = Counter('backup_metrics_samples_dropped_total', 'Run samples dropped because the push queue was full', registry=registry)
+
+# Internal cron scheduler (cronjob.py, scheduling.py)
+BACKUP_SCHEDULER_TICKS_SKIPPED_TOTAL = Counter('backup_scheduler_ticks_skipped_total', 'Cron ticks that did not start a run of their own', ['reason'], registry=registry)
+BACKUP_SCHEDULER_DEVICES = Gauge('backup_scheduler_devices', 'Devices on a schedule (fleet mode)', registry=registry)
+BACKUP_SCHEDULER_READY_QUEUE_DEPTH = Gauge('backup_scheduler_ready_queue_depth', 'Due runs waiting for a free worker (fleet mode)', registry=registry)
+BACKUP_SCHEDULER_RUNNING = Gauge('backup_scheduler_running', 'Runs in progress (fleet mode)', registry=registry)
+BACKUP_SCHEDULER_LAG_SECONDS = Histogram('backup_scheduler_lag_seconds', 'Delay between a run coming due and a worker starting it (fleet mode)', buckets=[0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900], registry=registry)
+BACKUP_SCHEDULER_STAGE_QUEUE_DEPTH = Gauge('backup_scheduler_stage_queue_depth', 'Runs waiting for a worker of a later stage, e.g. collected and waiting to be stored, or for a session slot (stage collect, asyncio engine) (fleet mode)', ['stage'], registry=registry)
+BACKUP_SCHEDULER_STAGE_WAIT_SECONDS = Histogram('backup_scheduler_stage_wait_seconds', 'Time a run waited for a worker of a later stage, or for a session slot (stage collect, asyncio engine) (fleet mode)', ['stage'], buckets=[0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900], registry=registry)
+BACKUP_ADMISSION_WAITING = Gauge('backup_admission_waiting', 'Due runs held back by an admission limit (fleet mode)', registry=registry)
+BACKUP_ADMISSION_DELAYED_TOTAL = Counter('backup_admission_delayed_total', 'Runs held back by an admission limit, by the limit that first held them back (fleet mode)', ['limit', 'reason'], registry=registry)
+BACKUP_ADMISSION_WAIT_SECONDS = Histogram('backup_admission_wait_seconds', 'Time a run was held back by admission limits, by the limit that held it back last; none = admitted at once (fleet mode)', ['limit'], buckets=[0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900], registry=registry)
+BACKUP_INVENTORY_RELOADS_TOTAL = Counter('backup_inventory_reloads_total', 'Inventory file changes picked up (fleet mode)', ['result'], registry=registry)
+
+# SSH session pool (ssh_session.py, SSH_SESSION_POOL=true)
+BACKUP_SSH_SESSIONS_TOTAL = Counter('backup_ssh_sessions_total', 'SSH sessions used for a run, by whether the pooled one was reused', ['outcome'], registry=registry)
+
+
+# Counters carried over between runs (push mode) so Pushgateway shows totals, not per-run values.
+_ACCUMULATED_COUNTERS = (
+    ('backup_connection_success_total', BACKUP_CONNECTION_SUCCESS_TOTAL),
+    ('backup_connection_failure_total', BACKUP_CONNECTION_FAILURE_TOTAL),
+    ('backup_configuration_success_total', BACKUP_CONFIGURATION_SUCCESS_TOTAL),
+    ('backup_configuration_failure_total', BACKUP_CONFIGURATION_FAILURE_TOTAL),
+    ('backup_storage_cloud_upload_success_total', BACKUP_STORAGE_CLOUD_UPLOAD_SUCCESS_TOTAL),
+    ('backup_storage_cloud_upload_failure_total', BACKUP_STORAGE_CLOUD_UPLOAD_FAILURE_TOTAL),
+    ('backup_transfer_bytes_total', BACKUP_TRANSFER_BYTES_TOTAL),
+    ('backup_transfer_lines_total', BACKUP_TRANSFER_LINES_TOTAL),
+    ('backup_transform_bytes_total', BACKUP_TRANSFORM_BYTES_TOTAL),
+    ('backup_transform_seconds_total', BACKUP_TRANSFORM_SECONDS_TOTAL),
+    ('backup_offload_tasks_total', BACKUP_OFFLOAD_TASKS_TOTAL),
+    ('backup_offload_seconds_total', BACKUP_OFFLOAD_SECONDS_TOTAL),
+    ('backup_device_runs_total', BACKUP_DEVICE_RUNS_TOTAL),
+    ('backup_device_bytes_uploaded_total', BACKUP_DEVICE_BYTES_UPLOADED_TOTAL),
+    ('backup_metrics_samples_dropped_total', BACKUP_METRICS_SAMPLES_DROPPED_TOTAL),
+)
+_GROUPING_LABELS = ('job', 'instance')
+_baseline_loaded = False
+_serving = False
+_last_file_size = 0.0
+
 
 def record_upload_success(file_size: float) -> None:
     """Record a successful upload (update accumulator and gauge)."""
-    global _total_bytes_uploaded_accumulator
+    global _total_bytes_uploaded_accumulator, _last_file_size
     _total_bytes_uploaded_accumulator += file_size
+    _last_file_size = file_size
     BACKUP_STORAGE_CLOUD_LAST_FILE_SIZE_BYTES.set(file_size)
     BACKUP_STORAGE_CLOUD_TOTAL_BYTES_UPLOADED.set(_total_bytes_uploaded_accumulator)
 
 
+
+
+def observe_phase(phase: str, seconds: float) -> None:
+    """Record the duration of one backup phase."""
+    BACKUP_PHASE_DURATION_SECONDS.labels(phase=phase).observe(seconds)
+
+
+def record_transfer(nbytes: int, nlines: int, seconds: float) -> None:
+    """Record a finished configuration download (bytes, lines, rate and transfer phase)."""
+    BACKUP_TRANSFER_BYTES_TOTAL.inc(nbytes)
+    BACKUP_TRANSFER_LINES_TOTAL.inc(nlines)
+    if seconds > 0:
+        BACKUP_TRANSFER_RATE_BYTES_PER_SECOND.set(nbytes / seconds)
+    observe_phase('transfer', seconds)
+
+
+def record_transform(stage: str, nbytes: int, seconds: float) -> None:
+    """Record one transform stage's share of a backup (bytes in, time spent)."""
+    BACKUP_TRANSFORM_BYTES_TOTAL.labels(stage=stage).inc(nbytes)
+    BACKUP_TRANSFORM_SECONDS_TOTAL.labels(stage=stage).inc(seconds)
+
+
+def record_offload(task: str, mode: str, seconds: float) -> None:
+    """mode: 'process' (ran in the offload pool; seconds include the hand-over) or 'inline'."""
+    BACKUP_OFFLOAD_TASKS_TOTAL.labels(task=task, mode=mode).inc()
+    BACKUP_OFFLOAD_SECONDS_TOTAL.labels(task=task, mode=mode).inc(seconds)
+
+
+def record_run(device: str, success: bool, durations: Dict[str, float], bytes_uploaded: float, timestamp: float) -> None:
+    """Record one device's backup run in the per-device series."""
+    BACKUP_DEVICE_RUNS_TOTAL.labels(device=device, result='success' if success else 'failure').inc()
+    BACKUP_DEVICE_LAST_RUN_TIMESTAMP.labels(device=device).set(timestamp)
+    for operation, seconds in durations.items():
+        BACKUP_DEVICE_LAST_DURATION_SECONDS.labels(device=device, operation=operation).set(seconds)
+    if bytes_uploaded:
+        BACKUP_DEVICE_BYTES_UPLOADED_TOTAL.labels(device=device).inc(bytes_uploaded)
+
+
+def record_sample_dropped() -> None:
+    BACKUP_METRICS_SAMPLES_DROPPED_TOTAL.inc()
+
+
+def record_skipped_ticks(reason: str, count: int) -> None:
+    """reason: 'coalesced' (missed while idle, merged into one run) or 'overlap' (came due during a run)."""
+    BACKUP_SCHEDULER_TICKS_SKIPPED_TOTAL.labels(reason=reason).inc(count)
+
+
+def set_scheduler_state(devices: int, ready: int, running: int) -> None:
+    BACKUP_SCHEDULER_DEVICES.set(devices)
+    BACKUP_SCHEDULER_READY_QUEUE_DEPTH.set(ready)
+    BACKUP_SCHEDULER_RUNNING.set(running)
+
+
+def observe_scheduling_lag(seconds: float) -> None:
+    BACKUP_SCHEDULER_LAG_SECONDS.observe(max(0.0, seconds))
+
+
+def set_stage_queue_depth(stage: str, depth: int) -> None:
+    BACKUP_SCHEDULER_STAGE_QUEUE_DEPTH.labels(stage=stage).set(depth)
+
+
+def observe_stage_wait(stage: str, seconds: float) -> None:
+    BACKUP_SCHEDULER_STAGE_WAIT_SECONDS.labels(stage=stage).observe(max(0.0, seconds))
+
+
+def set_admission_waiting(count: int) -> None:
+    BACKUP_ADMISSION_WAITING.set(count)
+
+
+def record_admission_delayed(limit: str, reason: str) -> None:
+    """limit: 'site', 'aaa' or 'vendor'; reason: 'concurrency' (no free slot) or 'rate' (no token)."""
+    BACKUP_ADMISSION_DELAYED_TOTAL.labels(limit=limit, reason=reason).inc()
+
+
+def observe_admission_wait(limit: str, seconds: float) -> None:
+    BACKUP_ADMISSION_WAIT_SECONDS.labels(limit=limit).observe(max(0.0, seconds))
+
+
+def record_inventory_reload(result: str) -> None:
+    """result: 'applied' or 'invalid' (the new version was rejected and the old one kept)."""
+    BACKUP_INVENTORY_RELOADS_TOTAL.labels(result=result).inc()
+
+
+def record_ssh_session(outcome: str) -> None:
+    """outcome: 'new' (connected), 'reused' (pooled session) or 'stale' (pooled session was dead, reconnected)."""
+    BACKUP_SSH_SESSIONS_TOTAL.labels(outcome=outcome).inc()
+
+
+def set_push_queue_depth(depth: int) -> None:
+    BACKUP_METRICS_PUSH_QUEUE_DEPTH.set(depth)
+
 def init_failure_gauges(aws_enabled: bool = False, azure_enabled: bool = False, gcp_enabled: bool = False) -> None:
     """Initialize failure metrics to 0. Only inits storage cloud error types for the enabled provider(s)."""
     BACKUP_CONNECTION_FAILURE_TOTAL.labels(error_type='authentication_error').inc(0)
@@ -50,65 +219,148 @@ def init_failure_gauges(aws_enabled: bool = False, azure_enabled: bool = False,
         BACKUP_STORAGE_CLOUD_UPLOAD_FAILURE_TOTAL.labels(error_type='gcp_client_error').inc(0)
 
 
-def push_metrics(pushgateway_addr: str, job: str, instance: str) -> None:
-    """Push all metrics to Pushgateway, manually accumulating counters."""
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _debug_runs(environ, start_response):
+    query = parse_qs(environ.get('QUERY_STRING', ''))
+    device = query.get('device', [None])[0]
+    try:
+        limit = int(query['limit'][0]) if 'limit' in query else None
+    except ValueError:
+        start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+        return [b'limit must be an integer\n']
+    body = json.dumps(run_history.snapshot(device, limit), default=str).encode()
+    start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def start_metrics_server() -> None:
+    """
+    Serve the registry on METRICS_HTTP_ADDR:METRICS_HTTP_PORT/metrics (idempotent), and the
+    recent run history (run_history.py) as JSON on /debug/runs[?device=<name>&limit=<n>].
+    """
+    global _serving
+    if _serving:
+        return
+    metrics_app = make_wsgi_app(registry)
+
+    def app(environ, start_response):
+        if environ.get('PATH_INFO') == '/debug/runs':
+            return _debug_runs(environ, start_response)
+        return metrics_app(environ, start_response)
+
+    run_history.enable()
+    server = make_server(METRICS_HTTP_ADDR, METRICS_HTTP_PORT, app, _ThreadingWSGIServer, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    _serving = True
+    print(f"✅ Serving metrics on http://{METRICS_HTTP_ADDR}:{METRICS_HTTP_PORT}/metrics (run history on /debug/runs)")
+
+
+def is_serving() -> bool:
+    """True when metrics are exposed for scraping, so runs must not push to Pushgateway."""
+    return _serving
+
+
+def _gateway_url(pushgateway_addr: str) -> str:
+    url = pushgateway_addr if pushgateway_addr.startswith(('http://', 'https://')) else f'http://{pushgateway_addr}'
+    return url.rstrip('/')
+
+
+def _state_file(job: str, instance: str) -> str:
+    if METRICS_STATE_FILE:
+        return METRICS_STATE_FILE
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{job}_{instance}")
+    return f".metrics_state_{safe}.prom"
+
+
+def _load_state(path: str) -> Optional[Dict[str, List[Tuple[dict, float]]]]:
+    """Parse a saved exposition-format snapshot into {sample_name: [(labels, value), ...]}."""
+    try:
+        with open(path) as f:
+            text = f.read()
+    except FileNotFoundError:
+        return None
+    samples: Dict[str, List[Tuple[dict, float]]] = {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            samples.setdefault(sample.name, []).append((dict(sample.labels), sample.value))
+    return samples
+
+
+def _fetch_group(pushgateway_addr: str, job: str, instance: str) -> Dict[str, List[Tuple[dict, float]]]:
+    """Read the existing values of this job/instance group from the Pushgateway JSON API."""
+    response = requests.get(f"{_gateway_url(pushgateway_addr)}/api/v1/metrics", timeout=15)
+    response.raise_for_status()
+    samples: Dict[str, List[Tuple[dict, float]]] = {}
+    for group in response.json().get('data', []):
+        labels = group.get('labels', {})
+        if labels.get('job') != job or labels.get('instance') != instance:
+            continue
+        for name, family in group.items():
+            if not isinstance(family, dict) or family.get('type') not in ('COUNTER', 'GAUGE'):
+                continue
+            for metric in family.get('metrics', []):
+                metric_labels = {k: v for k, v in metric.get('labels', {}).items() if k not in _GROUPING_LABELS}
+                samples.setdefault(name, []).append((metric_labels, float(metric['value'])))
+        break
+    return samples
+
+
+def _apply_baseline(samples: Dict[str, List[Tuple[dict, float]]]) -> None:
+    """Add previously pushed totals on top of this process's values (once per process)."""
     global _total_bytes_uploaded_accumulator
+    for sample_name, counter in _ACCUMULATED_COUNTERS:
+        for labels, value in samples.get(sample_name, []):
+            labels = {k: v for k, v in labels.items() if k not in _GROUPING_LABELS}
+            if value <= 0:
+                continue
+            if labels:
+                counter.labels(**labels).inc(value)
+            else:
+                counter.inc(value)
+
+    total_bytes = samples.get('backup_storage_cloud_total_bytes_uploaded')
+    if total_bytes:
+        _total_bytes_uploaded_accumulator += total_bytes[0][1]
+        BACKUP_STORAGE_CLOUD_TOTAL_BYTES_UPLOADED.set(_total_bytes_uploaded_accumulator)
+    last_size = samples.get('backup_storage_cloud_last_file_size_bytes')
+    if last_size and _last_file_size == 0:
+        BACKUP_STORAGE_CLOUD_LAST_FILE_SIZE_BYTES.set(last_size[0][1])
+
+
+def push_metrics(pushgateway_addr: str, job: str, instance: str) -> None:
+    """
+    Push all metrics to Pushgateway, accumulating counters across runs.
+
+    Previous totals are loaded once per process: from the local state file written after the
+    last successful push, or (first run on a fresh volume) from this group only via the
+    Pushgateway JSON API. No full /metrics scrape, no regex matching.
+    """
+    global _baseline_loaded
     try:
         print(f"✅ Job: {job}, Instance: {instance}")
+        state_path = _state_file(job, instance)
 
-        try:
-            gateway_url = pushgateway_addr if pushgateway_addr.startswith(('http://', 'https://')) else f'http://{pushgateway_addr}'
-            metrics_url = f"{gateway_url.rstrip('/')}/metrics"
-            response = requests.get(metrics_url, timeout=15)
-            response.raise_for_status()
-            metrics_text = response.text
-
-            def find_metric_value(metric_name: str):
-                num = r'(\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)'
-                for order in (
-                    rf'instance="{re.escape(instance)}",job="{re.escape(job)}"',
-                    rf'job="{re.escape(job)}",instance="{re.escape(instance)}"',
-                ):
-                    pattern = rf'{re.escape(metric_name)}\{{{order}\}}\s+{num}'
-                    match = re.search(pattern, metrics_text)
-                    if match:
-                        return float(match.group(1))
-                return None
-
-            counter_values = {}
-            for metric_name in ['backup_connection_success_total', 'backup_configuration_success_total', 'backup_storage_cloud_upload_success_total']:
-                val = find_metric_value(metric_name)
-                if val is not None:
-                    counter_values[metric_name] = val
-
-            gauge_values = {}
-            for metric_name in ['backup_storage_cloud_last_file_size_bytes', 'backup_storage_cloud_total_bytes_uploaded']:
-                val = find_metric_value(metric_name)
-                if val is not None:
-                    gauge_values[metric_name] = val
-
-            if counter_values:
-                print(f"✅ Accumulating: found existing counters for job={job} instance={instance}")
-
-            if 'backup_connection_success_total' in counter_values:
-                current_val = BACKUP_CONNECTION_SUCCESS_TOTAL._value.get()
-                BACKUP_CONNECTION_SUCCESS_TOTAL._value._value = counter_values['backup_connection_success_total'] + current_val
-            if 'backup_configuration_success_total' in counter_values:
-                current_val = BACKUP_CONFIGURATION_SUCCESS_TOTAL._value.get()
-                BACKUP_CONFIGURATION_SUCCESS_TOTAL._value._value = counter_values['backup_configuration_success_total'] + current_val
-            if 'backup_storage_cloud_upload_success_total' in counter_values:
-                current_val = BACKUP_STORAGE_CLOUD_UPLOAD_SUCCESS_TOTAL._value.get()
-                BACKUP_STORAGE_CLOUD_UPLOAD_SUCCESS_TOTAL._value._value = counter_values['backup_storage_cloud_upload_success_total'] + current_val
-
-            if 'backup_storage_cloud_total_bytes_uploaded' in gauge_values:
-                existing_total = gauge_values['backup_storage_cloud_total_bytes_uploaded']
-                new_total = existing_total + _total_bytes_uploaded_accumulator
-                BACKUP_STORAGE_CLOUD_TOTAL_BYTES_UPLOADED.set(new_total)
-            if 'backup_storage_cloud_last_file_size_bytes' in gauge_values and BACKUP_STORAGE_CLOUD_LAST_FILE_SIZE_BYTES._value.get() == 0:
-                BACKUP_STORAGE_CLOUD_LAST_FILE_SIZE_BYTES.set(gauge_values['backup_storage_cloud_last_file_size_bytes'])
-
-        except (requests.RequestException, AttributeError, ValueError) as e:
-            print(f"⚠️ Could not fetch existing metrics from Pushgateway: {e}")
+        if not _baseline_loaded:
+            try:
+                samples = _load_state(state_path)
+                source = 'state file'
+                if samples is None:
+                    samples = _fetch_group(pushgateway_addr, job, instance)
+                    source = 'Pushgateway'
+                if samples:
+                    _apply_baseline(samples)
+                    print(f"✅ Accumulating: loaded existing counters for job={job} instance={instance} from {source}")
+            except (OSError, requests.RequestException, ValueError, KeyError) as e:
+                print(f"⚠️ Could not load existing metrics: {e}")
+            _baseline_loaded = True
 
         push_to_gateway(
             gateway=pushgateway_addr,
@@ -117,5 +369,10 @@ def push_metrics(pushgateway_addr: str, job: str, instance: str) -> None:
             grouping_key={'instance': instance}
         )
         print(f"✅ Metrics pushed to Pushgateway at {pushgateway_addr}")
+
+        try:
+            write_to_textfile(state_path, registry)
+        except OSError as e:
+            print(f"⚠️ Could not save metrics state to {state_path}: {e}")
     except Exception as e:
         print(f"❌ Failed to push metrics to Pushgateway: {e}")
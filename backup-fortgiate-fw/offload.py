@@ -0,0 +1,121 @@
+"""CPU-heavy post-processing in worker processes.
+
+Collector threads share one interpreter: a regex pass, gzip or XML parse over a
+multi-MB configuration in one of them holds the GIL and stalls the SSH and HTTPS reads
+of all the others. With BACKUP_OFFLOAD_WORKERS > 0 that work runs in a
+ProcessPoolExecutor instead, and the calling thread waits for it without holding the
+GIL. Data is handed over in temp files, not pickled: transform spools the device output
+to one (SpooledPipeline) and `call()` writes its bytes to one, so only paths, settings and
+small results cross the process boundary.
+
+Inputs under BACKUP_OFFLOAD_MIN_BYTES run inline, where the round trip to a worker
+costs more than it saves. A broken pool (a worker killed, e.g. by the OOM killer) is
+replaced, and the task that hit it runs inline.
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, TypeVar
+
+import metrics
+
+# Worker processes for CPU-heavy post-processing; 0 runs everything in the collector thread.
+BACKUP_OFFLOAD_WORKERS = max(0, int(os.environ.get("BACKUP_OFFLOAD_WORKERS", "0")))
+# Smaller inputs are processed inline.
+BACKUP_OFFLOAD_MIN_BYTES = int(os.environ.get("BACKUP_OFFLOAD_MIN_BYTES", "1000000"))
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def enabled(nbytes: int) -> bool:
+    """Whether work on `nbytes` of input goes to a worker process."""
+    return BACKUP_OFFLOAD_WORKERS > 0 and nbytes >= BACKUP_OFFLOAD_MIN_BYTES
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the collector process has SSH and upload threads holding locks.
+            _pool = ProcessPoolExecutor(BACKUP_OFFLOAD_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _discard(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def shutdown() -> None:
+    """
+    Stop the worker processes (a later task starts new ones). Needed before a
+    multiprocessing child exits: it waits for its own children before atexit would stop them.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def run(fn: Callable[..., T], nbytes: int, *args) -> T:
+    """
+    fn(*args), in a worker process when it works on `nbytes` of input (see enabled()),
+    else inline; blocks until it returns. `fn` must be a module-level function of a shared
+    module, and its arguments and result are pickled: pass paths, not contents.
+    """
+    if not enabled(nbytes):
+        return _inline(fn.__name__, fn, *args)
+    return _submit(fn.__name__, fn, *args)
+
+
+def call(fn: Callable[..., T], data: bytes, *args) -> T:
+    """fn(data, *args), in a worker process for large `data` (handed over in a temp file), else inline."""
+    if not enabled(len(data)):
+        return _inline(fn.__name__, fn, data, *args)
+    fd, path = tempfile.mkstemp(prefix="backup-offload-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return _submit(fn.__name__, _call_file, fn, path, *args)
+    finally:
+        os.remove(path)
+
+
+def _call_file(fn: Callable[..., T], path: str, *args) -> T:
+    with open(path, "rb") as f:
+        data = f.read()
+    return fn(data, *args)
+
+
+def _submit(task: str, fn: Callable[..., T], *args) -> T:
+    pool = _executor()
+    start = time.perf_counter()
+    try:
+        result = pool.submit(fn, *args).result()
+    except BrokenProcessPool as e:
+        logger.warning("Offload worker pool broken (%s); running %s inline", e, task)
+        _discard(pool)
+        return _inline(task, fn, *args)
+    metrics.record_offload(task, "process", time.perf_counter() - start)
+    return result
+
+
+def _inline(task: str, fn: Callable[..., T], *args) -> T:
+    start = time.perf_counter()
+    result = fn(*args)
+    metrics.record_offload(task, "inline", time.perf_counter() - start)
+    return result
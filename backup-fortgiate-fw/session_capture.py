@@ -0,0 +1,420 @@
+"""Record device sessions, and replay them in place of the device.
+
+With SESSION_CAPTURE_DIR set, every SSH shell (ssh_session) and every Palo Alto API
+session (requests) is recorded to `<dir>/<device>_<time>.<ssh|http>.cap`: the bytes as
+they arrived from the device, what the collector sent, and when, gzip-compressed.
+Captures hold the device configuration; keep them as safe as the backups. API keys
+and passwords are not recorded.
+
+With SESSION_REPLAY_FILE set, no device is contacted: ssh_session.acquire() hands out
+a channel that plays the capture back, and the Palo Alto client's requests are answered
+from it. Output that followed a command in the capture is only played after the
+collector has sent that command, with the recorded delay, divided by
+SESSION_REPLAY_SPEED (0 = no delays). Slow devices, split prompts and pagers then
+behave the same on every run; see benchmarks/bench_replay.py.
+
+File format: a JSON header line, then records of (kind: 1 byte, seconds since the
+start: float64, length: uint32, payload), the whole file gzip-compressed. Kinds:
+`r` received and `s` sent (SSH); `q` request, `h` response status and headers (JSON)
+and `b` response body (HTTP).
+"""
+import gzip
+import itertools
+import json
+import os
+import re
+import struct
+import threading
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+SESSION_CAPTURE_DIR = os.environ.get("SESSION_CAPTURE_DIR", "")
+SESSION_REPLAY_FILE = os.environ.get("SESSION_REPLAY_FILE", "")
+SESSION_REPLAY_SPEED = float(os.environ.get("SESSION_REPLAY_SPEED", "1"))
+
+_MAGIC = "backup-session-capture"
+_RECORD = struct.Struct(">cdI")
+# Request parameters that are never written to a capture.
+_SECRET_PARAMS = {"password", "key", "user"}
+_API_KEY = re.compile(rb"<key>[^<]*</key>")
+# Tells apart the captures of one device started within the clock's resolution.
+_capture_ids = itertools.count(1)
+
+# The most recent replay channel (benchmarks read its timings).
+last_replay: Optional["ReplayChannel"] = None
+
+Record = Tuple[bytes, float, bytes]
+
+
+def capture_path(device: str, kind: str) -> str:
+    """A new file name for each capture: several sessions of one device may start in the same second."""
+    safe = re.sub(r"[^A-Za-z0-9._-]", "_", device)
+    now = time.time_ns()
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now // 10 ** 9))
+    return os.path.join(SESSION_CAPTURE_DIR, f"{safe}_{stamp}.{now % 10 ** 9:09d}-{next(_capture_ids)}.{kind}.cap")
+
+
+class Recorder:
+    """Appends timed records to a capture file; safe to call from several threads."""
+
+    def __init__(self, path: str, kind: str, device: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._f = gzip.open(path, "wb", compresslevel=6)
+        header = {"format": _MAGIC, "version": 1, "kind": kind, "device": device, "started": time.time()}
+        self._f.write(json.dumps(header).encode() + b"\n")
+
+    def record(self, kind: bytes, data: bytes) -> None:
+        with self._lock:
+            if self._f is None:
+                return
+            self._f.write(_RECORD.pack(kind, time.perf_counter() - self._start, len(data)))
+            self._f.write(data)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+def read_capture(path: str) -> Tuple[dict, List[Record]]:
+    """(header, records) of a capture; a file cut short (process killed) yields what was written."""
+    records = []
+    with gzip.open(path, "rb") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != _MAGIC:
+            raise ValueError(f"{path} is not a session capture")
+        try:
+            while True:
+                head = f.read(_RECORD.size)
+                if len(head) < _RECORD.size:
+                    break
+                kind, offset, length = _RECORD.unpack(head)
+                data = f.read(length)
+                if len(data) < length:
+                    break
+                records.append((kind, offset, data))
+        except (EOFError, OSError):
+            pass
+    return header, records
+
+
+# SSH
+
+class CaptureChannel:
+    """
+    A paramiko Channel that records what the device sends (as it arrives) and what is sent
+    to it. Arrival is recorded by hooking the channel's input buffer (paramiko internals);
+    on a paramiko without them, what recv() returns is recorded instead, with the time the
+    collector read it.
+    """
+
+    def __init__(self, channel, recorder: Recorder):
+        self._channel = channel
+        self._recorder = recorder
+        buffer = getattr(channel, "in_buffer", None)
+        self._hooked = all(hasattr(buffer, name) for name in ("_lock", "_buffer", "feed", "close"))
+        if not self._hooked:
+            return
+        feed, close = buffer.feed, buffer.close
+
+        def recorded_feed(data) -> None:
+            recorder.record(b"r", bytes(data))
+            feed(data)
+
+        def recorded_close() -> None:
+            close()
+            recorder.close()
+
+        # The transport thread feeds the channel's buffer packet by packet: record there, not in recv().
+        # Some devices write as soon as the channel opens: take what is already buffered along.
+        with buffer._lock:
+            pending = bytes(buffer._buffer)
+            buffer.feed = recorded_feed
+            buffer.close = recorded_close
+        if pending:
+            recorder.record(b"r", pending)
+
+    def recv(self, nbytes: int) -> bytes:
+        data = self._channel.recv(nbytes)
+        if not self._hooked and data:
+            self._recorder.record(b"r", data)
+        return data
+
+    def send(self, data) -> int:
+        # Recorded first: the reply can arrive (and be recorded) before send() returns.
+        self._recorder.record(b"s", data.encode() if isinstance(data, str) else bytes(data))
+        return self._channel.send(data)
+
+    def close(self) -> None:
+        self._channel.close()
+        self._recorder.close()
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+def capture_shell(channel, device: str):
+    """`channel`, recorded if SESSION_CAPTURE_DIR is set."""
+    if not SESSION_CAPTURE_DIR:
+        return channel
+    return CaptureChannel(channel, Recorder(capture_path(device, "ssh"), "ssh", device))
+
+
+class ReplayChannel:
+    """
+    Channel-like playback of an SSH capture: recv(), send(), close() and fileno() (for
+    select), with paramiko's buffering, so reads coalesce the way they do on a real channel.
+    """
+
+    def __init__(self, path: str, speed: float = SESSION_REPLAY_SPEED):
+        # paramiko is only a dependency of the SSH collectors.
+        from paramiko.buffered_pipe import BufferedPipe
+        from paramiko.pipe import make_pipe
+
+        _, records = read_capture(path)
+        self._records = [r for r in records if r[0] in (b"r", b"s")]
+        self._speed = speed
+        self._buffer = BufferedPipe()
+        self._pipe = make_pipe()
+        self._buffer.set_event(self._pipe)
+        self._sent = threading.Condition()
+        self._sends = 0
+        self._closed = False
+        self.mismatched_sends = 0
+        self.delivered = 0
+        # time.time_ns() when the last recorded byte was delivered (end of output).
+        self.finished_ns: Optional[int] = None
+        threading.Thread(target=self._play, name="session-replay", daemon=True).start()
+
+    def _play(self) -> None:
+        anchor_replay, anchor_recorded = time.perf_counter(), 0.0
+        expected_sends = 0
+        for kind, offset, data in self._records:
+            if kind == b"s":
+                # Output recorded after a command is only played once the collector sent it.
+                expected_sends += 1
+                with self._sent:
+                    while self._sends < expected_sends and not self._closed:
+                        self._sent.wait()
+                if self._closed:
+                    return
+                anchor_replay, anchor_recorded = time.perf_counter(), offset
+                continue
+            if self._speed > 0:
+                pause = anchor_replay + (offset - anchor_recorded) / self._speed - time.perf_counter()
+                if pause > 0:
+                    time.sleep(pause)
+            if self._closed:
+                return
+            self._buffer.feed(data)
+            self.delivered += len(data)
+            self.finished_ns = time.time_ns()
+
+    def recv(self, nbytes: int) -> bytes:
+        return self._buffer.read(nbytes)
+
+    def recv_ready(self) -> bool:
+        return self._buffer.read_ready()
+
+    def send(self, data) -> int:
+        with self._sent:
+            self._sends += 1
+            self._sent.notify_all()
+        return len(data)
+
+    def fileno(self) -> int:
+        return self._pipe.fileno()
+
+    def close(self) -> None:
+        with self._sent:
+            self._closed = True
+            self._sent.notify_all()
+        self._buffer.close()
+        self._pipe.close()
+
+
+class ReplaySession:
+    """Stands in for ssh_session.Session when SESSION_REPLAY_FILE is set."""
+
+    reused = False
+
+    def __init__(self, name: str, path: str = None):
+        self.name = name
+        self.path = path or SESSION_REPLAY_FILE
+
+    def open_shell(self) -> ReplayChannel:
+        global last_replay
+        last_replay = ReplayChannel(self.path)
+        return last_replay
+
+    def release(self, healthy: bool = True) -> None:
+        pass
+
+
+# HTTP (requests)
+
+def _redacted_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = [(k, "***" if k in _SECRET_PARAMS else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _redacted_body(body) -> Optional[str]:
+    if body is None:
+        return None
+    text = body.decode(errors="replace") if isinstance(body, bytes) else str(body)
+    if "=" not in text:
+        return text
+    return urlencode([(k, "***" if k in _SECRET_PARAMS else v) for k, v in parse_qsl(text, keep_blank_values=True)])
+
+
+def _is_keygen(request) -> bool:
+    params = parse_qsl(urlsplit(request.url).query)
+    if isinstance(request.body, (bytes, str)):
+        body = request.body.decode(errors="replace") if isinstance(request.body, bytes) else request.body
+        params += parse_qsl(body)
+    return ("type", "keygen") in params
+
+
+class _RecordedBody:
+    """
+    Wraps urllib3's response so every chunk the client reads is recorded. With `redact`
+    (a keygen response), the body is recorded once it has been read in full, with the
+    API key masked: a key split across two chunks would slip past per-chunk masking.
+    """
+
+    def __init__(self, raw, recorder: Recorder, redact: bool = False):
+        self._raw = raw
+        self._recorder = recorder
+        self._redact = redact
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        if not self._redact:
+            for chunk in self._raw.stream(amt, decode_content=decode_content):
+                self._recorder.record(b"b", chunk)
+                yield chunk
+            return
+        body = []
+        try:
+            for chunk in self._raw.stream(amt, decode_content=decode_content):
+                body.append(chunk)
+                yield chunk
+        finally:
+            self._recorder.record(b"b", _API_KEY.sub(b"<key>***</key>", b"".join(body)))
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class _ReplayBody:
+    """The body of one replayed response, delivered at its recorded pace."""
+
+    def __init__(self, chunks: List[Tuple[float, bytes]], anchor: float, speed: float):
+        self._chunks = chunks
+        self._anchor = anchor
+        self._speed = speed
+        self._original_response = None
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        start = time.perf_counter()
+        for offset, data in self._chunks:
+            if self._speed > 0:
+                pause = start + (offset - self._anchor) / self._speed - time.perf_counter()
+                if pause > 0:
+                    time.sleep(pause)
+            yield data
+
+    def read(self, amt=None, decode_content=None):
+        return b"".join(self.stream())
+
+    def close(self) -> None:
+        pass
+
+    def release_conn(self) -> None:
+        pass
+
+
+def _capture_adapter(recorder: Recorder):
+    from requests.adapters import HTTPAdapter
+
+    class CaptureAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            recorder.record(b"q", json.dumps({"method": request.method, "url": _redacted_url(request.url),
+                                              "body": _redacted_body(request.body)}).encode())
+            response = super().send(request, **kwargs)
+            # Bodies are recorded as the client reads them, i.e. already decoded.
+            headers = {k: v for k, v in response.headers.items() if k.lower() != "content-encoding"}
+            recorder.record(b"h", json.dumps({"status": response.status_code, "reason": response.reason,
+                                              "headers": headers}).encode())
+            response.raw = _RecordedBody(response.raw, recorder, redact=_is_keygen(request))
+            return response
+
+        def close(self):
+            super().close()
+            recorder.close()
+
+    return CaptureAdapter()
+
+
+def _replay_adapter(path: str, speed: float):
+    from requests.adapters import BaseAdapter
+    from requests.exceptions import ConnectionError
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    _, records = read_capture(path)
+    # One exchange per request: (request offset, head offset, head, [(offset, chunk)])
+    exchanges = []
+    for kind, offset, data in records:
+        if kind == b"q":
+            exchanges.append([offset, offset, None, []])
+        elif kind == b"h" and exchanges:
+            exchanges[-1][1], exchanges[-1][2] = offset, json.loads(data)
+        elif kind == b"b" and exchanges:
+            exchanges[-1][3].append((offset, data))
+
+    class ReplayAdapter(BaseAdapter):
+        def __init__(self):
+            super().__init__()
+            self._next = 0
+
+        def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+            if self._next >= len(exchanges) or exchanges[self._next][2] is None:
+                raise ConnectionError(f"{path} has no recorded response for {request.method} request #{self._next + 1}")
+            sent_at, head_at, head, chunks = exchanges[self._next]
+            self._next += 1
+            if speed > 0:
+                time.sleep((head_at - sent_at) / speed)
+            response = Response()
+            response.status_code = head["status"]
+            response.reason = head["reason"]
+            response.headers = CaseInsensitiveDict(head["headers"])
+            response.encoding = get_encoding_from_headers(response.headers)
+            response.raw = _ReplayBody(chunks, head_at, speed)
+            response.url = request.url
+            response.request = request
+            response.connection = self
+            return response
+
+        def close(self):
+            pass
+
+    return ReplayAdapter()
+
+
+def mount(session, device: str) -> None:
+    """Record a requests.Session (SESSION_CAPTURE_DIR) or answer it from a capture (SESSION_REPLAY_FILE)."""
+    if SESSION_REPLAY_FILE:
+        adapter = _replay_adapter(SESSION_REPLAY_FILE, SESSION_REPLAY_SPEED)
+    elif SESSION_CAPTURE_DIR:
+        adapter = _capture_adapter(Recorder(capture_path(device, "http"), "http", device))
+    else:
+        return
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
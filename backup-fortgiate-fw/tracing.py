@@ -0,0 +1,264 @@
+"""Lightweight tracing for backup runs.
+
+Each run is one trace: a root span (`backup_run`) with child spans for connect, auth,
+commands, cloud upload, retention, ... Finished spans are kept in memory and handed
+over together when the root span ends, to a background exporter thread (a slow
+collector must not stretch the run, or hold up a fleet worker):
+
+- TRACE_EXPORTER=jsonl: one JSON object per span appended to TRACE_FILE
+- TRACE_EXPORTER=otlp:  OTLP/HTTP JSON POST to OTEL_EXPORTER_OTLP_ENDPOINT/v1/traces
+  (an OpenTelemetry Collector, Jaeger or Tempo)
+
+Export is off by default. Spans are only collected when an exporter is configured or a
+listener is registered (`add_listener`, e.g. the in-process run history); otherwise
+`span()` is a no-op. Export and listener errors are logged, never raised. Traces that
+find the export queue full are dropped; queued ones are flushed at process exit.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+import requests
+
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "").lower()
+TRACE_FILE = os.environ.get("TRACE_FILE", "backup_traces.jsonl")
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318").rstrip("/")
+# Milliseconds, as in the OpenTelemetry SDK environment spec.
+OTLP_TIMEOUT = float(os.environ.get("OTEL_EXPORTER_OTLP_TIMEOUT", "10000")) / 1000
+# Finished traces waiting for the exporter thread.
+TRACE_QUEUE_SIZE = max(1, int(os.environ.get("TRACE_QUEUE_SIZE", "1000")))
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME") or os.path.splitext(os.path.basename(sys.argv[0] or ""))[0] or "network-backup"
+
+logger = logging.getLogger(__name__)
+
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_file_lock = threading.Lock()
+# Called with the finished spans of every trace (root span last).
+_listeners: List[Callable[[List["Span"]], None]] = []
+_export_queue: "queue.Queue[List[Span]]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+_exporter_lock = threading.Lock()
+_exporter: Optional[threading.Thread] = None
+# Traces queued or being exported; flush() waits for it to reach 0.
+_unexported = 0
+_exported = threading.Condition()
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "error", "_finished")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: dict, finished: List["Span"]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.error = False
+        self._finished = finished
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "service": SERVICE_NAME,
+            "start_time": self.start_ns / 1e9,
+            "end_time": self.end_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "error" if self.failed else "ok",
+            "attributes": self.attributes,
+        }
+
+    @property
+    def failed(self) -> bool:
+        return self.error or "error_type" in self.attributes
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def set_attributes(self, **attributes) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def enabled() -> bool:
+    return TRACE_EXPORTER in ("jsonl", "otlp")
+
+
+def add_listener(listener: Callable[[List["Span"]], None]) -> None:
+    """Call `listener(spans)` with every finished trace, whether or not it is exported."""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Time a block as a span, child of the current span (or the root of a new trace).
+    An exception escaping the block marks the span as failed and is re-raised.
+    """
+    if not enabled() and not _listeners:
+        yield _NOOP
+        return
+    parent = _current.get()
+    if parent is None:
+        s = Span(name, secrets.token_hex(16), None, attributes, [])
+    else:
+        s = Span(name, parent.trace_id, parent.span_id, attributes, parent._finished)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = True
+        s.attributes.setdefault("exception.type", type(e).__name__)
+        s.attributes.setdefault("exception.message", str(e)[:500])
+        raise
+    finally:
+        _current.reset(token)
+        s.end_ns = time.time_ns()
+        s._finished.append(s)
+        if parent is None:
+            _finish_trace(s._finished)
+
+
+def current_span():
+    """The active span, or a no-op span when tracing is off or outside a trace."""
+    return _current.get() or _NOOP
+
+
+def set_attribute(key: str, value) -> None:
+    """Set an attribute (e.g. error_type, bytes) on the active span."""
+    current_span().set_attribute(key, value)
+
+
+def _finish_trace(spans: List[Span]) -> None:
+    for listener in list(_listeners):
+        try:
+            listener(spans)
+        except Exception:
+            logger.exception("Trace listener %r failed", listener)
+    if enabled():
+        _submit(spans)
+
+
+def _submit(spans: List[Span]) -> None:
+    global _exporter, _unexported
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = threading.Thread(target=_export_loop, name="trace-exporter", daemon=True)
+            _exporter.start()
+    with _exported:
+        _unexported += 1
+    try:
+        _export_queue.put_nowait(spans)
+    except queue.Full:
+        _exported_some(1)
+        logger.warning("Trace export queue full (TRACE_QUEUE_SIZE=%d), dropping the %s trace", TRACE_QUEUE_SIZE, spans[-1].name)
+
+
+def _export_loop() -> None:
+    while True:
+        traces = [_export_queue.get()]
+        # Everything already queued goes out in one write / one request.
+        while True:
+            try:
+                traces.append(_export_queue.get_nowait())
+            except queue.Empty:
+                break
+        export([s for spans in traces for s in spans])
+        _exported_some(len(traces))
+
+
+def _exported_some(count: int) -> None:
+    global _unexported
+    with _exported:
+        _unexported -= count
+        _exported.notify_all()
+
+
+def flush(timeout: float = None) -> bool:
+    """Wait until the queued traces are exported, at most `timeout` seconds (default OTLP_TIMEOUT); at exit."""
+    deadline = time.monotonic() + (OTLP_TIMEOUT if timeout is None else timeout)
+    with _exported:
+        while _unexported:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning("%d trace(s) still unexported at exit", _unexported)
+                return False
+            _exported.wait(remaining)
+    return True
+
+
+# Registered at import, before metrics_flusher's stop(), so it runs after it and also
+# exports the final metrics_push trace.
+atexit.register(flush)
+
+
+def export(spans: List[Span]) -> None:
+    """Write finished spans (one or more traces) to the configured exporter."""
+    try:
+        if TRACE_EXPORTER == "jsonl":
+            lines = "".join(json.dumps(s.to_dict(), default=str, separators=(",", ":")) + "\n" for s in spans)
+            with _file_lock:
+                with open(TRACE_FILE, "a") as f:
+                    f.write(lines)
+        elif TRACE_EXPORTER == "otlp":
+            response = requests.post(f"{OTLP_ENDPOINT}/v1/traces", json=_otlp_payload(spans), timeout=OTLP_TIMEOUT)
+            response.raise_for_status()
+    except (OSError, requests.RequestException) as e:
+        logger.warning("Could not export trace (%s): %s", TRACE_EXPORTER, e)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(spans: List[Span]) -> dict:
+    otlp_spans = []
+    for s in spans:
+        otlp_span = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+            "status": {"code": 2 if s.failed else 1},  # STATUS_CODE_ERROR / STATUS_CODE_OK
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "network-backup"}, "spans": otlp_spans}],
+        }]
+    }
@@ -0,0 +1,422 @@
+"""Streaming transforms between a collector and its backup file.
+
+The collector pushes the device output into a `Pipeline` chunk by chunk, as it
+arrives. Each stage hands its output to the next, and the last one writes the file,
+so every byte is touched once and nothing is held beyond a partial line:
+
+- normalize – vendor clean-up: FortiOS pager prompts removed; Junos whitespace
+  collapsed and blank lines dropped
+- redact – passwords, keys and secrets masked (BACKUP_REDACT_SECRETS=true)
+- compress – gzip (BACKUP_COMPRESSION=gzip; the file gets a `.gz` suffix, see output_path())
+- hash – SHA-256 plus the provider-native checksum (checksum.Hasher), of the bytes stored
+- write – the file itself
+
+Every stage counts the bytes it was given and the time it spent. When the pipeline is
+closed, they go to `*_transform_bytes_total` / `*_transform_seconds_total{stage}` and, as
+`<stage>_seconds`, onto the active trace span. The digests are recorded for cloud_upload
+(checksum.record()), which uploads the file without reading it for hashing again.
+
+With BACKUP_OFFLOAD_WORKERS (offload.py), open_backup() returns a SpooledPipeline
+instead: the output is spooled to a temp file while it arrives and goes through the
+same stages when it is complete, in a worker process if it is large, so the regex
+and compression work does not hold the GIL in the collector's process.
+"""
+import os
+import re
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+import xml.parsers.expat as expat
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import checksum
+import metrics
+import offload
+import tracing
+
+# Mask secrets (encrypted passwords, pre-shared keys, ...) in the saved configuration.
+# A redacted backup documents the device but cannot be restored as is.
+BACKUP_REDACT_SECRETS = os.environ.get("BACKUP_REDACT_SECRETS", "false").lower() == "true"
+# "gzip" to store backups compressed (configurations shrink about 10x).
+BACKUP_COMPRESSION = os.environ.get("BACKUP_COMPRESSION", "").lower()
+BACKUP_COMPRESSION_LEVEL = int(os.environ.get("BACKUP_COMPRESSION_LEVEL", "6"))
+
+_REDACTED = b"<redacted>"
+
+
+class Stage:
+    """One step of a Pipeline: bytes in, bytes out. `finish()` returns what is still held back."""
+
+    name = "stage"
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def process(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _Lines(Stage):
+    """A stage that works on whole lines (or elements): the incomplete tail waits for the next chunk."""
+
+    boundary = b"\n"
+
+    def __init__(self):
+        super().__init__()
+        self._tail = b""
+
+    def process(self, data: bytes) -> bytes:
+        data = self._tail + data
+        cut = self._cut(data)
+        self._tail = data[cut:]
+        return self.transform(data[:cut]) if cut else b""
+
+    def finish(self) -> bytes:
+        data, self._tail = self._tail, b""
+        return self.transform(data) if data else b""
+
+    def _cut(self, data: bytes) -> int:
+        return data.rfind(self.boundary) + 1
+
+    def transform(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class FortiosNormalize(_Lines):
+    """Removes `--More--` pager prompts, also when a prompt arrives split across two chunks."""
+
+    name = "normalize"
+
+    def transform(self, data: bytes) -> bytes:
+        return data.replace(b"--More--", b"")
+
+
+class JunosNormalize(_Lines):
+    """Collapses runs of spaces, strips every line and drops blank lines."""
+
+    name = "normalize"
+    _spaces = re.compile(rb"  +")
+
+    def transform(self, data: bytes) -> bytes:
+        lines = [line.strip() for line in self._spaces.sub(b" ", data).split(b"\n")]
+        return b"\n".join([line for line in lines if line] + [b""]) if any(lines) else b""
+
+
+class Redact(_Lines):
+    """
+    Replaces the secret in every match of `pattern` (its `secret` group) with <redacted>.
+    For XML, `boundary` is the end of a tag and `open_tag` matches the start of a secret
+    element, so an element split across chunks is held back until it is complete.
+    """
+
+    name = "redact"
+
+    def __init__(self, pattern: "re.Pattern", boundary: bytes = b"\n", open_tag: Optional["re.Pattern"] = None):
+        super().__init__()
+        self._pattern = pattern
+        self.boundary = boundary
+        self._open_tag = open_tag
+
+    def _cut(self, data: bytes) -> int:
+        cut = data.rfind(self.boundary) + 1
+        if self._open_tag is not None and cut:
+            last = None
+            for last in self._open_tag.finditer(data, 0, cut):
+                pass
+            if last is not None and data.find(b"</" + last.group(1) + b">", last.end(), cut) < 0:
+                cut = last.start()
+        return cut
+
+    def _mask(self, match: "re.Match") -> bytes:
+        start, end = match.span("secret")
+        return match.group(0)[:start - match.start()] + _REDACTED + match.group(0)[end - match.start():]
+
+    def transform(self, data: bytes) -> bytes:
+        return self._pattern.sub(self._mask, data)
+
+
+# FortiOS stores every secret as `set <name> ENC <ciphertext>`.
+_FORTIOS_SECRET = re.compile(rb" ENC (?P<secret>\S+)")
+# Junos shows secrets only hashed ($1$, $5$, $6$) or encrypted ($9$), always quoted.
+_JUNOS_SECRET = re.compile(rb'(?P<secret>"\$[1569]\$[^"]*")')
+_PANOS_SECRET_TAGS = rb"phash|password|private-key|key|secret|authentication-key|pre-shared-key"
+_PANOS_SECRET = re.compile(rb"<(" + _PANOS_SECRET_TAGS + rb")>(?P<secret>[^<]+)</\1>")
+_PANOS_OPEN = re.compile(rb"<(" + _PANOS_SECRET_TAGS + rb")>")
+
+
+def redact_stage(vendor: str) -> Redact:
+    """The secret-masking stage for `vendor` (fortios, junos or panos)."""
+    if vendor == "fortios":
+        return Redact(_FORTIOS_SECRET)
+    if vendor == "junos":
+        return Redact(_JUNOS_SECRET)
+    if vendor == "panos":
+        return Redact(_PANOS_SECRET, boundary=b">", open_tag=_PANOS_OPEN)
+    raise ValueError(f"unknown vendor {vendor!r}")
+
+
+class Gzip(Stage):
+    """gzip-compresses the stream (no timestamp in the header, so equal input gives an equal file)."""
+
+    name = "compress"
+
+    def __init__(self, level: int = BACKUP_COMPRESSION_LEVEL):
+        super().__init__()
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class Hash(Stage):
+    """Hashes what passes through (checksum.Hasher) and passes it on unchanged."""
+
+    name = "hash"
+
+    def __init__(self, hasher: checksum.Hasher):
+        super().__init__()
+        self.hasher = hasher
+
+    def process(self, data: bytes) -> bytes:
+        self.hasher.update(data)
+        return data
+
+
+class WriteFile(Stage):
+    """Writes the stream to `path`; the end of every pipeline."""
+
+    name = "write"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.file = open(path, "wb")
+
+    def process(self, data: bytes) -> bytes:
+        self.file.write(data)
+        return b""
+
+
+_NORMALIZERS = {"fortios": FortiosNormalize, "junos": JunosNormalize}
+
+
+class Pipeline:
+    """
+    Stages from `vendor`'s normalizer to the file at `path`; a drop-in for
+    checksum.HashingWriter (write(), flush(), close(), digests(), bytes_written).
+    """
+
+    def __init__(self, path: str, vendor: str, encoding: str = "utf-8", redact: Optional[bool] = None):
+        self.path = path
+        self.encoding = encoding
+        stages: List[Stage] = []
+        if vendor in _NORMALIZERS:
+            stages.append(_NORMALIZERS[vendor]())
+        if BACKUP_REDACT_SECRETS if redact is None else redact:
+            stages.append(redact_stage(vendor))
+        if path.endswith(".gz"):
+            stages.append(Gzip())
+        self._hash = Hash(checksum.native_hasher())
+        self._write = WriteFile(path)
+        self.stages = stages + [self._hash, self._write]
+
+    @property
+    def bytes_written(self) -> int:
+        return self._write.bytes_in
+
+    def write(self, data) -> int:
+        """Push a chunk (text, encoded as `encoding`, or bytes) through the stages."""
+        self._push(data.encode(self.encoding, errors="replace") if isinstance(data, str) else data, 0)
+        return len(data)
+
+    def _push(self, data: bytes, first: int) -> None:
+        for stage in self.stages[first:]:
+            if not data:
+                return
+            start = time.perf_counter()
+            stage.bytes_in += len(data)
+            data = stage.process(data)
+            stage.bytes_out += len(data)
+            stage.seconds += time.perf_counter() - start
+
+    def flush(self) -> None:
+        self._write.file.flush()
+
+    def close(self) -> None:
+        if self._write.file.closed:
+            return
+        self.finish()
+        _report(self.path, self.stats(), self.digests())
+
+    def finish(self) -> None:
+        """Flush what the stages hold back and close the file, without recording anything."""
+        for index, stage in enumerate(self.stages):
+            start = time.perf_counter()
+            data = stage.finish()
+            stage.bytes_out += len(data)
+            stage.seconds += time.perf_counter() - start
+            self._push(data, index + 1)
+        self._write.file.close()
+
+    def digests(self) -> Dict[str, str]:
+        return self._hash.hasher.digests()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """{stage: {bytes_in, bytes_out, seconds}}."""
+        return {stage.name: {"bytes_in": stage.bytes_in, "bytes_out": stage.bytes_out, "seconds": stage.seconds}
+                for stage in self.stages}
+
+    def __enter__(self) -> "Pipeline":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def _report(path: str, stats: Dict[str, Dict[str, float]], digests: Dict[str, str]) -> None:
+    checksum.record(path, digests)
+    for name, stage in stats.items():
+        metrics.record_transform(name, stage["bytes_in"], stage["seconds"])
+        tracing.set_attribute(f"{name}_seconds", stage["seconds"])
+
+
+# Read size when a spooled output is pushed through the stages.
+_SPOOL_CHUNK = 1 << 20
+
+
+def transform_file(source: str, path: str, vendor: str, redact: bool) -> Tuple[Dict[str, Dict[str, float]], Dict[str, str]]:
+    """Push the file `source` through `vendor`'s stages into `path`; returns (stats, digests). Offload task."""
+    pipeline = Pipeline(path, vendor, redact=redact)
+    try:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(_SPOOL_CHUNK), b""):
+                pipeline.write(chunk)
+    finally:
+        pipeline.finish()
+    return pipeline.stats(), pipeline.digests()
+
+
+class SpooledPipeline:
+    """
+    A Pipeline that runs its stages on close(), through offload.run(): in a worker
+    process when the output is at least BACKUP_OFFLOAD_MIN_BYTES, else inline. Until then
+    the output is spooled to a temp file, so memory stays flat as with Pipeline. Same
+    interface; stats(), digests() and bytes_written are known once it is closed.
+    """
+
+    def __init__(self, path: str, vendor: str, encoding: str = "utf-8"):
+        self.path = path
+        self.vendor = vendor
+        self.encoding = encoding
+        self._spool = tempfile.NamedTemporaryFile(prefix="backup-spool-", delete=False)
+        self._size = 0
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._digests: Dict[str, str] = {}
+
+    @property
+    def bytes_written(self) -> int:
+        return int(self._stats["write"]["bytes_in"]) if self._stats else 0
+
+    def write(self, data) -> int:
+        encoded = data.encode(self.encoding, errors="replace") if isinstance(data, str) else data
+        self._spool.write(encoded)
+        # offload.run() compares bytes with BACKUP_OFFLOAD_MIN_BYTES, not characters.
+        self._size += len(encoded)
+        return len(data)
+
+    def flush(self) -> None:
+        self._spool.flush()
+
+    def close(self) -> None:
+        if self._spool.closed:
+            return
+        self._spool.close()
+        try:
+            self._stats, self._digests = offload.run(transform_file, self._size, self._spool.name, self.path,
+                                                     self.vendor, BACKUP_REDACT_SECRETS)
+        finally:
+            os.remove(self._spool.name)
+        _report(self.path, self._stats, self._digests)
+
+    def digests(self) -> Dict[str, str]:
+        return dict(self._digests)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return self._stats
+
+    def __enter__(self) -> "SpooledPipeline":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def open_backup(path: str, vendor: str):
+    """
+    Open `path` for a `vendor` (fortios, junos, panos) configuration; gzip if it ends in
+    `.gz`. A Pipeline, or a SpooledPipeline when BACKUP_OFFLOAD_WORKERS is set.
+    """
+    if offload.BACKUP_OFFLOAD_WORKERS > 0:
+        return SpooledPipeline(path, vendor)
+    return Pipeline(path, vendor)
+
+
+def has_element(data: bytes, tags: Sequence[str]) -> bool:
+    """
+    Whether the XML document `data` has one of `tags` below its root element; raises
+    ET.ParseError if it is not well-formed. Offload task (offload.call()).
+    """
+    root = ET.fromstring(data)
+    return any(root.find(f".//{tag}") is not None for tag in tags)
+
+
+class XmlEnvelope:
+    """
+    has_element() for a document that arrives in chunks: feed() each one, then close()
+    returns whether one of `tags` occurred below the root element. Raises ET.ParseError,
+    as has_element(), once the document turns out not to be well-formed. Only the envelope
+    costs Python calls: once a tag is found, expat checks the rest on its own.
+    """
+
+    def __init__(self, tags: Sequence[str]):
+        self._tags = set(tags)
+        self._root = None
+        self.found = False
+        self._parser = expat.ParserCreate()
+        self._parser.StartElementHandler = self._start
+
+    def _start(self, name: str, attributes) -> None:
+        if self._root is None:
+            self._root = name
+        elif name in self._tags:
+            self.found = True
+            self._parser.StartElementHandler = None
+
+    def feed(self, data: bytes) -> None:
+        self._parse(data, False)
+
+    def close(self) -> bool:
+        self._parse(b"", True)
+        return self.found
+
+    def _parse(self, data: bytes, final: bool) -> None:
+        try:
+            self._parser.Parse(data, final)
+        except expat.ExpatError as e:
+            error = ET.ParseError(str(e))
+            error.code, error.position = e.code, (e.lineno, e.offset)
+            raise error from None
+
+
+def output_path(path: str) -> str:
+    """The file to write a backup for `path` to: with `.gz` appended when BACKUP_COMPRESSION=gzip."""
+    return path + ".gz" if BACKUP_COMPRESSION == "gzip" else path
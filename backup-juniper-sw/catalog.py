@@ -0,0 +1,176 @@
+"""SQLite catalog of backup runs.
+
+Every run adds one row to CATALOG_DB: device, vendor, start/end time, per-phase durations,
+bytes, config SHA-256, uploaded object and error_type. Rows are built from the run's
+trace (see run_history.summarize), so the collectors need no extra bookkeeping.
+With indexes on (device, started_at) and sha256, these questions take milliseconds
+instead of scraping Pushgateway or listing buckets:
+
+    python catalog.py last-good            # last successful backup per device
+    python catalog.py stale --hours 24     # devices without a good backup for 24h
+    python catalog.py changes <device>     # when the config hash changed
+
+The database uses WAL mode so several containers can share it on a local volume
+(not on NFS/SMB, where SQLite locking is unreliable). A failed write is logged and
+never fails the backup.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from typing import List, Optional
+
+import run_history
+import tracing
+
+# Set to an empty string to disable the catalog.
+CATALOG_DB = os.environ.get("CATALOG_DB", "backup_catalog.sqlite")
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    device      TEXT NOT NULL,
+    vendor      TEXT NOT NULL,
+    started_at  REAL NOT NULL,
+    ended_at    REAL NOT NULL,
+    success     INTEGER NOT NULL,
+    error_type  TEXT,
+    bytes       INTEGER,
+    sha256      TEXT,
+    provider    TEXT,
+    bucket      TEXT,
+    object_key  TEXT,
+    trace_id    TEXT,
+    phases      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_device_started ON runs (device, started_at);
+CREATE INDEX IF NOT EXISTS runs_sha256 ON runs (sha256);
+"""
+
+_vendor = "unknown"
+
+
+def enabled() -> bool:
+    return bool(CATALOG_DB)
+
+
+def connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """Open the catalog (creating schema and indexes on first use)."""
+    conn = sqlite3.connect(path or CATALOG_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def enable(vendor: str) -> None:
+    """Record every finished backup run of this process (no-op when CATALOG_DB is empty)."""
+    global _vendor
+    if not enabled():
+        return
+    _vendor = vendor
+    tracing.add_listener(record_trace)
+
+
+def record_trace(spans: List["tracing.Span"]) -> None:
+    """Trace listener: insert one row for a finished `backup_run` trace."""
+    record = run_history.summarize(spans)
+    if record is None:
+        return
+    upload = record["object"] or {}
+    row = (
+        record["device"], _vendor, record["timestamp"], record["end_timestamp"],
+        int(record["success"]), record["error_type"], record["bytes"], record["sha256"],
+        upload.get("provider"), upload.get("bucket"), upload.get("object"),
+        record["trace_id"], json.dumps(record["phases"], separators=(",", ":")),
+    )
+    try:
+        conn = connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO runs (device, vendor, started_at, ended_at, success, error_type, bytes, sha256,"
+                    " provider, bucket, object_key, trace_id, phases) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("Could not record run of %s in catalog %s: %s", record["device"], CATALOG_DB, e)
+
+
+def last_good(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+    """The last successful run per device."""
+    # SQLite returns the other columns from the row that holds MAX().
+    return conn.execute(
+        "SELECT device, vendor, MAX(started_at) AS started_at, ended_at, bytes, sha256, provider, bucket, object_key"
+        " FROM runs WHERE success = 1 GROUP BY device ORDER BY device"
+    ).fetchall()
+
+
+def stale(conn: sqlite3.Connection, max_age_seconds: float, now: Optional[float] = None) -> List[sqlite3.Row]:
+    """Devices whose last successful run is older than max_age_seconds (or that never had one)."""
+    cutoff = (now if now is not None else time.time()) - max_age_seconds
+    return conn.execute(
+        "SELECT device, MAX(CASE WHEN success = 1 THEN started_at END) AS last_success, MAX(started_at) AS last_run"
+        " FROM runs GROUP BY device HAVING last_success IS NULL OR last_success < ? ORDER BY last_success",
+        (cutoff,),
+    ).fetchall()
+
+
+def hash_changes(conn: sqlite3.Connection, device: str) -> List[sqlite3.Row]:
+    """Successful runs of `device` whose config hash differs from the previous successful run."""
+    return conn.execute(
+        "SELECT started_at, sha256, previous_sha256, object_key FROM ("
+        "  SELECT started_at, sha256, object_key,"
+        "         LAG(sha256) OVER (ORDER BY started_at) AS previous_sha256"
+        "  FROM runs WHERE device = ? AND success = 1 AND sha256 IS NOT NULL"
+        ") WHERE previous_sha256 IS NULL OR previous_sha256 != sha256 ORDER BY started_at",
+        (device,),
+    ).fetchall()
+
+
+def _format_time(timestamp: Optional[float]) -> str:
+    if timestamp is None:
+        return "never"
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=f"Query the backup catalog ({CATALOG_DB})")
+    parser.add_argument("--db", default=CATALOG_DB, help="catalog file (default: CATALOG_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("last-good", help="last successful backup per device")
+    stale_parser = commands.add_parser("stale", help="devices without a recent successful backup")
+    stale_parser.add_argument("--hours", type=float, default=24)
+    changes_parser = commands.add_parser("changes", help="when a device's config hash changed")
+    changes_parser.add_argument("device")
+    args = parser.parse_args(argv)
+
+    if not args.db or not os.path.exists(args.db):
+        print(f"❌ Catalog not found: {args.db!r}")
+        return 1
+    conn = connect(args.db)
+    try:
+        if args.command == "last-good":
+            for row in last_good(conn):
+                location = f"{row['provider']}://{row['bucket']}/{row['object_key']}" if row["object_key"] else "local only"
+                print(f"{row['device']:<24} {_format_time(row['started_at'])}  {(row['sha256'] or '-')[:12]}  {location}")
+        elif args.command == "stale":
+            for row in stale(conn, args.hours * 3600):
+                print(f"{row['device']:<24} last success: {_format_time(row['last_success'])}  last run: {_format_time(row['last_run'])}")
+        else:
+            for row in hash_changes(conn, args.device):
+                print(f"{_format_time(row['started_at'])}  {(row['previous_sha256'] or '-')[:12]} -> {row['sha256'][:12]}  {row['object_key'] or ''}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Single-pass checksums for backup files.
+
+Backups are hashed chunk by chunk as they go to disk, by `Hasher` (the hash stage of
+transform.py's pipeline, which the collectors write through) or `HashingWriter` (a
+plain file writer): SHA-256 always, plus the provider-native checksum needed for
+server-side verification (Content-MD5 for S3/Azure, CRC32C for GCS). The digests
+are kept per file path so `cloud_upload` can send them without reading the file
+a second time.
+"""
+import base64
+import hashlib
+import os
+import threading
+from typing import Dict, Optional
+
+_lock = threading.Lock()
+# path -> (size, mtime_ns, digests) for files closed by HashingWriter (or passed to record())
+_digests: Dict[str, tuple] = {}
+
+
+class Hasher:
+    """SHA-256 of a byte stream, plus the optional provider-native checksums."""
+
+    def __init__(self, md5: bool = False, crc32c: bool = False):
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5(usedforsecurity=False) if md5 else None
+        if crc32c:
+            import google_crc32c  # installed with google-cloud-storage
+
+            self._crc32c = google_crc32c.Checksum()
+        else:
+            self._crc32c = None
+
+    def update(self, data: bytes) -> None:
+        self._sha256.update(data)
+        if self._md5 is not None:
+            self._md5.update(data)
+        if self._crc32c is not None:
+            self._crc32c.update(data)
+
+    def digests(self) -> Dict[str, str]:
+        """Return {'sha256': hex, 'md5': base64, 'crc32c': base64} for the bytes hashed so far."""
+        result = {'sha256': self._sha256.hexdigest()}
+        if self._md5 is not None:
+            result['md5'] = base64.b64encode(self._md5.digest()).decode('ascii')
+        if self._crc32c is not None:
+            result['crc32c'] = base64.b64encode(self._crc32c.digest()).decode('ascii')
+        return result
+
+
+def native_hasher() -> Hasher:
+    """A Hasher with the native checksum of whichever cloud provider is enabled."""
+    import cloud_upload
+
+    return Hasher(md5=cloud_upload.USE_AWS or cloud_upload.USE_AZURE, crc32c=cloud_upload.USE_GCP)
+
+
+class HashingWriter:
+    """Text file writer that hashes the encoded bytes while writing them."""
+
+    def __init__(self, path: str, md5: bool = False, crc32c: bool = False, encoding: str = 'utf-8',
+                 hasher: Optional[Hasher] = None):
+        self.path = path
+        self.encoding = encoding
+        self.bytes_written = 0
+        self._hasher = hasher or Hasher(md5, crc32c)
+        self._f = open(path, 'wb')
+
+    def write(self, text: str) -> int:
+        self.write_bytes(text.encode(self.encoding, errors='replace'))
+        return len(text)
+
+    def write_bytes(self, data: bytes) -> None:
+        self._hasher.update(data)
+        self._f.write(data)
+        self.bytes_written += len(data)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        self._f.close()
+        record(self.path, self.digests())
+
+    def digests(self) -> Dict[str, str]:
+        """Return {'sha256': hex, 'md5': base64, 'crc32c': base64} for the bytes written so far."""
+        return self._hasher.digests()
+
+    def __enter__(self) -> "HashingWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def open_backup(path: str) -> HashingWriter:
+    """Open `path` for writing, computing the native checksum of whichever cloud provider is enabled."""
+    return HashingWriter(path, hasher=native_hasher())
+
+
+def record(path: str, digests: Dict[str, str]) -> None:
+    """Remember the digests of `path`, just written and closed, for digests_for()."""
+    st = os.stat(path)
+    with _lock:
+        _digests[os.path.abspath(path)] = (st.st_size, st.st_mtime_ns, digests)
+
+
+def digests_for(path: str) -> Optional[Dict[str, str]]:
+    """
+    Return the digests recorded when `path` was written, or None if the file was not
+    written by HashingWriter or has changed since (size or mtime differ).
+    """
+    with _lock:
+        recorded = _digests.get(os.path.abspath(path))
+    if recorded is None:
+        return None
+    size, mtime_ns, digests = recorded
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if st.st_size != size or st.st_mtime_ns != mtime_ns:
+        return None
+    return digests
+
+
+def forget(path: str) -> None:
+    """Drop recorded digests for `path` (e.g. after the local file was uploaded and removed)."""
+    with _lock:
+        _digests.pop(os.path.abspath(path), None)
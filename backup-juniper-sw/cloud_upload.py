@@ -1,10 +1,15 @@
 """Upload backup file to AWS S3, Azure Blob Storage, or GCP Cloud Storage."""
+import base64
 import os
 import json
 import logging
 import time
 from typing import Optional, Tuple
 
+import checksum
+import manifest
+import tracing
+
 USE_AWS = os.environ.get('aws', 'false').lower() == 'true'
 USE_AZURE = os.environ.get('azure', 'false').lower() == 'true'
 USE_GCP = os.environ.get('gcp', 'false').lower() == 'true'
@@ -13,19 +18,104 @@ if USE_AWS:
     import boto3
 if USE_AZURE:
     from azure.identity import ClientSecretCredential, DefaultAzureCredential
-    from azure.storage.blob import BlobServiceClient
+    from azure.storage.blob import BlobServiceClient, ContentSettings
 if USE_GCP:
     from google.cloud import storage
 
 logger = logging.getLogger(__name__)
 
+# Files up to this size go to S3 in a single PutObject so Content-MD5 can be verified server-side
+# (same as boto3's default multipart threshold; larger files use upload_file, each part with
+# a SHA-256 that S3 verifies).
+S3_SINGLE_PUT_MAX_BYTES = 8 * 1024 * 1024
+
+
+def s3_client():
+    """Return an S3 client using explicit keys if set, otherwise the default credential chain."""
+    access_key = os.environ.get('AWS_ACCESS_KEY_ID')
+    secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
+    if access_key and secret_key:
+        return boto3.client(
+            's3',
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+        )
+    # Fall back to default credentials (e.g. IAM role / IRSA / env / shared config)
+    return boto3.client('s3')
+
 
-def upload_backup(backup_file: str, folder_prefix: str) -> Tuple[bool, float, Optional[str]]:
+def azure_container_client(container_name: str):
+    """Return an Azure ContainerClient for AZURE_STORAGE_ACCOUNT using a client secret or default credential.
+
+    AZURE_STORAGE_CONNECTION_STRING, if set, is used instead (shared key; e.g. Azurite or another
+    local Blob endpoint for testing).
+    """
+    connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')
+    if connection_string:
+        return BlobServiceClient.from_connection_string(connection_string).get_container_client(container_name)
+    account = os.environ.get('AZURE_STORAGE_ACCOUNT')
+    tenant_id = os.environ.get('AZURE_TENANT_ID')
+    client_id = os.environ.get('AZURE_CLIENT_ID')
+    client_secret = os.environ.get('AZURE_CLIENT_SECRET')
+    if tenant_id and client_id and client_secret:
+        credential = ClientSecretCredential(
+            tenant_id=tenant_id,
+            client_id=client_id,
+            client_secret=client_secret,
+        )
+    else:
+        # Fall back to default Azure credential (Managed Identity / federated SA / env)
+        credential = DefaultAzureCredential()
+    account_url = f"https://{account}.blob.core.windows.net"
+    blob_service = BlobServiceClient(account_url=account_url, credential=credential)
+    return blob_service.get_container_client(container_name)
+
+
+def gcs_client():
+    """Return a GCS client from GCP_APPLICATION_CREDENTIALS (file path or raw JSON) or default credentials."""
+    creds_value = os.environ.get('GCP_APPLICATION_CREDENTIALS') or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+    if creds_value:
+        # First, treat value as a path to a JSON file (Docker / volume / Secret volume)
+        if os.path.isfile(creds_value):
+            return storage.Client.from_service_account_json(creds_value)
+        # Otherwise, treat value as raw JSON content from env (e.g. K8s Secret -> env)
+        return storage.Client.from_service_account_info(json.loads(creds_value))
+    # Fall back to default credentials (e.g. GKE Workload Identity / node SA)
+    return storage.Client()
+
+
+def _record_manifest(device: Optional[str], provider: str, bucket: str, object_name: str, file_size: int, digests: Optional[dict]) -> None:
+    """Append the uploaded object to the manifest index; a failure here never fails the upload."""
+    try:
+        with tracing.span("manifest_record"):
+            manifest.record_upload(device or 'unknown', provider, bucket, object_name, file_size, checksums=digests)
+    except OSError as e:
+        logger.warning("Could not record %s in manifest %s: %s", object_name, manifest.MANIFEST_FILE, e)
+
+
+def upload_backup(backup_file: str, folder_prefix: str, device: Optional[str] = None,
+                  track: bool = True) -> Tuple[bool, float, Optional[str]]:
     """
     Upload backup file to cloud (AWS S3, Azure, or GCP).
     Returns (success, file_size, error_type).
-    On success, deletes the local file. On failure, error_type is set.
+    If the file was written through transform.Pipeline (or checksum.HashingWriter), its SHA-256 is
+    stored as object metadata and the provider-native checksum (Content-MD5 / CRC32C) is sent for
+    server-side verification, without re-reading the file. Where that checksum cannot cover the
+    upload (S3 multipart, Azure blocks), the SDK sends per-request checksums instead.
+    On success, records the object in the manifest index (unless track=False, e.g. for files
+    that are not backups and must not be seen by retention) and deletes the local file.
+    On failure, error_type is set.
     """
+    provider = 'aws' if USE_AWS else 'azure' if USE_AZURE else 'gcp' if USE_GCP else None
+    with tracing.span("cloud_upload", provider=provider, file=backup_file) as span:
+        success, file_size, error_type = _upload_backup(backup_file, folder_prefix, device, track)
+        span.set_attributes(bytes=int(file_size), success=success)
+        if error_type:
+            span.set_attribute("error_type", error_type)
+    return success, file_size, error_type
+
+
+def _upload_backup(backup_file: str, folder_prefix: str, device: Optional[str], track: bool) -> Tuple[bool, float, Optional[str]]:
     if not USE_AWS and not USE_AZURE and not USE_GCP:
         return False, 0.0, None
 
@@ -33,33 +123,44 @@ def upload_backup(backup_file: str, folder_prefix: str) -> Tuple[bool, float, Op
         return False, 0.0, 'file_not_found'
 
     base_name, ext = os.path.splitext(os.path.basename(backup_file))
+    if ext == '.gz':
+        # Compressed backups (transform.py) keep their own extension: name_<date>_<time>.conf.gz
+        base_name, inner_ext = os.path.splitext(base_name)
+        ext = inner_ext + ext
     date_part = time.strftime("%Y-%m-%d")
     time_part = time.strftime("%H%M%S")
     object_name = f"{folder_prefix}/{base_name}_{date_part}_{time_part}{ext}"
     file_size = os.path.getsize(backup_file)
+    digests = checksum.digests_for(backup_file)
+    metadata = {'sha256': digests['sha256']} if digests else None
+    tracing.set_attribute("object", object_name)
+    if digests:
+        tracing.set_attribute("sha256", digests['sha256'])
 
     if USE_AWS:
         bucket = os.environ.get('BUCKET_NAME')
         if not bucket:
             return False, 0.0, 'missing_bucket_name'
+        tracing.set_attribute("bucket", bucket)
         try:
-            access_key = os.environ.get('AWS_ACCESS_KEY_ID')
-            secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
-            if access_key and secret_key:
-                s3 = boto3.client(
-                    's3',
-                    aws_access_key_id=access_key,
-                    aws_secret_access_key=secret_key,
-                )
+            s3 = s3_client()
+            if digests and 'md5' in digests and file_size <= S3_SINGLE_PUT_MAX_BYTES:
+                with open(backup_file, 'rb') as f:
+                    s3.put_object(Bucket=bucket, Key=object_name, Body=f, ContentMD5=digests['md5'], Metadata=metadata)
             else:
-                # Fall back to default credentials (e.g. IAM role / IRSA / env / shared config)
-                s3 = boto3.client('s3')
-            s3.upload_file(backup_file, bucket, object_name)
+                # Multipart: S3 checks each part against its SHA-256, computed by the SDK as it sends.
+                extra_args = {'ChecksumAlgorithm': 'SHA256'}
+                if metadata:
+                    extra_args['Metadata'] = metadata
+                s3.upload_file(backup_file, bucket, object_name, ExtraArgs=extra_args)
             logger.info("Backup file %s uploaded to AWS S3 bucket: %s", backup_file, bucket)
+            if track:
+                _record_manifest(device, 'aws', bucket, object_name, file_size, digests)
             try:
                 os.remove(backup_file)
             except OSError:
                 pass
+            checksum.forget(backup_file)
             return True, float(file_size), None
         except Exception as e:
             error_type = 's3_client_error' if 'client' in str(e).lower() else 'upload_error'
@@ -69,32 +170,28 @@ def upload_backup(backup_file: str, folder_prefix: str) -> Tuple[bool, float, Op
     if USE_AZURE:
         account = os.environ.get('AZURE_STORAGE_ACCOUNT')
         container_name = os.environ.get('AZURE_STORAGE_CONTAINER')
-        tenant_id = os.environ.get('AZURE_TENANT_ID')
-        client_id = os.environ.get('AZURE_CLIENT_ID')
-        client_secret = os.environ.get('AZURE_CLIENT_SECRET')
-        if not account or not container_name:
+        if not (account or os.environ.get('AZURE_STORAGE_CONNECTION_STRING')) or not container_name:
             return False, 0.0, 'missing_azure_config'
+        tracing.set_attribute("bucket", container_name)
         try:
-            if tenant_id and client_id and client_secret:
-                credential = ClientSecretCredential(
-                    tenant_id=tenant_id,
-                    client_id=client_id,
-                    client_secret=client_secret,
-                )
-            else:
-                # Fall back to default Azure credential (Managed Identity / federated SA / env)
-                credential = DefaultAzureCredential()
-            account_url = f"https://{account}.blob.core.windows.net"
-            blob_service = BlobServiceClient(account_url=account_url, credential=credential)
-            container_client = blob_service.get_container_client(container_name)
+            container_client = azure_container_client(container_name)
             blob_client = container_client.get_blob_client(object_name)
+            content_settings = None
+            if digests and 'md5' in digests:
+                # Stored as the blob's Content-MD5 property (not checked by the service on upload).
+                content_settings = ContentSettings(content_md5=bytearray(base64.b64decode(digests['md5'])))
             with open(backup_file, 'rb') as f:
-                blob_client.upload_blob(f, overwrite=True)
+                # validate_content: a transactional MD5 with every Put Blob / Put Block, checked by the service.
+                blob_client.upload_blob(f, overwrite=True, content_settings=content_settings, metadata=metadata,
+                                        validate_content=True)
             logger.info("Backup file %s uploaded to Azure Blob container: %s", backup_file, container_name)
+            if track:
+                _record_manifest(device, 'azure', container_name, object_name, file_size, digests)
             try:
                 os.remove(backup_file)
             except OSError:
                 pass
+            checksum.forget(backup_file)
             return True, float(file_size), None
         except Exception as e:
             error_type = 'azure_client_error' if 'credential' in str(e).lower() or 'blob' in str(e).lower() else 'upload_error'
@@ -105,43 +202,31 @@ def upload_backup(backup_file: str, folder_prefix: str) -> Tuple[bool, float, Op
         bucket_name = os.environ.get('GCP_BUCKET_NAME') or os.environ.get('GCS_BUCKET_NAME')
         if not bucket_name:
             return False, 0.0, 'missing_gcp_config'
+        tracing.set_attribute("bucket", bucket_name)
 
-        creds_value = os.environ.get('GCP_APPLICATION_CREDENTIALS') or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-
-        client = None
-        if creds_value:
-            # First, treat value as a path to a JSON file (Docker / volume / Secret volume)
-            if os.path.isfile(creds_value):
-                try:
-                    client = storage.Client.from_service_account_json(creds_value)
-                except Exception as e:
-                    logger.exception("GCP credentials (file) error: %s", e)
-                    return False, 0.0, 'gcp_client_error'
-            else:
-                # Otherwise, treat value as raw JSON content from env (e.g. K8s Secret -> env)
-                try:
-                    info = json.loads(creds_value)
-                    client = storage.Client.from_service_account_info(info)
-                except Exception as e:
-                    logger.exception("GCP credentials (JSON env) error: %s", e)
-                    return False, 0.0, 'gcp_client_error'
-        else:
-            # Fall back to default credentials (e.g. GKE Workload Identity / node SA)
-            try:
-                client = storage.Client()
-            except Exception as e:
-                logger.exception("GCP default credentials error: %s", e)
-                return False, 0.0, 'gcp_client_error'
+        try:
+            client = gcs_client()
+        except Exception as e:
+            logger.exception("GCP credentials error: %s", e)
+            return False, 0.0, 'gcp_client_error'
 
         try:
             bucket = client.bucket(bucket_name)
             blob = bucket.blob(object_name)
+            if digests and 'crc32c' in digests:
+                # Sent with the upload metadata; GCS rejects the object if the content doesn't match.
+                blob.crc32c = digests['crc32c']
+            if metadata:
+                blob.metadata = metadata
             blob.upload_from_filename(backup_file)
             logger.info("Backup uploaded to GCP bucket: %s", bucket_name)
+            if track:
+                _record_manifest(device, 'gcp', bucket_name, object_name, file_size, digests)
             try:
                 os.remove(backup_file)
             except OSError:
                 pass
+            checksum.forget(backup_file)
             return True, float(file_size), None
         except Exception as e:
             error_type = 'gcp_client_error' if 'google' in str(e).lower() or 'credentials' in str(e).lower() else 'upload_error'
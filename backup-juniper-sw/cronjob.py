@@ -3,19 +3,30 @@
 This module contains only the cron-loop logic. The actual backup work
 is implemented in `juniper-sw.run_backup_once`.
 """
+import functools
 import importlib.util
 import os
+import signal
 import sys
 import time
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Dict, List
 
-from croniter import croniter
+import admission
+import async_engine
+import inventory
+import metrics
+import retention
+import session_capture
+import ssh_session
+from scheduling import (CRONJOB_MAX_RUNTIME, SCHEDULER_ENGINE, SCHEDULER_STORE_WORKERS, SCHEDULER_WORKERS,
+                        WATCHDOG_EXIT_CODE, CronTicker, FleetScheduler, jitter_key, run_with_watchdog)
 
 
-def _load_run_backup_once():
+def _load_backup_module():
     """
-    Dynamically load run_backup_once from juniper-sw.py.
+    Dynamically load juniper-sw.py (run_backup_once, env_device).
 
     The file name uses a dash, so we can't use a normal Python import.
     """
@@ -27,10 +38,14 @@ def _load_run_backup_once():
     spec.loader.exec_module(module)
     if not hasattr(module, "run_backup_once"):
         raise AttributeError("juniper-sw.py does not define run_backup_once()")
-    return module.run_backup_once
+    return module
 
 
-run_backup_once = _load_run_backup_once()
+_backup_module = _load_backup_module()
+run_backup_once = _backup_module.run_backup_once
+backup_stages = _backup_module.backup_stages
+get_full_configuration_async = _backup_module.get_full_configuration_async
+env_device = _backup_module.env_device
 
 # CRON expression controlling when the backup runs.
 # Default: every 2 minutes.
@@ -90,9 +105,11 @@ def _describe_cron(expr: str) -> str:
 
 def run_cron_loop() -> None:
     """Run backup on a cron-like schedule controlled by env vars."""
+    if inventory.INVENTORY_FILE:
+        run_fleet_loop()
+        return
     try:
-        base = datetime.now(timezone.utc)
-        iterator = croniter(CRONJOB_SCHEDULE, base)
+        ticker = CronTicker(CRONJOB_SCHEDULE, jitter_key())
     except (ValueError, TypeError) as e:
         print(f"❌ Invalid CRONJOB_SCHEDULE '{CRONJOB_SCHEDULE}': {e}")
         print("   Falling back to a single run and exit.")
@@ -104,20 +121,114 @@ def run_cron_loop() -> None:
         f"ℹ️  CRONJOB_ENABLED=true. This Juniper cron job will run {desc} "
         f"(cron='{CRONJOB_SCHEDULE}'). Starting backup..."
     )
+    if ticker.jitter:
+        print(f"ℹ️  Runs start {ticker.jitter:.1f}s after each tick (jitter for '{jitter_key()}').")
     while True:
-        next_run = iterator.get_next(datetime)
-        now = datetime.now(timezone.utc)
-        sleep_seconds = (next_run - now).total_seconds()
-        if sleep_seconds > 0:
-            time.sleep(sleep_seconds)
+        lateness, coalesced = ticker.wait()
+        if coalesced:
+            print(f"⏩ {coalesced} missed tick(s) coalesced into this run ({lateness:.0f}s late).")
+            metrics.record_skipped_ticks('coalesced', coalesced)
 
         print(f"⏰ Running scheduled Juniper backup at {datetime.now(timezone.utc).isoformat()}")
-        success = run_backup_once()
+        success = run_with_watchdog(run_backup_once)
+        if success is None:
+            # The run is stuck in I/O and a thread cannot be cancelled: let the container restart.
+            print(f"❌ Scheduled Juniper backup still running after CRONJOB_MAX_RUNTIME={CRONJOB_MAX_RUNTIME:g}s. Exiting.")
+            sys.stdout.flush()
+            os._exit(WATCHDOG_EXIT_CODE)
         if success:
             print("✅ Scheduled Juniper backup completed successfully.")
         else:
             print("❌ Scheduled Juniper backup failed. See logs for details.")
 
+        overlapped = ticker.advance_past(time.time())
+        if overlapped:
+            print(f"⏭️  Skipped {overlapped} tick(s) that came due while the backup was still running.")
+            metrics.record_skipped_ticks('overlap', overlapped)
+
+
+def _describe_limit(limit: inventory.Limit) -> str:
+    parts = []
+    if limit.concurrency:
+        parts.append(f"{limit.concurrency} at a time")
+    if limit.rate:
+        parts.append(f"{limit.rate:g} start(s)/s, bursts of {limit.bucket}")
+    return ", ".join(parts) or "unlimited"
+
+
+def run_fleet_loop() -> None:
+    """Back up every device in INVENTORY_FILE on its own schedule (see inventory.py)."""
+    template = env_device()._replace(schedule=CRONJOB_SCHEDULE)
+    if SCHEDULER_ENGINE == "asyncio" and session_capture.SESSION_REPLAY_FILE:
+        # The asyncio collectors do not replay: they would back up the real devices instead.
+        print("❌ SESSION_REPLAY_FILE is not supported with SCHEDULER_ENGINE=asyncio; use the threads engine")
+        sys.exit(1)
+    if SCHEDULER_ENGINE == "asyncio" and session_capture.SESSION_CAPTURE_DIR:
+        print("⚠️  SESSION_CAPTURE_DIR is ignored with SCHEDULER_ENGINE=asyncio: sessions are not recorded")
+    admission_control = admission.Admission("juniper")
+    if SCHEDULER_ENGINE == "asyncio":
+        scheduler = FleetScheduler(functools.partial(backup_stages, collect=get_full_configuration_async),
+                                   admission=admission_control)
+    else:
+        scheduler = FleetScheduler(backup_stages, admission=admission_control)
+
+    def apply(new_devices: List[inventory.Device]) -> None:
+        admission_control.configure(watcher.limits)
+        added, removed, changed = scheduler.sync(new_devices)
+        for name in removed + changed:
+            ssh_session.discard(name)
+        if added or removed or changed:
+            print(f"🔄 Inventory reloaded: +{len(added)} -{len(removed)} ~{len(changed)} device(s), {len(new_devices)} scheduled")
+
+    watcher = inventory.InventoryWatcher(inventory.INVENTORY_FILE, template, on_change=apply)
+    try:
+        devices = watcher.load()
+    except inventory.InventoryError as e:
+        print(f"❌ Invalid INVENTORY_FILE: {e}")
+        sys.exit(1)
+    admission_control.configure(watcher.limits)
+
+    schedules: Dict[str, int] = {}
+    for device in devices:
+        scheduler.add(device)
+        schedules[device.schedule] = schedules.get(device.schedule, 0) + 1
+    if SCHEDULER_ENGINE == "asyncio":
+        concurrency = f"on one event loop, up to {async_engine.SCHEDULER_ASYNC_SESSIONS} at a time"
+    else:
+        concurrency = f"with up to {SCHEDULER_WORKERS} at a time"
+    print(
+        f"ℹ️  CRONJOB_ENABLED=true. Backing up {len(devices)} Juniper device(s) from {inventory.INVENTORY_FILE} "
+        f"{concurrency}:"
+    )
+    if SCHEDULER_STORE_WORKERS:
+        print(f"   Uploads run on {SCHEDULER_STORE_WORKERS} store worker(s) of their own, overlapping the next collections")
+    for schedule, count in sorted(schedules.items(), key=lambda item: -item[1]):
+        print(f"   {count:>5} device(s) {_describe_cron(schedule)} (cron='{schedule}')")
+    for kind, keys in sorted(watcher.limits.items()):
+        for key, limit in sorted(keys.items()):
+            print(f"   Limit {kind} {key}: {_describe_limit(limit)}")
+
+    if inventory.INVENTORY_RELOAD_INTERVAL > 0:
+        print(f"   Watching {inventory.INVENTORY_FILE} for changes every {inventory.INVENTORY_RELOAD_INTERVAL:g}s (SIGHUP reloads now)")
+    else:
+        print(f"   Reloading {inventory.INVENTORY_FILE} on SIGHUP only")
+    signal.signal(signal.SIGHUP, lambda signum, frame: watcher.trigger())
+    watcher.start()
+    if retention.RETENTION_ENABLED:
+        # Once per schedule for the whole fleet, not after every device's upload.
+        try:
+            retention.start_scheduled()
+        except (ValueError, TypeError) as e:
+            print(f"❌ Invalid RETENTION_SCHEDULE '{retention.RETENTION_SCHEDULE}': {e}")
+            sys.exit(1)
+        print(f"   Retention runs {_describe_cron(retention.RETENTION_SCHEDULE)} (RETENTION_SCHEDULE='{retention.RETENTION_SCHEDULE}')")
+
+    stuck = scheduler.run_forever()
+    # Same as single-device mode: a blocked run cannot be cancelled, so let the container restart.
+    print(f"❌ Juniper backup of {stuck} still running after CRONJOB_MAX_RUNTIME={CRONJOB_MAX_RUNTIME:g}s. Exiting.")
+    sys.stdout.flush()
+    os._exit(WATCHDOG_EXIT_CODE)
+
 
 if __name__ == "__main__":
     run_cron_loop()
@@ -0,0 +1,216 @@
+"""Grandfather-father-son retention for uploaded backups.
+
+Deletions are planned from the manifest index (`manifest.py`) instead of listing
+the bucket, and executed with each provider's bulk delete API (S3 DeleteObjects,
+Azure Blob batch, GCS batch requests).
+
+Run standalone (`python retention.py`) or set RETENTION_ENABLED=true to prune after
+every successful single-device run. In fleet mode every upload would re-plan the whole
+manifest and concurrent store workers would send the same deletes, so the fleet process
+prunes on RETENTION_SCHEDULE from a thread of its own instead (`start_scheduled`).
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Tuple
+
+import cloud_upload
+import manifest
+import scheduling
+import tracing
+
+RETENTION_ENABLED = os.environ.get("RETENTION_ENABLED", "false").lower() == "true"
+RETENTION_DRY_RUN = os.environ.get("RETENTION_DRY_RUN", "false").lower() == "true"
+# Keep every version for N days, then the newest per day, then the newest per calendar month.
+RETENTION_KEEP_ALL_DAYS = int(os.environ.get("RETENTION_KEEP_ALL_DAYS", "7"))
+RETENTION_DAILY_DAYS = int(os.environ.get("RETENTION_DAILY_DAYS", "90"))
+RETENTION_MONTHLY_MONTHS = int(os.environ.get("RETENTION_MONTHLY_MONTHS", "24"))
+# Fleet mode: when to prune (cron expression).
+RETENTION_SCHEDULE = os.environ.get("RETENTION_SCHEDULE", "30 4 * * *")
+
+# Maximum number of objects per bulk delete request for each provider.
+S3_DELETE_BATCH_SIZE = 1000
+AZURE_DELETE_BATCH_SIZE = 256
+GCS_DELETE_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def plan_retention(entries: List[dict], now: float = None) -> Tuple[List[dict], List[dict]]:
+    """
+    Split manifest entries into (keep, delete) using the GFS policy, per device and bucket.
+    The newest backup of every device is always kept, whatever its age.
+    """
+    now = time.time() if now is None else now
+    now_dt = datetime.fromtimestamp(now, timezone.utc)
+    now_month = now_dt.year * 12 + now_dt.month
+
+    groups: Dict[tuple, List[dict]] = defaultdict(list)
+    for entry in entries:
+        groups[(entry.get("provider"), entry.get("bucket"), entry.get("device"))].append(entry)
+
+    keep, delete = [], []
+    for group in groups.values():
+        group.sort(key=lambda e: float(e.get("timestamp", 0)), reverse=True)
+        seen_days, seen_months = set(), set()
+        for i, entry in enumerate(group):
+            ts = float(entry.get("timestamp", 0))
+            age_days = (now - ts) / 86400
+            dt = datetime.fromtimestamp(ts, timezone.utc)
+            day = dt.date()
+            month = dt.year * 12 + dt.month
+
+            if i == 0 or age_days <= RETENTION_KEEP_ALL_DAYS:
+                keeper = True
+            elif age_days <= RETENTION_DAILY_DAYS and day not in seen_days:
+                keeper = True
+            elif now_month - month < RETENTION_MONTHLY_MONTHS and month not in seen_months:
+                keeper = True
+            else:
+                keeper = False
+
+            # Newest-first order: the first entry seen for a day/month is the one that represents it.
+            seen_days.add(day)
+            seen_months.add(month)
+            (keep if keeper else delete).append(entry)
+    return keep, delete
+
+
+def _delete_s3(bucket: str, keys: List[str]) -> List[str]:
+    s3 = cloud_upload.s3_client()
+    deleted = []
+    for batch in _chunks(keys, S3_DELETE_BATCH_SIZE):
+        resp = s3.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True},
+        )
+        failed = set()
+        for err in resp.get('Errors', []):
+            failed.add(err.get('Key'))
+            logger.warning("S3 delete failed for %s: %s %s", err.get('Key'), err.get('Code'), err.get('Message'))
+        deleted.extend(k for k in batch if k not in failed)
+    return deleted
+
+
+def _delete_azure(container_name: str, keys: List[str]) -> List[str]:
+    container_client = cloud_upload.azure_container_client(container_name)
+    deleted = []
+    for batch in _chunks(keys, AZURE_DELETE_BATCH_SIZE):
+        responses = container_client.delete_blobs(*batch, raise_on_any_failure=False)
+        for key, resp in zip(batch, responses):
+            # 404: already gone, drop it from the manifest as well.
+            if resp.status_code in (202, 404):
+                deleted.append(key)
+            else:
+                logger.warning("Azure delete failed for %s: HTTP %s", key, resp.status_code)
+    return deleted
+
+
+def _delete_gcs(bucket_name: str, keys: List[str]) -> List[str]:
+    from google.api_core.exceptions import GoogleAPICallError, NotFound
+
+    client = cloud_upload.gcs_client()
+    bucket = client.bucket(bucket_name)
+    deleted = []
+    for batch in _chunks(keys, GCS_DELETE_BATCH_SIZE):
+        try:
+            with client.batch():
+                for key in batch:
+                    bucket.delete_blob(key)
+            deleted.extend(batch)
+            continue
+        except GoogleAPICallError as e:
+            # A batch only reports one of its failures: find out which objects are left, one by one.
+            logger.info("GCS batch delete in %s had failures (%s), deleting its objects one by one", bucket_name, e)
+        for key in batch:
+            try:
+                bucket.delete_blob(key)
+            except NotFound:
+                pass  # already gone (e.g. by the batch), drop it from the manifest as well
+            except GoogleAPICallError as e:
+                logger.warning("GCS delete failed for %s: %s", key, e)
+                continue
+            deleted.append(key)
+    return deleted
+
+
+_DELETERS = {
+    'aws': _delete_s3,
+    'azure': _delete_azure,
+    'gcp': _delete_gcs,
+}
+
+
+def run_retention() -> bool:
+    """Plan from the manifest and bulk-delete expired backups. Returns False if any batch failed."""
+    with tracing.span("retention"):
+        return _run_retention()
+
+
+def start_scheduled(schedule: str = RETENTION_SCHEDULE) -> None:
+    """Fleet mode: run retention on `schedule` from a background thread, one run at a time."""
+    ticker = scheduling.CronTicker(schedule, "retention")
+
+    def loop() -> None:
+        while True:
+            ticker.wait()
+            try:
+                run_retention()
+            except Exception as e:
+                logger.exception("Scheduled retention failed: %s", e)
+
+    threading.Thread(target=loop, name="backup-retention", daemon=True).start()
+
+
+def _run_retention() -> bool:
+    entries = manifest.load_entries()
+    keep, delete = plan_retention(entries)
+    print(f"🗂️  Retention: {len(entries)} objects in manifest, keeping {len(keep)}, expiring {len(delete)}")
+    if not delete:
+        return True
+    if RETENTION_DRY_RUN:
+        for entry in delete:
+            print(f"   (dry run) would delete {entry.get('provider')}://{entry.get('bucket')}/{entry.get('key')}")
+        return True
+
+    by_target: Dict[tuple, List[str]] = defaultdict(list)
+    for entry in delete:
+        by_target[(entry.get("provider"), entry.get("bucket"))].append(entry.get("key"))
+
+    ok = True
+    removed = []
+    for (provider, bucket), keys in by_target.items():
+        deleter = _DELETERS.get(provider)
+        if deleter is None:
+            logger.warning("Retention: unknown provider %r in manifest, skipping %d objects", provider, len(keys))
+            ok = False
+            continue
+        try:
+            with tracing.span("retention_delete", provider=provider, bucket=bucket, objects=len(keys)) as span:
+                deleted = deleter(bucket, keys)
+                span.set_attribute("deleted", len(deleted))
+        except Exception as e:
+            logger.exception("Retention delete on %s://%s failed: %s", provider, bucket, e)
+            ok = False
+            continue
+        if len(deleted) != len(keys):
+            ok = False
+        removed.extend((provider, bucket, key) for key in deleted)
+        print(f"✅ Retention: deleted {len(deleted)}/{len(keys)} objects from {provider}://{bucket}")
+
+    manifest.remove_keys(removed)
+    return ok
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    sys.exit(0 if run_retention() else 1)
@@ -0,0 +1,189 @@
+"""In-process history of recent backup runs, for debugging a long-running collector.
+
+Each finished `backup_run` trace (see tracing.py) is summarised into one record: per-phase
+timings, bytes, sha256, error_type and retry count (the `retries` span attributes: a stale
+pooled SSH session reconnected; None when the run's collector has no retry path, e.g.
+PAN-OS). The last RUN_HISTORY_SIZE records are kept per device in a ring buffer.
+p50/p95/p99 per phase are estimated incrementally with the P² algorithm (five markers per
+quantile, O(1) memory), so they cover every run since start-up, not just the ones still
+in the buffer.
+
+`snapshot()` is served as JSON on /debug/runs next to /metrics (cron mode).
+"""
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import tracing
+
+RUN_HISTORY_SIZE = max(1, int(os.environ.get("RUN_HISTORY_SIZE", "50")))
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Span attributes that hold a sub-phase measured inside a span (seconds).
+_ATTRIBUTE_PHASES = {
+    "end_detect_wait_seconds": "end_detect_wait",
+    "normalize_seconds": "normalize",
+    "redact_seconds": "redact",
+    "compress_seconds": "compress",
+    "hash_seconds": "hash",
+    "write_seconds": "write",
+}
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile (Jain & Chlamtac, 1985)."""
+
+    __slots__ = ("p", "count", "heights", "positions", "desired", "increments")
+
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self.heights: List[float] = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                candidate = q[i] + step / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < candidate < q[i + 1]:
+                    q[i] = candidate
+                else:
+                    q[i] += step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                n[i] += step
+
+    def value(self) -> Optional[float]:
+        if not self.heights:
+            return None
+        if self.count <= 5:
+            return self.heights[round(self.p * (len(self.heights) - 1))]
+        return self.heights[2]
+
+
+class _DeviceHistory:
+    __slots__ = ("runs", "total", "failures", "phases")
+
+    def __init__(self):
+        self.runs: Deque[dict] = deque(maxlen=RUN_HISTORY_SIZE)
+        self.total = 0
+        self.failures = 0
+        self.phases: Dict[str, List[P2Quantile]] = {}
+
+    def add(self, record: dict) -> None:
+        self.runs.append(record)
+        self.total += 1
+        if not record["success"]:
+            self.failures += 1
+        for phase, seconds in record["phases"].items():
+            estimators = self.phases.get(phase)
+            if estimators is None:
+                estimators = self.phases[phase] = [P2Quantile(p) for p in QUANTILES]
+            for estimator in estimators:
+                estimator.add(seconds)
+
+    def summary(self) -> dict:
+        phases = {}
+        for phase, estimators in sorted(self.phases.items()):
+            phases[phase] = {"count": estimators[0].count}
+            for p, estimator in zip(QUANTILES, estimators):
+                phases[phase][f"p{round(p * 100)}"] = round(estimator.value(), 6)
+        return {"runs": self.total, "failures": self.failures, "phases": phases}
+
+
+_devices: Dict[str, _DeviceHistory] = {}
+_lock = threading.Lock()
+
+
+def enable() -> None:
+    """Start recording runs (registers a trace listener; idempotent)."""
+    tracing.add_listener(record_trace)
+
+
+def summarize(spans: List["tracing.Span"]) -> Optional[dict]:
+    """One run record for a finished `backup_run` trace (root span last); None for other traces."""
+    root = spans[-1]
+    if root.name != "backup_run":
+        return None
+    phases: Dict[str, float] = {"total": (root.end_ns - root.start_ns) / 1e9}
+    error_type = None
+    retries = None
+    for s in spans[:-1]:
+        phases[s.name] = phases.get(s.name, 0.0) + (s.end_ns - s.start_ns) / 1e9
+        for attribute, phase in _ATTRIBUTE_PHASES.items():
+            if attribute in s.attributes:
+                phases[phase] = phases.get(phase, 0.0) + float(s.attributes[attribute])
+        if error_type is None:
+            error_type = s.attributes.get("error_type")
+        if "retries" in s.attributes:
+            retries = (retries or 0) + int(s.attributes["retries"])
+    attributes = root.attributes
+    upload = next((s.attributes for s in spans if s.name == "cloud_upload" and s.attributes.get("success")), None)
+    return {
+        "device": str(attributes.get("device", "unknown")),
+        "timestamp": root.start_ns / 1e9,
+        "end_timestamp": root.end_ns / 1e9,
+        "trace_id": root.trace_id,
+        "success": bool(attributes.get("success", not root.failed)),
+        "error_type": attributes.get("error_type", error_type),
+        "bytes": attributes.get("bytes"),
+        "sha256": next((s.attributes["sha256"] for s in spans if "sha256" in s.attributes), None),
+        "object": {k: upload.get(k) for k in ("provider", "bucket", "object")} if upload else None,
+        "retries": retries,
+        "phases": {phase: round(seconds, 6) for phase, seconds in phases.items()},
+    }
+
+
+def record_trace(spans: List["tracing.Span"]) -> None:
+    """Trace listener: add a finished `backup_run` trace to its device's history."""
+    record = summarize(spans)
+    if record is None:
+        return
+    with _lock:
+        history = _devices.get(record["device"])
+        if history is None:
+            history = _devices[record["device"]] = _DeviceHistory()
+        history.add(record)
+
+
+def snapshot(device: Optional[str] = None, limit: Optional[int] = None) -> dict:
+    """Recent runs (newest first) and per-phase percentiles, per device."""
+    with _lock:
+        devices = {}
+        for name, history in sorted(_devices.items()):
+            if device is not None and name != device:
+                continue
+            runs = list(reversed(history.runs))
+            if limit is not None:
+                runs = runs[:limit]
+            devices[name] = {"summary": history.summary(), "runs": runs}
+    return {"history_size": RUN_HISTORY_SIZE, "devices": devices}
@@ -0,0 +1,431 @@
+"""Tick handling for the internal cron scheduler (cronjob.py).
+
+- Jitter: each device fires a fixed offset after the cron tick, derived from a hash of
+  its name/host, so pods sharing one CRONJOB_SCHEDULE do not all hit the devices, the
+  AAA servers and Pushgateway in the same second. The offset is stable across restarts.
+- Coalescing: ticks that came due while the scheduler was not sleeping on them (process
+  paused, clock jump) result in one run, not one run per tick.
+- Skip if still running: ticks that come due during a run are dropped, not queued.
+- Watchdog: a run that exceeds CRONJOB_MAX_RUNTIME cannot be cancelled (it is a thread
+  blocked in I/O), so the caller is told and exits for the container to be restarted.
+
+`FleetScheduler` applies the same rules to many devices in one process (inventory.py).
+`StagePipeline` lets a later stage of those runs (the upload) have workers of its own.
+With SCHEDULER_ENGINE=asyncio, async_engine runs the collections instead. Both start a
+run only once admission.py admits it (per-site/AAA/vendor limits).
+"""
+import contextvars
+import hashlib
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Generator, Iterable, List, Optional, Set, Tuple, Union
+
+from croniter import croniter
+
+import admission
+import inventory
+import metrics
+
+# Upper bound for the per-device start offset (seconds); also capped to a quarter of the
+# schedule interval so a jittered run never drifts into the next tick. 0 disables jitter.
+CRONJOB_JITTER_SECONDS = float(os.environ.get("CRONJOB_JITTER_SECONDS", "60"))
+# Longest a single run may take before the watchdog fires (seconds). 0 disables it.
+CRONJOB_MAX_RUNTIME = float(os.environ.get("CRONJOB_MAX_RUNTIME", "0"))
+# Process exit code when the watchdog fires.
+WATCHDOG_EXIT_CODE = 2
+# Fleet mode: how many device backups run at the same time.
+SCHEDULER_WORKERS = max(1, int(os.environ.get("SCHEDULER_WORKERS", "8")))
+# Fleet mode: workers that only store (upload) collected backups. 0 = each backup is stored
+# by the worker that collected it, before that worker takes the next device.
+SCHEDULER_STORE_WORKERS = max(0, int(os.environ.get("SCHEDULER_STORE_WORKERS", "0")))
+# Collected backups that may wait for a store worker (0 = SCHEDULER_STORE_WORKERS). When
+# the queue is full, collecting workers wait, so a slow upload holds back new collections.
+SCHEDULER_STORE_QUEUE_SIZE = max(0, int(os.environ.get("SCHEDULER_STORE_QUEUE_SIZE", "0")))
+# Fleet mode: "threads" (a worker thread per concurrent backup) or "asyncio" (collections
+# as tasks of one event loop, see async_engine).
+SCHEDULER_ENGINE = os.environ.get("SCHEDULER_ENGINE", "threads").lower()
+
+# A run in stages: a generator that yields the name of its next stage and returns the result.
+# On the asyncio engine it yields its collection as an awaitable instead, and is sent its result.
+Stages = Generator[Union[str, Awaitable[bool]], Optional[bool], bool]
+
+
+def jitter_key() -> str:
+    """What the jitter is hashed from: the device name, else the host."""
+    return os.environ.get("DEVICE_NAME") or os.environ.get("HOST") or "unknown"
+
+
+def jitter_for(key: str, max_jitter: float) -> float:
+    """Deterministic offset in [0, max_jitter) for `key`."""
+    if max_jitter <= 0:
+        return 0.0
+    fraction = int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big") / 2 ** 64
+    return fraction * max_jitter
+
+
+class CronTicker:
+    """Cron ticks shifted by a fixed jitter, with missed ticks collapsed."""
+
+    def __init__(self, schedule: str, key: str, now: Optional[float] = None,
+                 max_jitter: float = CRONJOB_JITTER_SECONDS):
+        now = time.time() if now is None else now
+        self._iterator = croniter(schedule, now)
+        tick = self._iterator.get_next(float)
+        self.interval = croniter(schedule, tick).get_next(float) - tick
+        self.jitter = jitter_for(key, min(max_jitter, self.interval / 4))
+        self.due = tick + self.jitter
+
+    def advance_past(self, now: float) -> int:
+        """Move `due` to the first jittered tick after `now`; returns how many due ticks were passed over."""
+        passed = 0
+        while self.due <= now:
+            self.due = self._iterator.get_next(float) + self.jitter
+            passed += 1
+        return passed
+
+    def wait(self) -> Tuple[float, int]:
+        """
+        Sleep until the next due tick. Returns (lateness in seconds, extra ticks that had
+        also come due and are coalesced into this one).
+        """
+        while True:
+            sleep_seconds = self.due - time.time()
+            if sleep_seconds <= 0:
+                break
+            time.sleep(sleep_seconds)
+        now = time.time()
+        lateness = now - self.due
+        coalesced = self.advance_past(now) - 1
+        return lateness, coalesced
+
+
+def run_with_watchdog(fn: Callable[[], bool], max_runtime: float = CRONJOB_MAX_RUNTIME) -> Optional[bool]:
+    """
+    Run `fn()` and return its result, or None if it is still running after `max_runtime`
+    seconds (the run is then left behind on a daemon thread). max_runtime <= 0 runs inline.
+    """
+    if max_runtime <= 0:
+        return fn()
+    result = []
+
+    def target() -> None:
+        result.append(fn())
+
+    worker = threading.Thread(target=target, name="backup-run", daemon=True)
+    worker.start()
+    worker.join(max_runtime)
+    if worker.is_alive():
+        return None
+    # An exception in fn() leaves no result: count it as a failed run.
+    return result[0] if result else False
+
+
+class StagedRun:
+    """
+    One device run, stepped from stage to stage. Every step runs in the run's own
+    contextvars context, so a span opened in one stage (the run's trace) is still the
+    current span when a later stage continues on another thread.
+    """
+
+    def __init__(self, device: inventory.Device, stages: Stages):
+        self.device = device
+        self.stage = "collect"
+        self.result = False
+        self.finished = False
+        self.started: Optional[float] = time.monotonic()  # current stage (monotonic); None while queued
+        self.queued_at = 0.0
+        self.context = contextvars.copy_context()
+        # Called once the run is past its collection (e.g. to release its admission ticket).
+        self.collected: Optional[Callable[[], None]] = None
+        self._stages = stages
+
+    def step(self, value: Optional[bool] = None) -> None:
+        """
+        Run the current stage up to the next one, sending in `value` (the result of an
+        awaited collection); an exception ends the run as failed and is re-raised.
+        """
+        try:
+            self.stage = self.context.run(self._stages.send, value)
+        except StopIteration as done:
+            self.result, self.finished = bool(done.value), True
+        except BaseException:
+            self.finished = True
+            raise
+        finally:
+            if self.collected is not None and (self.finished or self.stage == "store"):
+                collected, self.collected = self.collected, None
+                collected()
+
+
+def run_stages(stages: Stages) -> bool:
+    """Run all stages of a run on this thread; returns its result."""
+    while True:
+        try:
+            next(stages)
+        except StopIteration as done:
+            return bool(done.value)
+
+
+class StagePipeline:
+    """
+    Worker pools for the later stages of staged runs, each fed by a bounded queue. A run
+    is stepped on the thread that has it until it reaches a stage with workers here, then
+    waits in that stage's queue. `advance()` blocks while the queue is full, so the slowest
+    stage sets the pace and finished collections do not pile up behind it. Stages without
+    workers run inline. `on_change(run)` is called when a queued run starts its stage and
+    when a run has finished (run.finished).
+    """
+
+    def __init__(self, workers: Dict[str, int], queue_size: int = 0,
+                 on_change: Callable[[StagedRun], None] = lambda run: None):
+        self._workers = {stage: count for stage, count in workers.items() if count > 0}
+        self._queues: Dict[str, "queue.Queue[StagedRun]"] = {
+            stage: queue.Queue(maxsize=queue_size or count) for stage, count in self._workers.items()}
+        self._on_change = on_change
+
+    def start(self) -> None:
+        for stage, count in self._workers.items():
+            for i in range(count):
+                threading.Thread(target=self._worker, args=(stage,), name=f"backup-{stage}-{i + 1}", daemon=True).start()
+
+    def advance(self, run: StagedRun) -> None:
+        """Step `run` on this thread until it has finished or has been queued for another stage."""
+        while True:
+            try:
+                run.step()
+            except Exception as e:
+                print(f"❌ Backup of {run.device.name} raised: {e}")
+            if run.finished:
+                self._on_change(run)
+                return
+            waiting = self._queues.get(run.stage)
+            if waiting is not None:
+                run.started, run.queued_at = None, time.monotonic()
+                waiting.put(run)
+                metrics.set_stage_queue_depth(run.stage, waiting.qsize())
+                return
+
+    def _worker(self, stage: str) -> None:
+        waiting = self._queues[stage]
+        while True:
+            run = waiting.get()
+            metrics.set_stage_queue_depth(stage, waiting.qsize())
+            run.started = time.monotonic()
+            metrics.observe_stage_wait(stage, run.started - run.queued_at)
+            self._on_change(run)
+            self.advance(run)
+
+
+class FleetScheduler:
+    """
+    Per-device cron schedules in one process. A heap holds each device's next due time;
+    the dispatcher sleeps until the earliest one (no polling, so thousands of idle
+    schedules cost nothing) and hands due devices to a fixed pool of worker threads
+    through a ready queue. A device that is still queued or running when its next tick
+    comes due skips that tick. `sync()` changes the device set while running.
+
+    `run(device)` returns the run's stages (see StagedRun). With `store_workers`, the
+    "store" stage goes through a StagePipeline: the workers collect, and uploads overlap
+    the next collections. With engine="asyncio", one worker hands the runs to an
+    async_engine.AsyncEngine instead, and `run` must yield its collection as an awaitable.
+
+    With `admission` limits, a worker takes the first ready run that is admitted, not the
+    first in line: runs held back by their site or AAA realm stay queued (in order) while
+    the others go ahead, until a run releases its slot or a token is due.
+    """
+
+    def __init__(self, run: Callable[[inventory.Device], Stages], workers: int = SCHEDULER_WORKERS,
+                 max_runtime: float = CRONJOB_MAX_RUNTIME, store_workers: int = SCHEDULER_STORE_WORKERS,
+                 store_queue_size: int = SCHEDULER_STORE_QUEUE_SIZE, engine: str = SCHEDULER_ENGINE,
+                 admission: Optional["admission.Admission"] = None):
+        self._run = run
+        self._max_runtime = max_runtime
+        self._admission = None  # thread workers only: async_engine admits its tasks itself
+        if engine == "asyncio":
+            # Imported here: async_engine builds on this module.
+            import async_engine
+            self._workers = 1
+            self._stages = async_engine.AsyncEngine(store_workers=store_workers or workers,
+                                                    store_queue_size=store_queue_size, on_change=self._stage_changed,
+                                                    admission=admission)
+        else:
+            self._workers = workers
+            self._stages = StagePipeline({"store": store_workers}, store_queue_size, on_change=self._stage_changed)
+            self._admission = admission
+            if admission is not None:
+                admission.on_release(self._admission_released)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)     # dispatcher
+        self._work = threading.Condition(self._lock)       # workers
+        self._devices: Dict[str, inventory.Device] = {}
+        self._tickers: Dict[str, CronTicker] = {}
+        # (due, sequence, device name); sequence breaks ties without comparing names
+        self._heap: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        self._ready: Deque[Tuple[str, float]] = deque()      # (device name, due)
+        self._pending: Set[str] = set()                    # queued or running
+        self._running: Dict[str, StagedRun] = {}           # started, not finished
+
+    def add(self, device: inventory.Device) -> None:
+        ticker = CronTicker(device.schedule, device.name)
+        with self._lock:
+            self._schedule(device, ticker)
+            self._wakeup.notify()
+
+    def sync(self, devices: List[inventory.Device]) -> Tuple[List[str], List[str], List[str]]:
+        """
+        Make the scheduled set match `devices`; returns (added, removed, changed) names.
+        Unchanged devices keep their place in the schedule. A changed device keeps its
+        schedule unless the schedule itself changed, and its next run uses the new settings.
+        Runs already in progress finish; a removed device that is still queued is dropped.
+        """
+        wanted = {device.name: device for device in devices}
+        added, removed, changed = [], [], []
+        # Tickers are built outside the lock: croniter parsing is the slow part.
+        tickers = {}
+        with self._lock:
+            current = dict(self._devices)
+        for name, device in wanted.items():
+            old = current.get(name)
+            if old is None or old.schedule != device.schedule:
+                tickers[name] = CronTicker(device.schedule, name)
+        with self._lock:
+            for name in list(self._devices):
+                if name not in wanted:
+                    del self._devices[name]
+                    del self._tickers[name]  # its heap entries are now stale
+                    removed.append(name)
+            for name, device in wanted.items():
+                old = self._devices.get(name)
+                if old == device:
+                    continue
+                if old is None or old.schedule != device.schedule:
+                    ticker = tickers.get(name) or CronTicker(device.schedule, name)
+                    self._schedule(device, ticker)
+                else:
+                    self._devices[name] = device
+                (added if old is None else changed).append(name)
+            self._wakeup.notify()
+        return added, removed, changed
+
+    def trigger(self, names: Optional[Iterable[str]] = None) -> None:
+        """Queue a run of `names` (default: every device) now, off schedule; devices already queued or running are skipped."""
+        with self._lock:
+            now = time.time()
+            for name in (list(self._devices) if names is None else names):
+                if name in self._devices and name not in self._pending:
+                    self._pending.add(name)
+                    self._ready.append((name, now))
+            self._work.notify_all()
+            self._wakeup.notify()
+
+    def _schedule(self, device: inventory.Device, ticker: CronTicker) -> None:
+        self._devices[device.name] = device
+        self._tickers[device.name] = ticker
+        heapq.heappush(self._heap, (ticker.due, next(self._sequence), device.name))
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def run_forever(self) -> str:
+        """Dispatch due runs until the watchdog fires; returns the name of the stuck device."""
+        for i in range(self._workers):
+            threading.Thread(target=self._worker, name=f"backup-worker-{i + 1}", daemon=True).start()
+        self._stages.start()
+        with self._lock:
+            while True:
+                now = time.time()
+                self._dispatch_due(now)
+                metrics.set_scheduler_state(len(self._devices), len(self._ready), len(self._running))
+
+                timeout = self._heap[0][0] - now if self._heap else None
+                # Only the current stage counts: a run waiting for a stage worker is not stuck.
+                started = [(run.started, name) for name, run in self._running.items() if run.started is not None]
+                if self._max_runtime > 0 and started:
+                    started, name = min(started)
+                    remaining = started + self._max_runtime - time.monotonic()
+                    if remaining <= 0:
+                        return name
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                self._wakeup.wait(timeout)
+
+    def _dispatch_due(self, now: float) -> None:
+        while self._heap and self._heap[0][0] <= now:
+            due, _, name = heapq.heappop(self._heap)
+            ticker = self._tickers.get(name)
+            if ticker is None or ticker.due != due:
+                continue  # stale entry (device removed or rescheduled)
+            coalesced = ticker.advance_past(now) - 1
+            if coalesced:
+                metrics.record_skipped_ticks('coalesced', coalesced)
+            heapq.heappush(self._heap, (ticker.due, next(self._sequence), name))
+            if name in self._pending:
+                metrics.record_skipped_ticks('overlap', 1)
+                continue
+            self._pending.add(name)
+            self._ready.append((name, due))
+            self._work.notify()
+
+    def _worker(self) -> None:
+        while True:
+            with self._lock:
+                while not self._ready:
+                    self._work.wait()
+                if self._admission is not None and self._admission.enabled:
+                    device, due, ticket = self._take_admitted()
+                else:
+                    name, due = self._ready.popleft()
+                    device, ticket = self._devices.get(name), None
+                    if device is None:
+                        self._pending.discard(name)  # removed from the inventory while queued
+                        continue
+            metrics.observe_scheduling_lag(time.time() - due)
+            run = StagedRun(device, self._run(device))
+            if ticket is not None:
+                run.collected = ticket.release
+            self._stage_changed(run)
+            self._stages.advance(run)
+
+    def _take_admitted(self) -> Tuple[inventory.Device, float, "admission.Ticket"]:
+        """Wait for a ready run that is admitted and take it off the ready queue (holding the lock)."""
+        while True:
+            retry_after = None
+            for index, (name, due) in enumerate(self._ready):
+                device = self._devices.get(name)
+                if device is None:
+                    break
+                ticket, refusal = self._admission.try_acquire(device)
+                if ticket is not None:
+                    del self._ready[index]
+                    if self._ready:
+                        self._work.notify()  # the next idle worker looks for another one
+                    return device, due, ticket
+                if refusal.retry_after is not None:
+                    retry_after = refusal.retry_after if retry_after is None else min(retry_after, refusal.retry_after)
+            else:
+                self._work.wait(retry_after)
+                continue
+            # Drop the runs of devices removed from the inventory while queued, then look again.
+            for name, due in list(self._ready):
+                if name not in self._devices:
+                    self._ready.remove((name, due))
+                    self._pending.discard(name)
+                    self._admission.forget(name)
+
+    def _admission_released(self) -> None:
+        with self._lock:
+            self._work.notify()
+
+    def _stage_changed(self, run: StagedRun) -> None:
+        with self._lock:
+            if run.finished:
+                self._running.pop(run.device.name, None)
+                self._pending.discard(run.device.name)
+            else:
+                self._running[run.device.name] = run
+            self._wakeup.notify()
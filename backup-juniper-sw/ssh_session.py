@@ -0,0 +1,393 @@
+"""SSH session setup for the CLI collectors, timed phase by phase.
+
+paramiko's SSHClient.connect() hides TCP connect, key exchange and authentication
+behind one call. Doing the same steps on a Transport lets the collectors report each
+phase separately (metrics callback and tracing span). Host keys are not verified
+(as with AutoAddPolicy before).
+
+With SSH_SESSION_POOL=true, `acquire()` keeps each device's authenticated transport
+open between runs (cron mode), with keepalives, and every run opens a fresh shell
+channel on it. Handshake and AAA authentication then happen once, not every cycle.
+A pooled transport that turns out to be dead when the shell is opened is replaced
+by a new connection, so a stale session costs one reconnect, not a failed run.
+
+TRANSPORT_PROFILE (SSH_COMPRESSION, SSH_WINDOW_SIZE, SSH_MAX_PACKET_SIZE, SSH_KEX,
+SSH_CIPHERS, SSH_MACS) tunes every new transport; see benchmarks/bench_ssh_transport.py.
+
+Shells are recorded with SESSION_CAPTURE_DIR, and SESSION_REPLAY_FILE replaces the
+device with a recording (session_capture).
+
+On the asyncio engine (SCHEDULER_ENGINE=asyncio) the collectors use `acquire_async()`
+instead: the same phases and exceptions over asyncssh, without pooling or capture.
+"""
+import asyncio
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+
+import paramiko
+
+import metrics
+import session_capture
+import tracing
+from scheduling import SCHEDULER_ENGINE
+
+if SCHEDULER_ENGINE == "asyncio":
+    import asyncssh
+
+# Keep SSH sessions open between runs (only useful in cron mode).
+SSH_SESSION_POOL = os.environ.get("SSH_SESSION_POOL", "false").lower() == "true"
+# Interval of SSH keepalive messages on pooled sessions (seconds); keeps NAT/firewall state alive.
+SSH_KEEPALIVE_SECONDS = int(os.environ.get("SSH_KEEPALIVE_SECONDS", "30"))
+# Pooled sessions unused for longer than this are closed instead of reused (seconds).
+SSH_SESSION_MAX_IDLE = float(os.environ.get("SSH_SESSION_MAX_IDLE", "3600"))
+
+# Called with (phase, seconds) after each completed phase.
+PhaseCallback = Optional[Callable[[str, float], None]]
+
+
+class TransportProfile(NamedTuple):
+    """SSH transport settings. Empty algorithm lists keep paramiko's order."""
+    # zlib compression, if the device agrees. Pays off for config text over slow links.
+    compression: bool = False
+    # Per-channel receive window and largest packet the device may send (bytes); None = paramiko default.
+    window_size: Optional[int] = None
+    max_packet_size: Optional[int] = None
+    # Algorithms to offer first, most preferred first. Names paramiko does not support are ignored.
+    kex: Tuple[str, ...] = ()
+    ciphers: Tuple[str, ...] = ()
+    macs: Tuple[str, ...] = ()
+
+
+def _names(value: Optional[str]) -> Tuple[str, ...]:
+    return tuple(name.strip() for name in (value or "").split(",") if name.strip())
+
+
+def _size(value: Optional[str]) -> Optional[int]:
+    return int(value) if value else None
+
+
+TRANSPORT_PROFILE = TransportProfile(
+    compression=os.environ.get("SSH_COMPRESSION", "false").lower() == "true",
+    window_size=_size(os.environ.get("SSH_WINDOW_SIZE")),
+    max_packet_size=_size(os.environ.get("SSH_MAX_PACKET_SIZE")),
+    kex=_names(os.environ.get("SSH_KEX")),
+    ciphers=_names(os.environ.get("SSH_CIPHERS")),
+    macs=_names(os.environ.get("SSH_MACS")),
+)
+
+
+def _prefer(current: Tuple[str, ...], preferred: Tuple[str, ...]) -> Tuple[str, ...]:
+    """`current` with the supported names from `preferred` moved to the front, in that order."""
+    first = tuple(name for name in preferred if name in current)
+    return first + tuple(name for name in current if name not in first)
+
+
+def _new_transport(sock: socket.socket, profile: TransportProfile) -> paramiko.Transport:
+    sizes = {}
+    if profile.window_size:
+        sizes["default_window_size"] = profile.window_size
+    if profile.max_packet_size:
+        sizes["default_max_packet_size"] = profile.max_packet_size
+    transport = paramiko.Transport(sock, **sizes)
+    options = transport.get_security_options()
+    if profile.kex:
+        options.kex = _prefer(options.kex, profile.kex)
+    if profile.ciphers:
+        options.ciphers = _prefer(options.ciphers, profile.ciphers)
+    if profile.macs:
+        options.digests = _prefer(options.digests, profile.macs)
+    if profile.compression:
+        transport.use_compression(True)
+    return transport
+
+
+@contextmanager
+def _phase(on_phase: PhaseCallback, phase: str, **attributes) -> Iterator[None]:
+    start = time.perf_counter()
+    with tracing.span(phase, **attributes):
+        yield
+    if on_phase is not None:
+        on_phase(phase, time.perf_counter() - start)
+
+
+def connect(host: str, port: int, username: str, password: str, timeout: float = 10,
+            on_phase: PhaseCallback = None, profile: Optional[TransportProfile] = None) -> paramiko.Transport:
+    """
+    Open an authenticated SSH transport (phases: tcp_connect, ssh_handshake, auth), tuned
+    by `profile` (default: TRANSPORT_PROFILE).
+    Raises OSError, paramiko.SSHException or paramiko.AuthenticationException, like SSHClient.connect().
+    """
+    with _phase(on_phase, 'tcp_connect', host=host, port=port):
+        sock = socket.create_connection((host, port), timeout=timeout)
+
+    transport = _new_transport(sock, profile or TRANSPORT_PROFILE)
+    try:
+        with _phase(on_phase, 'ssh_handshake'):
+            transport.start_client(timeout=timeout)
+            # What was negotiated, for comparing profiles (device -> collector direction).
+            tracing.set_attribute("cipher", transport.remote_cipher)
+            # AES-GCM authenticates the data itself; paramiko still reports the MAC it would have used.
+            aead = transport.remote_cipher.endswith("-gcm@openssh.com")
+            tracing.set_attribute("mac", "aead" if aead else transport.remote_mac)
+            tracing.set_attribute("compression", transport.remote_compression)
+
+        with _phase(on_phase, 'auth', username=username):
+            # Falls back to keyboard-interactive when the device only offers that.
+            transport.auth_password(username, password)
+    except Exception:
+        transport.close()
+        raise
+    return transport
+
+
+def open_shell(transport: paramiko.Transport, timeout: float = 10, device: str = "") -> paramiko.Channel:
+    """Open an interactive shell with a PTY, like SSHClient.invoke_shell()."""
+    # Wrapped before the shell starts, so a capture includes the first prompt.
+    channel = session_capture.capture_shell(transport.open_session(timeout=timeout), device)
+    channel.get_pty('vt100', 80, 24)
+    channel.invoke_shell()
+    return channel
+
+
+class StreamMatcher:
+    """
+    Looks for `marker` (an end-of-output prompt, a pager prompt) in text that arrives
+    in chunks, including when the device's output splits it across two chunks.
+    """
+
+    def __init__(self, marker: str):
+        self.marker = marker
+        self._tail = ""
+
+    def feed(self, chunk: str) -> bool:
+        """True if `marker` ends in this chunk (each occurrence is reported once)."""
+        window = self._tail + chunk
+        found = self.marker in window
+        keep = len(self.marker) - 1
+        # Keep just enough to complete a marker that the next chunk finishes.
+        self._tail = window[-keep:] if keep and not found else ""
+        return found
+
+
+class _Endpoint(NamedTuple):
+    host: str
+    port: int
+    username: str
+    password: str
+
+
+class Session:
+    """One run's use of an SSH transport: new, or taken from the pool."""
+
+    def __init__(self, name: str, endpoint: _Endpoint, transport: paramiko.Transport, reused: bool,
+                 timeout: float, on_phase: PhaseCallback):
+        self.name = name
+        self.endpoint = endpoint
+        self.transport = transport
+        self.reused = reused
+        self._timeout = timeout
+        self._on_phase = on_phase
+
+    def open_shell(self) -> paramiko.Channel:
+        """open_shell() on this session; a dead pooled transport is replaced by a new connection once."""
+        try:
+            shell = open_shell(self.transport, self._timeout, self.name)
+        except (paramiko.SSHException, OSError, EOFError):
+            if not self.reused:
+                raise
+        else:
+            tracing.set_attribute("retries", 0)
+            return shell
+        self.transport.close()
+        metrics.record_ssh_session('stale')
+        tracing.set_attribute("ssh_session", "stale")
+        tracing.set_attribute("retries", 1)
+        self.transport = _connect_pooled(self.endpoint, self._timeout, self._on_phase)
+        self.reused = False
+        return open_shell(self.transport, self._timeout, self.name)
+
+    def release(self, healthy: bool = True) -> None:
+        """Return the transport to the pool (if pooling and `healthy`), else close it."""
+        if SSH_SESSION_POOL and healthy and self.transport.is_active():
+            with _pool_lock:
+                previous = _pool.get(self.name)
+                _pool[self.name] = (self.endpoint, self.transport, time.monotonic())
+            if previous is not None and previous[1] is not self.transport:
+                previous[1].close()
+        else:
+            self.transport.close()
+
+
+# device name -> (endpoint, transport, last released at (monotonic))
+_pool: Dict[str, Tuple[_Endpoint, paramiko.Transport, float]] = {}
+_pool_lock = threading.Lock()
+
+
+def _connect_pooled(endpoint: _Endpoint, timeout: float, on_phase: PhaseCallback) -> paramiko.Transport:
+    transport = connect(*endpoint, timeout=timeout, on_phase=on_phase)
+    if SSH_SESSION_POOL and SSH_KEEPALIVE_SECONDS > 0:
+        transport.set_keepalive(SSH_KEEPALIVE_SECONDS)
+    return transport
+
+
+def acquire(name: str, host: str, port: int, username: str, password: str, timeout: float = 10,
+            on_phase: PhaseCallback = None) -> Session:
+    """
+    An authenticated session for device `name`: its pooled transport when one is open,
+    idle for less than SSH_SESSION_MAX_IDLE and for the same host/port/credentials,
+    otherwise a new connection (phases and exceptions as in connect()).
+    Call `release()` on the result when the run is done.
+    With SESSION_REPLAY_FILE set, a session_capture.ReplaySession instead (no connection).
+    """
+    if session_capture.SESSION_REPLAY_FILE:
+        return session_capture.ReplaySession(name)
+    endpoint = _Endpoint(host, port, username, password)
+    if SSH_SESSION_POOL:
+        now = time.monotonic()
+        with _pool_lock:
+            entry = _pool.pop(name, None)
+            # Each open transport holds a socket and a thread: close the ones idle too long.
+            expired = [other for other, (_, _, released_at) in _pool.items()
+                       if now - released_at >= SSH_SESSION_MAX_IDLE]
+            idle = [_pool.pop(other)[1] for other in expired]
+        for transport in idle:
+            transport.close()
+        if entry is not None:
+            pooled_endpoint, transport, released_at = entry
+            if (pooled_endpoint == endpoint and transport.is_active()
+                    and now - released_at < SSH_SESSION_MAX_IDLE):
+                metrics.record_ssh_session('reused')
+                tracing.set_attribute("ssh_session", "reused")
+                return Session(name, endpoint, transport, True, timeout, on_phase)
+            transport.close()
+    transport = _connect_pooled(endpoint, timeout, on_phase)
+    if SSH_SESSION_POOL:
+        metrics.record_ssh_session('new')
+    return Session(name, endpoint, transport, False, timeout, on_phase)
+
+
+def discard(name: str) -> None:
+    """Close the pooled session of `name` (device removed or changed in the inventory)."""
+    with _pool_lock:
+        entry = _pool.pop(name, None)
+    if entry is not None:
+        entry[1].close()
+
+
+def _async_options(profile: TransportProfile) -> dict:
+    """asyncssh.connect() options for `profile` ('^' puts the names in front of asyncssh's defaults)."""
+    options = {"compression_algs": ["zlib@openssh.com", "zlib", "none"] if profile.compression else None}
+    if profile.window_size:
+        options["window"] = profile.window_size
+    if profile.max_packet_size:
+        options["max_pktsize"] = profile.max_packet_size
+    for option, names in (("kex_algs", profile.kex), ("encryption_algs", profile.ciphers), ("mac_algs", profile.macs)):
+        if names:
+            options[option] = "^" + ",".join(names)
+    return options
+
+
+class AsyncShell:
+    """An interactive shell of an AsyncSession; send() like a paramiko Channel, recv() awaited."""
+
+    def __init__(self, process: "asyncssh.SSHClientProcess"):
+        self._process = process
+
+    def send(self, text: str) -> None:
+        self._process.stdin.write(text.encode())
+
+    async def recv(self, size: int, timeout: Optional[float] = None) -> Optional[bytes]:
+        """Up to `size` bytes, None if nothing arrived within `timeout`; EOFError once the device closed the shell."""
+        try:
+            data = await asyncio.wait_for(self._process.stdout.read(size), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if not data:
+            raise EOFError("shell closed by the device")
+        return data
+
+    def close(self) -> None:
+        self._process.close()
+
+
+class AsyncSession:
+    """Session for the asyncio engine: an asyncssh connection of one run (not pooled)."""
+
+    def __init__(self, name: str, connection: "asyncssh.SSHClientConnection", timeout: float):
+        self.name = name
+        self.connection = connection
+        self._timeout = timeout
+
+    async def open_shell(self) -> AsyncShell:
+        """An interactive shell with a PTY, like open_shell()."""
+        try:
+            process = await asyncio.wait_for(
+                self.connection.create_process(term_type="vt100", term_size=(80, 24), encoding=None), self._timeout)
+        except asyncssh.Error as e:
+            raise paramiko.SSHException(str(e)) from e
+        return AsyncShell(process)
+
+    def release(self, healthy: bool = True) -> None:
+        self.connection.close()
+
+
+async def acquire_async(name: str, host: str, port: int, username: str, password: str, timeout: float = 10,
+                        on_phase: PhaseCallback = None, profile: Optional[TransportProfile] = None) -> AsyncSession:
+    """
+    acquire() for the asyncio engine: a new asyncssh connection (phases tcp_connect,
+    ssh_handshake and auth, tuned by `profile`), raising the same exceptions as connect()
+    so the collectors handle both alike. Sessions are not pooled, captured or replayed here.
+    """
+    loop = asyncio.get_running_loop()
+    with _phase(on_phase, 'tcp_connect', host=host, port=port):
+        address = (await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM))[0]
+        sock = socket.socket(address[0], socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, address[4]), timeout)
+        except asyncio.TimeoutError:
+            sock.close()
+            # As socket.create_connection() in connect(): an OSError the collectors catch.
+            raise socket.timeout(f"timed out connecting to {host}:{port}") from None
+        except BaseException:
+            sock.close()
+            raise
+
+    auth_started = []
+
+    class PhaseClient(asyncssh.SSHClient):
+        def begin_auth(self, username: str) -> bool:
+            # The handshake is done; asyncssh.connect() only returns after authentication.
+            auth_started.append(time.perf_counter())
+            return True
+
+    start = time.perf_counter()
+    try:
+        with tracing.span('auth', username=username):
+            connection = await asyncio.wait_for(asyncssh.connect(
+                sock=sock, username=username, password=password, known_hosts=None, client_factory=PhaseClient,
+                preferred_auth="password,keyboard-interactive", login_timeout=timeout,
+                **_async_options(profile or TRANSPORT_PROFILE)), timeout)
+            tracing.set_attribute("cipher", connection.get_extra_info("recv_cipher"))
+            tracing.set_attribute("mac", connection.get_extra_info("recv_mac") or "aead")
+            tracing.set_attribute("compression", connection.get_extra_info("recv_compression"))
+    except asyncssh.PermissionDenied as e:
+        raise paramiko.AuthenticationException(str(e)) from e
+    except asyncssh.Error as e:
+        raise paramiko.SSHException(str(e)) from e
+    except asyncio.TimeoutError:
+        sock.close()
+        # paramiko raises SSHException when the handshake or the authentication times out.
+        stage = "authentication" if auth_started else "SSH handshake"
+        raise paramiko.SSHException(f"{stage} with {host}:{port} timed out") from None
+    if on_phase is not None:
+        end = time.perf_counter()
+        # No begin_auth() when the server lets the user in without authenticating.
+        handshake_end = auth_started[0] if auth_started else end
+        on_phase('ssh_handshake', handshake_end - start)
+        on_phase('auth', end - handshake_end)
+    return AsyncSession(name, connection, timeout)
@@ -0,0 +1,143 @@
+"""Asyncio engine for fleet mode (SCHEDULER_ENGINE=asyncio).
+
+A worker thread per concurrent backup (SCHEDULER_WORKERS) stops scaling at a few hundred
+devices: every one has a stack, and with paramiko a transport thread of its own, and
+most of them only wait for the device. Here collections are tasks of one event loop on
+one thread, talking to the devices through async clients (asyncssh in ssh_session,
+aiohttp for PAN-OS), and SCHEDULER_ASYNC_SESSIONS caps how many device sessions are
+open at a time (of the runs admission.py has admitted). Runs are the same staged runs as
+with threads (scheduling.StagedRun): the run yields its collection as an awaitable,
+which is awaited on the loop in the run's context, and the "store" stage (blocking
+uploads) runs on a thread pool.
+
+Everything else a run does between its awaits (span bookkeeping, the transform stages
+of each chunk) runs on the loop thread, so it holds up all collections: keep
+BACKUP_OFFLOAD_WORKERS on for large configurations. The single-device `run_backup_once`
+keeps the blocking clients.
+"""
+import asyncio
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Set
+
+import admission
+import metrics
+from scheduling import StagedRun
+
+# Device sessions (collections) open at the same time on the asyncio engine.
+SCHEDULER_ASYNC_SESSIONS = max(1, int(os.environ.get("SCHEDULER_ASYNC_SESSIONS", "1000")))
+
+
+class AsyncEngine:
+    """
+    Runs staged runs on an event loop thread: collections under a global semaphore of
+    `max_sessions`, stores on `store_workers` threads. A collected run keeps its session
+    slot until one of `store_workers + store_queue_size` store slots is free, so slow
+    uploads hold back new collections (as the bounded queue of a StagePipeline does).
+    Same interface as StagePipeline: start(), then advance(run) from any thread, which
+    returns at once. `on_change(run)` is called when a run starts a stage after waiting
+    for it and when it has finished, from the loop or a store thread. With `admission`, a
+    run waits to be admitted before it waits for a session slot, so runs held back by
+    their site or AAA realm do not take slots from the others.
+    """
+
+    def __init__(self, max_sessions: int = SCHEDULER_ASYNC_SESSIONS, store_workers: int = 8,
+                 store_queue_size: int = 0, on_change: Callable[[StagedRun], None] = lambda run: None,
+                 admission: Optional["admission.Admission"] = None):
+        self._max_sessions = max_sessions
+        self._admission = admission
+        self._store_workers = max(1, store_workers)
+        self._store_slots_total = self._store_workers + (store_queue_size or self._store_workers)
+        self._on_change = on_change
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sessions: Optional[asyncio.Semaphore] = None
+        self._store_slots: Optional[asyncio.Semaphore] = None
+        self._store_pool: Optional[ThreadPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._waiting = {"collect": 0, "store": 0}
+
+    def start(self) -> None:
+        """Start the event loop thread (and the store threads)."""
+        started = threading.Event()
+
+        def serve() -> None:
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._sessions = asyncio.Semaphore(self._max_sessions)
+            self._store_slots = asyncio.Semaphore(self._store_slots_total)
+            started.set()
+            self._loop.run_forever()
+
+        self._store_pool = ThreadPoolExecutor(self._store_workers, thread_name_prefix="backup-store")
+        threading.Thread(target=serve, name="backup-asyncio", daemon=True).start()
+        started.wait()
+
+    def advance(self, run: StagedRun) -> None:
+        """Hand `run` to the event loop; returns without waiting for it."""
+        run.started, run.queued_at = None, time.monotonic()
+        self._loop.call_soon_threadsafe(self._create_task, run)
+
+    def _create_task(self, run: StagedRun) -> None:
+        task = self._loop.create_task(self._run(run))
+        # The loop only keeps weak references to its tasks.
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, run: StagedRun) -> None:
+        if self._admission is not None and self._admission.enabled:
+            ticket = await self._admission.acquire(run.device)
+            # Released by the run once its collection is over.
+            run.collected = ticket.release
+            run.queued_at = time.monotonic()  # the session slot wait starts now
+        await self._acquire("collect", run, self._sessions)
+        try:
+            run.started = time.monotonic()
+            self._on_change(run)
+            self._step(run)
+            if not run.finished and inspect.iscoroutine(run.stage):
+                try:
+                    # A task in the run's context, so the collection's spans are children of the run's.
+                    collected = await self._loop.create_task(run.stage, context=run.context)
+                except Exception as e:
+                    print(f"❌ Backup of {run.device.name} raised: {e}")
+                    collected = False
+                self._step(run, collected)
+            if not run.finished:
+                await self._acquire("store", run, self._store_slots)
+        finally:
+            self._sessions.release()
+        if run.finished:
+            self._on_change(run)
+            return
+        try:
+            run.started = time.monotonic()
+            self._on_change(run)
+            while not run.finished:
+                await self._loop.run_in_executor(self._store_pool, self._step, run)
+        finally:
+            self._store_slots.release()
+        self._on_change(run)
+
+    async def _acquire(self, stage: str, run: StagedRun, slots: asyncio.Semaphore) -> None:
+        """Take one of `slots` for `stage`, recording the wait like a StagePipeline queue."""
+        if stage == "store":
+            run.started, run.queued_at = None, time.monotonic()
+        self._waiting[stage] += 1
+        metrics.set_stage_queue_depth(stage, self._waiting[stage])
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting[stage] -= 1
+            metrics.set_stage_queue_depth(stage, self._waiting[stage])
+        metrics.observe_stage_wait(stage, time.monotonic() - run.queued_at)
+
+    @staticmethod
+    def _step(run: StagedRun, value: Optional[bool] = None) -> None:
+        try:
+            run.step(value)
+        except Exception as e:
+            print(f"❌ Backup of {run.device.name} raised: {e}")
+
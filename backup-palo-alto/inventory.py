@@ -0,0 +1,266 @@
+"""Device inventory for fleet mode: many devices, each on its own schedule, in one process.
+
+INVENTORY_FILE is JSON. Schedules are cron expressions, given per device or through a
+named tier; fields a device does not set come from "defaults", then from the app's
+env configuration (HOST/PORT/USERNAME/PASSWORD/...) and CRONJOB_SCHEDULE:
+
+    {
+      "tiers": {"core": "*/15 * * * *", "access": "0 3 * * *"},
+      "defaults": {"username": "backup", "password_env": "BACKUP_PASSWORD", "tier": "access"},
+      "devices": [
+        {"name": "core-fw-1", "host": "10.0.0.1", "tier": "core"},
+        {"name": "branch-fw-7", "host": "10.7.0.1", "port": 2222, "schedule": "0 */6 * * *",
+         "site": "branch-7"}
+      ]
+    }
+
+Passwords can be given inline ("password") or, better, as the name of an env var
+("password_env").
+
+"limits" caps how many runs collect at the same time ("concurrency") and how fast they
+start ("rate" per second, with bursts of "burst"), per "site", "aaa" realm (both device
+fields, e.g. in "defaults") or "vendor" ("fortigate", "juniper" or "palo-alto": the app).
+"*" applies to every key not listed, to each on its own. The scheduler enforces them
+(admission.py):
+
+    "limits": {
+      "site": {"*": {"concurrency": 2}, "dc-1": {"concurrency": 32}},
+      "aaa": {"tacacs-eu": {"rate": 5, "burst": 10}},
+      "vendor": {"*": {"rate": 50}}
+    }
+
+`InventoryWatcher` polls the file and hands every valid new version to the scheduler,
+so devices and schedules change without restarting the process.
+"""
+import json
+import math
+import os
+import re
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from croniter import croniter
+
+import metrics
+
+INVENTORY_FILE = os.environ.get("INVENTORY_FILE")
+# How often the inventory file is checked for changes (seconds). 0 disables reloading.
+INVENTORY_RELOAD_INTERVAL = float(os.environ.get("INVENTORY_RELOAD_INTERVAL", "30"))
+
+_DEVICE_FIELDS = ("name", "host", "port", "username", "password", "password_env", "prompt",
+                  "verify_ssl", "schedule", "tier", "site", "aaa")
+# What admission limits can be keyed by.
+LIMIT_KINDS = ("site", "aaa", "vendor")
+
+
+class InventoryError(ValueError):
+    """The inventory file is missing, not valid JSON, or describes an invalid device."""
+
+
+class Device(NamedTuple):
+    name: str
+    host: Optional[str]
+    port: int
+    username: Optional[str]
+    password: Optional[str] = None
+    # CLI prompt that ends the config output (FW_NAME / SW_NAME); unused for Palo Alto.
+    prompt: Optional[str] = None
+    verify_ssl: bool = False
+    schedule: Optional[str] = None
+    # Admission keys (inventory "limits"): where the device is and which AAA servers log it in.
+    site: Optional[str] = None
+    aaa: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return (f"Device(name={self.name!r}, host={self.host!r}, port={self.port}, "
+                f"username={self.username!r}, schedule={self.schedule!r})")
+
+
+class Limit(NamedTuple):
+    """Admission limit of one site, AAA realm or vendor; 0 = no limit."""
+    # Runs collecting at the same time.
+    concurrency: int = 0
+    # Runs started per second (token bucket), and how many may start at once after a quiet spell
+    # (0 = one second's worth).
+    rate: float = 0
+    burst: int = 0
+
+    @property
+    def bucket(self) -> int:
+        """Size of the token bucket: `burst`, else one second's worth of starts."""
+        return self.burst or max(1, math.ceil(self.rate))
+
+
+# kind ("site", "aaa", "vendor") -> key (or "*" for the others) -> limit
+Limits = Dict[str, Dict[str, Limit]]
+
+
+def safe_name(name: str) -> str:
+    """`name` reduced to characters that are safe in file and object names."""
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name)
+
+
+def load(path: str, template: Device) -> List[Device]:
+    """
+    Read the inventory at `path`. `template` supplies the values a device and the
+    "defaults" section leave unset (the env-configured device, with CRONJOB_SCHEDULE).
+    Raises InventoryError with a message naming the offending device.
+    """
+    return load_with_limits(path, template)[0]
+
+
+def _limits(data) -> Limits:
+    if not isinstance(data, dict):
+        raise InventoryError("'limits' must be an object")
+    limits: Limits = {}
+    for kind, keys in data.items():
+        if kind not in LIMIT_KINDS:
+            raise InventoryError(f"limits: unknown kind {kind!r} (expected {', '.join(LIMIT_KINDS)})")
+        if not isinstance(keys, dict):
+            raise InventoryError(f"limits.{kind}: expected an object of {kind} names")
+        limits[kind] = {}
+        for key, fields in keys.items():
+            where = f"limits.{kind}.{key}"
+            if not isinstance(fields, dict) or set(fields) - set(Limit._fields):
+                raise InventoryError(f"{where}: expected an object with {', '.join(Limit._fields)}")
+            try:
+                limit = Limit(int(fields.get("concurrency", 0)), float(fields.get("rate", 0)),
+                              int(fields.get("burst", 0)))
+            except (TypeError, ValueError):
+                raise InventoryError(f"{where}: limits must be numbers") from None
+            if min(limit) < 0:
+                raise InventoryError(f"{where}: limits must not be negative")
+            limits[kind][key] = limit
+    return limits
+
+
+def load_with_limits(path: str, template: Device) -> Tuple[List[Device], Limits]:
+    """load(), plus the admission limits of the "limits" section (empty without one)."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except OSError as e:
+        raise InventoryError(f"cannot read inventory {path}: {e}") from e
+    except ValueError as e:
+        raise InventoryError(f"inventory {path} is not valid JSON: {e}") from e
+    if not isinstance(data, dict) or not isinstance(data.get("devices"), list):
+        raise InventoryError(f"inventory {path} must be an object with a 'devices' list")
+
+    limits = _limits(data.get("limits") or {})
+    tiers = data.get("tiers") or {}
+    defaults = data.get("defaults") or {}
+    devices = []
+    seen = set()
+    for index, entry in enumerate(data["devices"]):
+        if not isinstance(entry, dict):
+            raise InventoryError(f"device #{index + 1}: expected an object")
+        unknown = set(entry) - set(_DEVICE_FIELDS)
+        if unknown:
+            raise InventoryError(f"device #{index + 1}: unknown field(s) {', '.join(sorted(unknown))}")
+        fields = dict(defaults)
+        fields.update(entry)
+        name = fields.get("name") or fields.get("host")
+        if not name or not fields.get("host"):
+            raise InventoryError(f"device #{index + 1}: 'host' is required")
+        if name in seen:
+            raise InventoryError(f"device {name!r}: duplicate name")
+        seen.add(name)
+
+        schedule = entry.get("schedule")
+        tier = fields.get("tier")
+        if schedule is None and tier is not None:
+            if tier not in tiers:
+                raise InventoryError(f"device {name!r}: unknown tier {tier!r}")
+            schedule = tiers[tier]
+        schedule = schedule or defaults.get("schedule") or template.schedule
+        if not schedule or not croniter.is_valid(schedule):
+            raise InventoryError(f"device {name!r}: invalid schedule {schedule!r}")
+
+        password = fields.get("password")
+        if "password_env" in fields:
+            password = os.environ.get(fields["password_env"])
+            if password is None:
+                raise InventoryError(f"device {name!r}: env var {fields['password_env']} is not set")
+        try:
+            port = int(fields.get("port", template.port))
+        except (TypeError, ValueError):
+            raise InventoryError(f"device {name!r}: invalid port {fields.get('port')!r}") from None
+        # Like the VERIFY_SSL env var: true/false, as a JSON boolean or a string in any case.
+        verify_ssl = fields.get("verify_ssl", template.verify_ssl)
+        if isinstance(verify_ssl, str) and verify_ssl.lower() in ("true", "false"):
+            verify_ssl = verify_ssl.lower() == "true"
+        if not isinstance(verify_ssl, bool):
+            raise InventoryError(f"device {name!r}: invalid verify_ssl {fields['verify_ssl']!r} (expected true or false)")
+
+        devices.append(Device(
+            name=str(name),
+            host=fields["host"],
+            port=port,
+            username=fields.get("username", template.username),
+            password=password if password is not None else template.password,
+            prompt=fields.get("prompt", template.prompt),
+            verify_ssl=verify_ssl,
+            schedule=schedule,
+            site=fields.get("site"),
+            aaa=fields.get("aaa"),
+        ))
+    return devices, limits
+
+
+class InventoryWatcher(threading.Thread):
+    """
+    Re-reads the inventory when the file changes (mtime, size or inode, so atomic
+    replaces and Kubernetes ConfigMap updates are seen) and calls `on_change(devices)`.
+    An invalid new version is reported and ignored: the current devices keep running.
+    `limits` holds the admission limits of the version last loaded.
+    """
+
+    def __init__(self, path: str, template: Device, on_change: Callable[[List[Device]], None],
+                 interval: float = INVENTORY_RELOAD_INTERVAL):
+        super().__init__(name="inventory-watcher", daemon=True)
+        self.path = path
+        self.template = template
+        self.on_change = on_change
+        self.interval = interval
+        self.limits: Limits = {}
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._wake = threading.Event()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def load(self) -> List[Device]:
+        """Read the current version (raises InventoryError) and remember it as seen."""
+        stamp = self._file_stamp()
+        devices, self.limits = load_with_limits(self.path, self.template)
+        self._stamp = stamp
+        return devices
+
+    def check(self) -> None:
+        """Reload now if the file changed since the last load."""
+        stamp = self._file_stamp()
+        if stamp is None or stamp == self._stamp:
+            return
+        try:
+            devices = self.load()
+        except InventoryError as e:
+            self._stamp = stamp  # report each broken version once
+            metrics.record_inventory_reload('invalid')
+            print(f"⚠️  Inventory not reloaded, keeping the current devices: {e}")
+            return
+        metrics.record_inventory_reload('applied')
+        self.on_change(devices)
+
+    def trigger(self) -> None:
+        """Check the file now instead of at the next interval (e.g. on SIGHUP)."""
+        self._wake.set()
+
+    def run(self) -> None:
+        while True:
+            self._wake.wait(self.interval if self.interval > 0 else None)
+            self._wake.clear()
+            self.check()
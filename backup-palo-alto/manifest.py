@@ -0,0 +1,111 @@
+"""Local index of uploaded backup objects.
+
+Every successful cloud upload appends one JSON line to MANIFEST_FILE. Retention
+(and anything else that needs "which objects exist for this device") reads this
+index instead of listing the bucket.
+
+Retention may run in another process (`python retention.py` as a separate job) while the
+collector keeps appending. Appends and rewrites therefore hold an exclusive flock on
+`<MANIFEST_FILE>.lock` as well as the in-process lock, so an entry appended during a
+rewrite is never lost.
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional
+
+# JSON-lines index file. Keep it on the persistent volume (/app) next to the backups.
+MANIFEST_FILE = os.environ.get("MANIFEST_FILE", "backup_manifest.jsonl")
+
+_lock = threading.Lock()
+
+
+def record_upload(device: str, provider: str, bucket: str, key: str, size: int,
+                  timestamp: Optional[float] = None, checksums: Optional[dict] = None) -> dict:
+    """
+    Append an uploaded object to the manifest and return the stored entry.
+    `checksums` ({'sha256': ..., 'md5' / 'crc32c': ...}) is stored as-is when given.
+    """
+    entry = {
+        "device": device,
+        "provider": provider,
+        "bucket": bucket,
+        "key": key,
+        "size": size,
+        "timestamp": timestamp if timestamp is not None else time.time(),
+    }
+    if checksums:
+        entry.update(checksums)
+    line = json.dumps(entry, separators=(",", ":")) + "\n"
+    with _locked():
+        with open(MANIFEST_FILE, "a") as f:
+            f.write(line)
+    return entry
+
+
+def load_entries() -> List[dict]:
+    """Return all manifest entries (oldest first). Missing file means no entries; corrupt lines are skipped."""
+    with _locked():
+        return _read()
+
+
+def remove_keys(removed: Iterable[tuple]) -> int:
+    """
+    Drop entries whose (provider, bucket, key) is in `removed` and rewrite the file atomically.
+    Returns the number of entries removed.
+    """
+    removed = set(removed)
+    if not removed:
+        return 0
+    with _locked():
+        entries = _read()
+        kept = [e for e in entries if (e.get("provider"), e.get("bucket"), e.get("key")) not in removed]
+        fd, tmp_path = tempfile.mkstemp(prefix=".manifest-", dir=os.path.dirname(MANIFEST_FILE) or ".")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for e in kept:
+                    f.write(json.dumps(e, separators=(",", ":")) + "\n")
+            try:
+                # mkstemp() creates the file 0600: keep the manifest's own mode.
+                os.chmod(tmp_path, os.stat(MANIFEST_FILE).st_mode & 0o777)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, MANIFEST_FILE)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return len(entries) - len(kept)
+
+
+@contextmanager
+def _locked() -> Iterator[None]:
+    """Hold the manifest against other threads and other processes (see the module docstring)."""
+    with _lock:
+        # A lock file of its own: the manifest itself is replaced by every rewrite.
+        with open(f"{MANIFEST_FILE}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read() -> List[dict]:
+    entries = []
+    try:
+        with open(MANIFEST_FILE) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
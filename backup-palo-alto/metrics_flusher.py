@@ -0,0 +1,123 @@
+"""Background, batched Pushgateway pushes.
+
+Runs hand a per-device `RunSample` to `submit()`, which never blocks: samples go into
+a bounded queue (full queue -> sample dropped and counted). A single worker thread
+applies them to the shared registry (device-labelled series) and pushes the whole
+registry once per batch or interval, so a slow Pushgateway never stretches a backup
+cycle and N devices cost one push per batch instead of one per device.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+import metrics
+import tracing
+
+METRICS_QUEUE_SIZE = int(os.environ.get('METRICS_QUEUE_SIZE', '1000'))
+METRICS_PUSH_BATCH_SIZE = int(os.environ.get('METRICS_PUSH_BATCH_SIZE', '100'))
+METRICS_PUSH_INTERVAL = float(os.environ.get('METRICS_PUSH_INTERVAL', '10'))
+# How long process exit may wait for the final push.
+METRICS_FLUSH_TIMEOUT = float(os.environ.get('METRICS_FLUSH_TIMEOUT', '10'))
+
+
+class RunSample(NamedTuple):
+    device: str
+    success: bool
+    durations: Dict[str, float]
+    bytes_uploaded: float
+    timestamp: float
+
+
+class _Flusher(threading.Thread):
+    def __init__(self, gateway: str, job: str, instance: str):
+        super().__init__(name='metrics-flusher', daemon=True)
+        self.gateway = gateway
+        self.job = job
+        self.instance = instance
+        self.queue: "queue.Queue[RunSample]" = queue.Queue(maxsize=METRICS_QUEUE_SIZE)
+        self.stopping = threading.Event()
+
+    def run(self) -> None:
+        pending = 0
+        first_pending_at = 0.0
+        while True:
+            if pending:
+                wait = max(0.0, first_pending_at + METRICS_PUSH_INTERVAL - time.monotonic())
+            else:
+                wait = 0.5
+            try:
+                sample = self.queue.get(timeout=0.05 if self.stopping.is_set() else wait)
+            except queue.Empty:
+                sample = None
+            # Apply everything already queued: the registry is cumulative, so one push covers it all.
+            while sample is not None:
+                metrics.record_run(sample.device, sample.success, sample.durations, sample.bytes_uploaded, sample.timestamp)
+                if not pending:
+                    first_pending_at = time.monotonic()
+                pending += 1
+                try:
+                    sample = self.queue.get_nowait()
+                except queue.Empty:
+                    sample = None
+            metrics.set_push_queue_depth(0)
+
+            due = pending and (
+                pending >= METRICS_PUSH_BATCH_SIZE
+                or time.monotonic() - first_pending_at >= METRICS_PUSH_INTERVAL
+                or self.stopping.is_set()
+            )
+            if due:
+                with tracing.span("metrics_push", samples=pending):
+                    metrics.push_metrics(self.gateway, self.job, self.instance)
+                pending = 0
+            if self.stopping.is_set() and not pending and self.queue.empty():
+                return
+
+
+_flusher: Optional[_Flusher] = None
+_lock = threading.Lock()
+
+
+def start(gateway: str, job: str, instance: str) -> None:
+    """Start the background flusher (idempotent). The final push happens at process exit."""
+    global _flusher
+    with _lock:
+        if _flusher is not None:
+            return
+        _flusher = _Flusher(gateway, job, instance)
+        _flusher.start()
+        atexit.register(stop)
+
+
+def submit(sample: RunSample) -> bool:
+    """
+    Queue a run sample without blocking. Returns False if it was dropped (queue full).
+    Without a running flusher (e.g. metrics served over HTTP) the sample is applied directly.
+    """
+    flusher = _flusher
+    if flusher is None:
+        metrics.record_run(sample.device, sample.success, sample.durations, sample.bytes_uploaded, sample.timestamp)
+        return True
+    try:
+        flusher.queue.put_nowait(sample)
+    except queue.Full:
+        metrics.record_sample_dropped()
+        return False
+    metrics.set_push_queue_depth(flusher.queue.qsize())
+    return True
+
+
+def stop(timeout: float = None) -> None:
+    """Push whatever is pending and stop the worker, waiting at most `timeout` seconds."""
+    global _flusher
+    with _lock:
+        flusher, _flusher = _flusher, None
+    if flusher is None:
+        return
+    flusher.stopping.set()
+    flusher.join(METRICS_FLUSH_TIMEOUT if timeout is None else timeout)
+    if flusher.is_alive():
+        print(f"⚠️ Metrics push still pending after {METRICS_FLUSH_TIMEOUT if timeout is None else timeout:.0f}s; exiting without it")
@@ -1,17 +1,32 @@
 """Palo Alto backup: fetch running config via API and upload to cloud or keep locally."""
+import asyncio
 import logging
 import os
 import sys
 import time
 import xml.etree.ElementTree as ET
+from typing import Awaitable, Callable, Optional
 from urllib.parse import quote
 
 import requests
 import urllib3
 from urllib3.exceptions import InsecureRequestWarning
 
+import catalog
 import cloud_upload
+import inventory
 import metrics
+import metrics_flusher
+import offload
+import profiling
+import retention
+import scheduling
+import session_capture
+import tracing
+import transform
+
+if scheduling.SCHEDULER_ENGINE == "asyncio":
+    import aiohttp
 
 urllib3.disable_warnings(InsecureRequestWarning)
 
@@ -20,14 +35,28 @@ HOST = os.environ.get("HOST")
 PORT = os.environ.get("PORT", "443")
 USERNAME = os.environ.get("USERNAME")
 PASSWORD = os.environ.get("PASSWORD")
+DEVICE_NAME = os.environ.get("DEVICE_NAME", HOST or "unknown")
 backup_file = "palo_alto_backup.xml"
 VERIFY_SSL = os.environ.get("VERIFY_SSL", "false").lower() == "true"
+# Read size of the configuration response body (streamed into the backup file).
+_CONFIG_CHUNK_SIZE = 1 << 16
 
 USE_METRICS = os.environ.get("metrics-pushgw", "false").lower() == "true"
 PUSHGATEWAY_ADDR = os.environ.get("PUSHGATEWAY_ADDR", "pushgateway:9091")
 PUSHGATEWAY_JOB = os.environ.get("PUSHGATEWAY_JOB", "backup-palo-alto")
 PUSHGATEWAY_INSTANCE = os.environ.get("PUSHGATEWAY_INSTANCE", HOST or "unknown")
 
+def env_device() -> inventory.Device:
+    """The device configured through HOST/PORT/USERNAME/PASSWORD/VERIFY_SSL."""
+    return inventory.Device(DEVICE_NAME, HOST, int(PORT or 443), USERNAME, PASSWORD, verify_ssl=VERIFY_SSL)
+
+
+def backup_path(device: inventory.Device) -> str:
+    """Local backup file of an inventory device: `backup_file` with the device name appended."""
+    base, ext = os.path.splitext(backup_file)
+    return f"{base}_{inventory.safe_name(device.name)}{ext}"
+
+
 def configure_logging() -> None:
     level_name = os.environ.get("LOG_LEVEL", "INFO").upper()
     level = getattr(logging, level_name, logging.INFO)
@@ -37,33 +66,42 @@ def configure_logging() -> None:
             logging.getLogger(lib).setLevel(logging.WARNING)
 
 
-def get_full_configuration() -> bool:
+def get_full_configuration(device: inventory.Device, backup_file: str) -> bool:
     """Get Palo Alto API key, fetch running config, save to backup_file."""
     start_time = time.time()
     error_type = None
 
-    if not all([HOST, USERNAME, PASSWORD]):
+    if not all([device.host, device.username, device.password]):
         print("❌ HOST, USERNAME, and PASSWORD must be set")
+        tracing.set_attribute("error_type", "connection_error")
         if USE_METRICS:
             metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type="connection_error").inc()
             metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
         return False
 
-    base_url = f"https://{HOST}:{PORT}" if PORT != "443" else f"https://{HOST}"
+    base_url = f"https://{device.host}:{device.port}" if device.port != 443 else f"https://{device.host}"
     api_base = f"{base_url}/api"
 
+    # One session for keygen and config so the second request reuses the TCP/TLS connection.
+    session = requests.Session()
+    # Also passed per request: requests lets REQUESTS_CA_BUNDLE override a session-level verify=False.
+    session.verify = device.verify_ssl
+    session_capture.mount(session, device.name)
     try:
-        print(f"Connecting to Palo Alto: {HOST}:{PORT}...")
+        print(f"Connecting to Palo Alto: {device.host}:{device.port}...")
 
-        # Get API key
-        key_url = f"{api_base}/?type=keygen&user={quote(USERNAME, safe='')}&password={quote(PASSWORD, safe='')}"
+        # Get API key (on a fresh connection this includes TCP connect and TLS handshake)
+        key_url = f"{api_base}/?type=keygen&user={quote(device.username, safe='')}&password={quote(device.password, safe='')}"
         try:
-            key_resp = requests.get(key_url, verify=VERIFY_SSL, timeout=30)
-            key_resp.raise_for_status()
+            auth_start = time.perf_counter()
+            with tracing.span("auth", username=device.username):
+                key_resp = session.get(key_url, timeout=30, verify=device.verify_ssl)
+                key_resp.raise_for_status()
         except requests.RequestException as e:
             resp = getattr(e, "response", None)
             status = resp.status_code if resp is not None else None
             error_type = "authentication_error" if status in (401, 403) else "connection_error"
+            tracing.set_attribute("error_type", error_type)
             if USE_METRICS:
                 metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
                 metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
@@ -75,6 +113,7 @@ def get_full_configuration() -> bool:
         if key_elem is None or not key_elem.text:
             msg = root.find(".//msg")
             err = msg.text if msg is not None else key_resp.text[:500]
+            tracing.set_attribute("error_type", "authentication_error")
             if USE_METRICS:
                 metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type="authentication_error").inc()
                 metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
@@ -83,6 +122,7 @@ def get_full_configuration() -> bool:
 
         api_key = key_elem.text
         if USE_METRICS:
+            metrics.observe_phase("auth", time.perf_counter() - auth_start)
             metrics.BACKUP_PALO_CONNECTION_SUCCESS_TOTAL.inc()
         print("✅ Successfully authenticated to Palo Alto")
 
@@ -93,30 +133,191 @@ def get_full_configuration() -> bool:
                 "cmd": "<show><config><running></running></config></show>",
                 "key": api_key,
             }
-            config_resp = requests.post(f"{api_base}/", data=values, verify=VERIFY_SSL, timeout=60)
-            config_resp.raise_for_status()
+            request_start = time.perf_counter()
+            with tracing.span("command", command="show config running") as command_span:
+                # stream=True returns once the headers arrive. The body is then read chunk by chunk
+                # straight into the backup file, and its XML envelope checked on the way: a multi-MB
+                # configuration is never held in memory.
+                config_resp = session.post(f"{api_base}/", data=values, timeout=60, stream=True,
+                                           verify=device.verify_ssl)
+                first_byte = time.perf_counter()
+                config_resp.raise_for_status()
+                envelope = transform.XmlEnvelope(("result", "response"))
+                head = b""
+                received = lines = 0
+                write_time = 0.0
+                try:
+                    with transform.open_backup(backup_file, "panos") as f:
+                        for chunk in config_resp.iter_content(_CONFIG_CHUNK_SIZE):
+                            if len(head) < 500:
+                                head += chunk[:500 - len(head)]
+                            received += len(chunk)
+                            lines += chunk.count(b"\n")
+                            envelope.feed(chunk)
+                            write_start = time.perf_counter()
+                            f.write(chunk)
+                            write_time += time.perf_counter() - write_start
+                        transfer_end = time.perf_counter()
+                        valid = envelope.close()
+                except BaseException:
+                    _discard_backup(backup_file)
+                    raise
+                command_span.set_attributes(bytes=received, lines=lines, sha256=f.digests()["sha256"])
         except requests.RequestException as e:
             error_type = "configuration_error"
+            tracing.set_attribute("error_type", error_type)
             if USE_METRICS:
                 metrics.BACKUP_PALO_CONFIGURATION_FAILURE_TOTAL.labels(error_type=error_type).inc()
                 metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="configuration").set(time.time())
             print(f"❌ Failed to fetch running config: {e}")
             return False
 
-        root = ET.fromstring(config_resp.text)
-        if root.find(".//result") is None and root.find(".//response") is None:
-            err = config_resp.text[:500] if config_resp.text else "Unknown error"
+        if not valid:
+            _discard_backup(backup_file)
+            err = head.decode(errors="replace") if head else "Unknown error"
+            tracing.set_attribute("error_type", "configuration_error")
             if USE_METRICS:
                 metrics.BACKUP_PALO_CONFIGURATION_FAILURE_TOTAL.labels(error_type="configuration_error").inc()
                 metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="configuration").set(time.time())
             print(f"❌ Invalid config response: {err}")
             return False
 
-        with open(backup_file, "w") as f:
-            f.write(config_resp.text)
+        print(f"✅ Configuration saved to: {backup_file}")
+        if USE_METRICS:
+            metrics.observe_phase("first_byte", first_byte - request_start)
+            metrics.observe_phase("write", write_time)
+            metrics.record_transfer(received, lines, transfer_end - first_byte)
+            metrics.BACKUP_PALO_CONFIGURATION_SUCCESS_TOTAL.inc()
+            metrics.BACKUP_PALO_LAST_SUCCESS_TIMESTAMP.labels(operation="configuration").set(time.time())
+            duration = time.time() - start_time
+            metrics.BACKUP_PALO_DURATION_SECONDS.labels(operation="configuration").observe(duration)
+        return True
+
+    except ET.ParseError as e:
+        tracing.set_attribute("error_type", "api_error")
+        if USE_METRICS:
+            metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type="api_error").inc()
+            metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
+        print(f"❌ Invalid API response (XML): {e}")
+        return False
+    except Exception as e:
+        if error_type is None:
+            error_type = "unknown_error"
+        tracing.set_attribute("error_type", error_type)
+        if USE_METRICS:
+            metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+            metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
+        print(f"❌ Error: {e}")
+        return False
+    finally:
+        session.close()
+
+
+async def get_full_configuration_async(device: inventory.Device, backup_file: str) -> bool:
+    """
+    get_full_configuration() for the asyncio engine (SCHEDULER_ENGINE=asyncio): over
+    aiohttp, on the event loop. The XML check and the write of the configuration run on a
+    thread, where offload can take them on without blocking the loop. The session is not
+    captured or replayed (session_capture): cronjob refuses SESSION_REPLAY_FILE on this engine.
+    """
+    start_time = time.time()
+    error_type = None
+
+    if not all([device.host, device.username, device.password]):
+        print("❌ HOST, USERNAME, and PASSWORD must be set")
+        tracing.set_attribute("error_type", "connection_error")
+        if USE_METRICS:
+            metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type="connection_error").inc()
+            metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
+        return False
+
+    base_url = f"https://{device.host}:{device.port}" if device.port != 443 else f"https://{device.host}"
+    api_base = f"{base_url}/api"
+
+    # One session for keygen and config so the second request reuses the TCP/TLS connection.
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=device.verify_ssl))
+    try:
+        print(f"Connecting to Palo Alto: {device.host}:{device.port}...")
+
+        key_url = f"{api_base}/?type=keygen&user={quote(device.username, safe='')}&password={quote(device.password, safe='')}"
+        try:
+            auth_start = time.perf_counter()
+            with tracing.span("auth", username=device.username):
+                async with session.get(key_url, timeout=_timeout(30)) as key_resp:
+                    key_resp.raise_for_status()
+                    key_text = await key_resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = getattr(e, "status", None)
+            error_type = "authentication_error" if status in (401, 403) else "connection_error"
+            tracing.set_attribute("error_type", error_type)
+            if USE_METRICS:
+                metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
+            print(f"❌ API keygen failed: {e}")
+            return False
+
+        root = ET.fromstring(key_text)
+        key_elem = root.find(".//key")
+        if key_elem is None or not key_elem.text:
+            msg = root.find(".//msg")
+            err = msg.text if msg is not None else key_text[:500]
+            tracing.set_attribute("error_type", "authentication_error")
+            if USE_METRICS:
+                metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type="authentication_error").inc()
+                metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
+            print(f"❌ API did not return a key: {err}")
+            return False
+
+        api_key = key_elem.text
+        if USE_METRICS:
+            metrics.observe_phase("auth", time.perf_counter() - auth_start)
+            metrics.BACKUP_PALO_CONNECTION_SUCCESS_TOTAL.inc()
+        print("✅ Successfully authenticated to Palo Alto")
+
+        try:
+            values = {
+                "type": "op",
+                "cmd": "<show><config><running></running></config></show>",
+                "key": api_key,
+            }
+            request_start = time.perf_counter()
+            with tracing.span("command", command="show config running") as command_span:
+                async with session.post(f"{api_base}/", data=values, timeout=_timeout(60)) as config_resp:
+                    # The response is returned once the headers arrive, so the body read below is the transfer.
+                    first_byte = time.perf_counter()
+                    config_resp.raise_for_status()
+                    body = await config_resp.read()
+                transfer_end = time.perf_counter()
+                command_span.set_attributes(bytes=len(body), lines=body.count(b"\n"))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_type = "configuration_error"
+            tracing.set_attribute("error_type", error_type)
+            if USE_METRICS:
+                metrics.BACKUP_PALO_CONFIGURATION_FAILURE_TOTAL.labels(error_type=error_type).inc()
+                metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="configuration").set(time.time())
+            print(f"❌ Failed to fetch running config: {e}")
+            return False
+
+        if not await asyncio.to_thread(offload.call, transform.has_element, body, ("result", "response")):
+            err = body[:500].decode(errors="replace") if body else "Unknown error"
+            tracing.set_attribute("error_type", "configuration_error")
+            if USE_METRICS:
+                metrics.BACKUP_PALO_CONFIGURATION_FAILURE_TOTAL.labels(error_type="configuration_error").inc()
+                metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="configuration").set(time.time())
+            print(f"❌ Invalid config response: {err}")
+            return False
+
+        write_start = time.perf_counter()
+        with tracing.span("write") as write_span:
+            f = await asyncio.to_thread(_write_backup, backup_file, body)
+            write_span.set_attributes(bytes=f.bytes_written, sha256=f.digests()["sha256"])
+        write_time = time.perf_counter() - write_start
 
         print(f"✅ Configuration saved to: {backup_file}")
         if USE_METRICS:
+            metrics.observe_phase("first_byte", first_byte - request_start)
+            metrics.observe_phase("write", write_time)
+            metrics.record_transfer(len(body), body.count(b"\n"), transfer_end - first_byte)
             metrics.BACKUP_PALO_CONFIGURATION_SUCCESS_TOTAL.inc()
             metrics.BACKUP_PALO_LAST_SUCCESS_TIMESTAMP.labels(operation="configuration").set(time.time())
             duration = time.time() - start_time
@@ -124,6 +325,7 @@ def get_full_configuration() -> bool:
         return True
 
     except ET.ParseError as e:
+        tracing.set_attribute("error_type", "api_error")
         if USE_METRICS:
             metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type="api_error").inc()
             metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
@@ -132,14 +334,37 @@ def get_full_configuration() -> bool:
     except Exception as e:
         if error_type is None:
             error_type = "unknown_error"
+        tracing.set_attribute("error_type", error_type)
         if USE_METRICS:
             metrics.BACKUP_PALO_CONNECTION_FAILURE_TOTAL.labels(error_type=error_type).inc()
             metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="connection").set(time.time())
         print(f"❌ Error: {e}")
         return False
+    finally:
+        await session.close()
+
+
+def _timeout(seconds: float) -> "aiohttp.ClientTimeout":
+    """Like requests' timeout=: for the connect and between reads, not for the whole request."""
+    return aiohttp.ClientTimeout(total=None, sock_connect=seconds, sock_read=seconds)
+
 
+def _discard_backup(backup_file: str) -> None:
+    """Remove what was written of a configuration that turned out to be invalid or cut short."""
+    try:
+        os.remove(backup_file)
+    except FileNotFoundError:
+        pass
+
+
+def _write_backup(backup_file: str, body: bytes):
+    """Write a fetched configuration through the transform stages; returns the closed pipeline."""
+    with transform.open_backup(backup_file, "panos") as f:
+        f.write(body)
+    return f
 
-def backup_data() -> bool:
+
+def backup_data(device: inventory.Device, backup_file: str) -> bool:
     """Upload backup file to cloud (AWS/Azure). If cloud disabled, skip and keep file locally."""
     start_time = time.time()
 
@@ -152,7 +377,8 @@ def backup_data() -> bool:
             print("⚠️  Cloud upload disabled and backup file not found.")
         return True
 
-    success, file_size, error_type = cloud_upload.upload_backup(backup_file, "backup-palo-alto")
+    upload_start = time.perf_counter()
+    success, file_size, error_type = cloud_upload.upload_backup(backup_file, "backup-palo-alto", device=device.name)
 
     if success:
         if USE_METRICS:
@@ -161,46 +387,100 @@ def backup_data() -> bool:
             metrics.record_upload_success(file_size)
             duration = time.time() - start_time
             metrics.BACKUP_PALO_DURATION_SECONDS.labels(operation="storage_upload").observe(duration)
+            metrics.observe_phase("upload", time.perf_counter() - upload_start)
         return True
 
     if error_type:
+        tracing.set_attribute("error_type", error_type)
         if USE_METRICS:
             metrics.BACKUP_PALO_STORAGE_CLOUD_UPLOAD_FAILURE_TOTAL.labels(error_type=error_type).inc()
             metrics.BACKUP_PALO_LAST_FAILURE_TIMESTAMP.labels(operation="storage_upload").set(time.time())
     return False
 
 
-def run_backup_once() -> bool:
-    """Run a single backup cycle and push metrics (if enabled)."""
-    overall_start_time = time.time()
+def run_backup_once(device: inventory.Device = None) -> bool:
+    """
+    Run a single backup cycle and record its metrics (pushed in the background unless served over HTTP).
+    Backs up the env-configured device to `backup_file`, or the given inventory device to its own file.
+    """
+    success = scheduling.run_stages(backup_stages(device))
+    if success and retention.RETENTION_ENABLED and cloud_upload.is_cloud_enabled():
+        # Once per run here; fleet mode prunes on RETENTION_SCHEDULE instead (retention.start_scheduled).
+        retention.run_retention()
+    return success
+
+
+@profiling.profiled_stages("palo_alto_backup", upload_prefix="backup-palo-alto")
+def backup_stages(device: inventory.Device = None,
+                  collect: Optional[Callable[[inventory.Device, str], Awaitable[bool]]] = None) -> scheduling.Stages:
+    """
+    run_backup_once() in stages, for the fleet scheduler: collects, yields "store", then
+    uploads and records the metrics. The scheduler may run the "store" part on another
+    thread (SCHEDULER_STORE_WORKERS). Returns whether the run succeeded.
+    With `collect` (get_full_configuration_async), yields collect(device, path) for the
+    asyncio engine to await, and continues with the result it is sent.
+    """
+    if device is None:
+        device, path = env_device(), backup_file
+    else:
+        path = backup_path(device)
+    path = transform.output_path(path)
+    with tracing.span("backup_run", device=device.name) as run_span:
+        overall_start_time = time.time()
 
-    if USE_METRICS:
-        metrics.init_failure_gauges(aws_enabled=cloud_upload.USE_AWS, azure_enabled=cloud_upload.USE_AZURE, gcp_enabled=cloud_upload.USE_GCP)
+        if USE_METRICS:
+            metrics.init_failure_gauges(aws_enabled=cloud_upload.USE_AWS, azure_enabled=cloud_upload.USE_AZURE, gcp_enabled=cloud_upload.USE_GCP)
+
+        with tracing.span("collect"):
+            if collect is None:
+                config_success = get_full_configuration(device, path)
+            else:
+                config_success = yield collect(device, path)
+        durations = {"configuration": time.time() - overall_start_time}
+        backup_size = os.path.getsize(path) if config_success and os.path.exists(path) else 0
+        yield "store"
+        if config_success:
+            upload_start_time = time.time()
+            with tracing.span("store"):
+                cloud_success = backup_data(device, path)
+            durations["storage_upload"] = time.time() - upload_start_time
+        else:
+            print("❌ Configuration retrieval failed. Skipping cloud upload.")
+            cloud_success = False
 
-    config_success = get_full_configuration()
-    if config_success:
-        cloud_success = backup_data()
-    else:
-        print("❌ Configuration retrieval failed. Skipping cloud upload.")
-        cloud_success = False
+        if USE_METRICS:
+            overall_duration = time.time() - overall_start_time
+            metrics.BACKUP_PALO_DURATION_SECONDS.labels(operation="total").observe(overall_duration)
+            durations["total"] = overall_duration
+            if not metrics.is_serving():
+                # Pushed from a background thread: a slow Pushgateway must not hold up the run.
+                metrics_flusher.start(PUSHGATEWAY_ADDR, PUSHGATEWAY_JOB, PUSHGATEWAY_INSTANCE)
+            metrics_flusher.submit(metrics_flusher.RunSample(
+                device=device.name,
+                success=bool(config_success and cloud_success),
+                durations=durations,
+                bytes_uploaded=backup_size if cloud_success and cloud_upload.is_cloud_enabled() else 0,
+                timestamp=time.time(),
+            ))
+        else:
+            print("ℹ️  Metrics disabled. Set metrics-pushgw=true to enable Prometheus metrics.")
 
-    if USE_METRICS:
-        overall_duration = time.time() - overall_start_time
-        metrics.BACKUP_PALO_DURATION_SECONDS.labels(operation="total").observe(overall_duration)
-        metrics.push_metrics(PUSHGATEWAY_ADDR, PUSHGATEWAY_JOB, PUSHGATEWAY_INSTANCE)
-    else:
-        print("ℹ️  Metrics disabled. Set metrics-pushgw=true to enable Prometheus metrics.")
+        run_span.set_attributes(success=bool(config_success and cloud_success), bytes=backup_size)
 
     return bool(config_success and cloud_success)
 
 
 if __name__ == "__main__":
     configure_logging()
+    catalog.enable("palo-alto")
     # Decide whether to run once or via the cronjob helper, based on env.
     cronjob_enabled = os.environ.get("CRONJOB_ENABLED", "false").lower() == "true"
     if cronjob_enabled:
         from cronjob import run_cron_loop
 
+        if USE_METRICS:
+            # Long-running process: let Prometheus scrape us instead of pushing every cycle.
+            metrics.start_metrics_server()
         run_cron_loop()
     else:
         success = run_backup_once()
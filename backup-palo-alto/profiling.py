@@ -0,0 +1,186 @@
+"""On-demand profiling of backup runs (cProfile and tracemalloc).
+
+Enable with PROFILE_CPU=true and/or PROFILE_MEMORY=true. Every PROFILE_EVERY-th run
+(1 = every run; use a larger value in cron mode) writes to PROFILE_DIR:
+
+- <name>_<timestamp>_<run>.pstats      cProfile stats (`python -m pstats`, snakeviz, ...)
+- <name>_<timestamp>_<run>_memory.txt  peak traced memory and the top PROFILE_TOP allocation
+                                       sites still alive when the run ended (what it retained)
+
+Runs are profiled across their stages (`profiled_stages`), also in fleet mode. The memory
+report is process-wide: it includes whatever runs overlapped the profiled one.
+
+With PROFILE_UPLOAD=true the files are uploaded next to the backups (<prefix>/profiles/).
+Nothing here runs unless profiling is enabled.
+"""
+import cProfile
+import functools
+import os
+import threading
+import time
+import tracemalloc
+from typing import Callable, Generator, List, Optional
+
+PROFILE_CPU = os.environ.get("PROFILE_CPU", "false").lower() == "true"
+PROFILE_MEMORY = os.environ.get("PROFILE_MEMORY", "false").lower() == "true"
+PROFILE_EVERY = max(1, int(os.environ.get("PROFILE_EVERY", "1")))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "25"))
+PROFILE_UPLOAD = os.environ.get("PROFILE_UPLOAD", "false").lower() == "true"
+
+_runs = 0
+_tracers = 0    # profiled runs in flight that need tracemalloc
+_started_tracing = False
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return PROFILE_CPU or PROFILE_MEMORY
+
+
+def _sampled_run() -> Optional[int]:
+    """Number of this run if it is to be profiled (every PROFILE_EVERY-th), else None."""
+    global _runs
+    if not enabled():
+        return None
+    with _lock:
+        _runs += 1
+        run_number = _runs
+    return None if (run_number - 1) % PROFILE_EVERY else run_number
+
+
+def profiled_stages(name: str, upload_prefix: Optional[str] = None) -> Callable:
+    """
+    Decorator for a run in stages (scheduling.Stages): profile every PROFILE_EVERY-th run,
+    whether run_stages() or the fleet scheduler drives it. Each step is profiled on the
+    thread that runs it, so a store stage on a store worker is included; an awaitable the
+    run yields to the asyncio engine is not (it runs on the event loop, interleaved with
+    every other collection).
+    """
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            stages = fn(*args, **kwargs)
+            run_number = _sampled_run()
+            if run_number is None:
+                return stages
+            return _profile_stages(_Profile(name, upload_prefix, run_number), stages)
+        return wrapper
+    return decorator
+
+
+def _profile_stages(profile: "_Profile", stages: Generator) -> Generator:
+    value = None
+    try:
+        while True:
+            profile.resume()
+            try:
+                item = stages.send(value)
+            except StopIteration as done:
+                return done.value
+            finally:
+                profile.pause()
+            value = yield item
+    finally:
+        stages.close()
+        profile.finish()
+
+
+class _Profile:
+    """cProfile and tracemalloc state of one profiled run, resumed for each of its steps."""
+
+    def __init__(self, name: str, upload_prefix: Optional[str], run_number: int):
+        global _tracers, _started_tracing
+        self.name = name
+        self.upload_prefix = upload_prefix
+        self.run_number = run_number
+        self.base = os.path.join(PROFILE_DIR, f"{name}_{time.strftime('%Y%m%d-%H%M%S')}_{run_number}")
+        self.profiler = cProfile.Profile() if PROFILE_CPU else None
+        self.skipped_steps = 0
+        self.baseline = None
+        if PROFILE_MEMORY:
+            # tracemalloc is process-wide: it stays on while any profiled run is in flight.
+            with _lock:
+                if _tracers == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _started_tracing = True
+                _tracers += 1
+            tracemalloc.reset_peak()
+            self.baseline = tracemalloc.take_snapshot()
+
+    def resume(self) -> None:
+        if self.profiler is None:
+            return
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ allows one per process): this step
+            # of an overlapping profiled run goes unprofiled.
+            self.skipped_steps += 1
+
+    def pause(self) -> None:
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def finish(self) -> None:
+        global _tracers, _started_tracing
+        snapshot = None
+        if PROFILE_MEMORY:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            with _lock:
+                _tracers -= 1
+                if _tracers == 0 and _started_tracing:
+                    tracemalloc.stop()
+                    _started_tracing = False
+        files = []
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if self.profiler is not None:
+                self.profiler.dump_stats(f"{self.base}.pstats")
+                files.append(f"{self.base}.pstats")
+            if snapshot is not None:
+                _write_memory_report(f"{self.base}_memory.txt", self.name, self.run_number, self.baseline,
+                                     snapshot, current, peak)
+                files.append(f"{self.base}_memory.txt")
+            skipped = f" ({self.skipped_steps} steps not profiled: another profile was active)" if self.skipped_steps else ""
+            print(f"🔬 Profile of run #{self.run_number} written: {', '.join(files)}{skipped}")
+        except OSError as e:
+            print(f"⚠️ Could not write profile to {PROFILE_DIR}: {e}")
+        if PROFILE_UPLOAD and self.upload_prefix:
+            _upload(files, self.upload_prefix)
+
+
+def _write_memory_report(path: str, name: str, run_number: int, baseline, snapshot,
+                         current: int, peak: int) -> None:
+    ignore = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    )
+    stats = snapshot.filter_traces(ignore).compare_to(baseline.filter_traces(ignore), "lineno")
+    grown = [s for s in stats if s.size_diff > 0][:PROFILE_TOP]
+    lines = [
+        f"Run #{run_number} of {name}",
+        f"Traced memory at end of run: {current / 1024:.1f} KiB, peak during run: {peak / 1024:.1f} KiB",
+        "",
+        f"Top {len(grown)} allocation sites still alive at the end of the run (growth since it started):",
+    ]
+    for stat in grown:
+        frame = stat.traceback[0]
+        lines.append(f"  {stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  {frame.filename}:{frame.lineno}")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _upload(files: List[str], upload_prefix: str) -> None:
+    import cloud_upload
+
+    if not cloud_upload.is_cloud_enabled():
+        return
+    for path in files:
+        # Not recorded in the manifest: retention must only see backups.
+        success, _, error_type = cloud_upload.upload_backup(path, f"{upload_prefix}/profiles", track=False)
+        if not success:
+            print(f"⚠️ Could not upload profile {path} (error_type={error_type})")
@@ -0,0 +1,30 @@
+"""Locations of the three backup apps, so benchmarks can import their modules."""
+import importlib
+import importlib.util
+import os
+import sys
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+App = namedtuple("App", "directory main job prefix")
+
+APPS = {
+    "fortigate": App("backup-fortgiate-fw", "fortigate_backup", "backup-fw-fortigate", "backup_"),
+    "juniper": App("backup-juniper-sw", "juniper-sw", "backup-sw-juniper", "backup_sw_"),
+    "palo-alto": App("backup-palo-alto", "palo_alto_backup", "backup-palo-alto", "backup_palo_"),
+}
+
+
+def import_module(app: str, name: str):
+    """Import `name` from the given app directory (the apps share module names, so one app per process)."""
+    path = os.path.join(ROOT, APPS[app].directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    if name == APPS[app].main and "-" in name:
+        spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(path, f"{name}.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+        return module
+    return importlib.import_module(name)
@@ -0,0 +1,147 @@
+"""Benchmark: fleet throughput under admission limits (admission.py).
+
+Runs a FleetScheduler over --devices simulated devices spread over --sites sites and
+--realms AAA realms, every device due at once (FleetScheduler.trigger). A collection
+"logs in" and then takes --collect-seconds (a sleep, or asyncio.sleep on the asyncio
+engine); the store stage is free. Each engine runs twice in a spawned child: without
+limits, and with a per-site concurrency limit and a per-realm login rate. Reported are
+wall time against the lower bound the limits allow, the peak number of collections at
+one site, the peak logins per realm in any one-second window (what the AAA servers
+see), and admission waits. With limits, the peaks must stay within them while the wall
+time stays close to the bound: runs held back by their site must not hold up the rest.
+
+    python benchmarks/bench_admission.py --devices 600 --sites 60 --workers 32
+    python benchmarks/bench_admission.py --engines asyncio --workers 500 --realm-rate 50
+"""
+import argparse
+import asyncio
+import bisect
+import functools
+import multiprocessing
+import os
+import threading
+import time
+
+import _apps
+
+
+def _bench(engine: str, workers: int, devices: int, sites: int, realms: int, collect_seconds: float,
+           limits: dict, conn) -> None:
+    """Child process: back up every device once; send back timings and the observed peaks."""
+    os.environ.update({"CRONJOB_MAX_RUNTIME": "0", "SCHEDULER_ASYNC_SESSIONS": str(workers)})
+    inventory = _apps.import_module("fortigate", "inventory")
+    admission = _apps.import_module("fortigate", "admission")
+    metrics = _apps.import_module("fortigate", "metrics")
+    scheduling = _apps.import_module("fortigate", "scheduling")
+
+    lock = threading.Lock()
+    active = {}
+    logins = {}
+    peak_site = [0]
+    finished = threading.Semaphore(0)
+
+    def collection_started(device) -> None:
+        with lock:
+            active[device.site] = active.get(device.site, 0) + 1
+            peak_site[0] = max(peak_site[0], active[device.site])
+            logins.setdefault(device.aaa, []).append(time.monotonic())
+
+    def collection_done(device) -> None:
+        with lock:
+            active[device.site] -= 1
+
+    async def collect_async(device) -> bool:
+        collection_started(device)
+        await asyncio.sleep(collect_seconds)
+        collection_done(device)
+        return True
+
+    def stages(device, collect=None):
+        if collect is not None:
+            ok = yield collect(device)
+        else:
+            collection_started(device)
+            time.sleep(collect_seconds)
+            collection_done(device)
+            ok = True
+        yield "store"
+        finished.release()
+        return ok
+
+    control = admission.Admission("fortigate", limits)
+    run = functools.partial(stages, collect=collect_async) if engine == "asyncio" else stages
+    scheduler = scheduling.FleetScheduler(run, workers=workers, engine=engine, admission=control)
+    # Monthly schedule: nothing comes due on its own during the benchmark.
+    fleet = [inventory.Device(f"dev-{i}", "127.0.0.1", 22, "u", "p", schedule="0 0 1 * *",
+                              site=f"site-{i % sites}", aaa=f"realm-{i % realms}") for i in range(devices)]
+    scheduler.sync(fleet)
+    threading.Thread(target=scheduler.run_forever, daemon=True).start()
+    time.sleep(0.2)
+
+    start = time.monotonic()
+    scheduler.trigger()
+    for _ in range(devices):
+        finished.acquire()
+    wall = time.monotonic() - start
+
+    peak_rate = 0
+    for times in logins.values():
+        times.sort()
+        peak_rate = max(peak_rate, max(bisect.bisect_right(times, t + 1.0) - i for i, t in enumerate(times)))
+    waits = metrics.BACKUP_ADMISSION_WAIT_SECONDS
+    held = sum(sample.value for metric in waits.collect() for sample in metric.samples
+               if sample.name.endswith("_count") and sample.labels["limit"] != "none")
+    conn.send({"wall": wall, "peak_site": peak_site[0], "peak_rate": peak_rate, "held": int(held)})
+    conn.close()
+
+
+def _bound(args, limits: dict) -> float:
+    """Lower bound for the wall time: workers, site concurrency and realm rate each allow no less."""
+    bound = args.devices * args.collect_seconds / args.workers
+    site = limits.get("site", {}).get("*")
+    if site and site.concurrency:
+        per_site = -(-args.devices // args.sites)
+        bound = max(bound, -(-per_site // site.concurrency) * args.collect_seconds)
+    realm = limits.get("aaa", {}).get("*")
+    if realm and realm.rate:
+        per_realm = -(-args.devices // args.realms)
+        bound = max(bound, (per_realm - realm.bucket) / realm.rate + args.collect_seconds)
+    return bound
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=600)
+    parser.add_argument("--sites", type=int, default=60)
+    parser.add_argument("--realms", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=32, help="SCHEDULER_WORKERS, or sessions on the asyncio engine")
+    parser.add_argument("--collect-seconds", type=float, default=0.2)
+    parser.add_argument("--site-concurrency", type=int, default=2)
+    parser.add_argument("--realm-rate", type=float, default=20.0, help="logins per second per AAA realm")
+    parser.add_argument("--realm-burst", type=int, default=0, help="0 = one second's worth")
+    parser.add_argument("--engines", default="threads,asyncio")
+    args = parser.parse_args()
+
+    inventory = _apps.import_module("fortigate", "inventory")
+    limited = {"site": {"*": inventory.Limit(concurrency=args.site_concurrency)},
+               "aaa": {"*": inventory.Limit(rate=args.realm_rate, burst=args.realm_burst)}}
+    realm_limit = limited["aaa"]["*"]
+    print(f"{args.devices} devices, {args.sites} sites, {args.realms} AAA realms, {args.workers} workers, "
+          f"{args.collect_seconds:g}s per collection; limits: {args.site_concurrency} per site, "
+          f"{args.realm_rate:g} logins/s per realm (bursts of {realm_limit.bucket})")
+    print(f"{'engine':<8} {'limits':<7} {'wall':>8} {'bound':>8} {'peak/site':>10} {'logins/s/realm':>15} {'held back':>10}")
+    context = multiprocessing.get_context("spawn")
+    for engine in args.engines.split(","):
+        for name, limits in (("none", {}), ("on", limited)):
+            parent, child = context.Pipe(duplex=False)
+            process = context.Process(target=_bench, args=(engine, args.workers, args.devices, args.sites,
+                                                            args.realms, args.collect_seconds, limits, child))
+            process.start()
+            result = parent.recv()
+            process.join()
+            print(f"{engine:<8} {name:<7} {result['wall']:>7.2f}s {_bound(args, limits):>7.2f}s "
+                  f"{result['peak_site']:>10} {result['peak_rate']:>15} {result['held']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Benchmark: cloud_upload.upload_backup against local S3, Azure Blob and GCS stand-ins.
+
+For each provider, the upload path runs unchanged against object_store_stubs through
+endpoint overrides (AWS_ENDPOINT_URL, AZURE_STORAGE_CONNECTION_STRING,
+STORAGE_EMULATOR_HOST). It reports client construction time (first call and warm),
+then sweeps file sizes and the number of concurrent uploads (as fleet workers issue
+them) for MB/s and p50/p95 latency, and finally runs the error paths: missing bucket,
+endpoint down and an endpoint answering 503, with the error_type, time to give up and
+number of requests sent. Each provider runs in a forked child, since cloud_upload
+picks its provider at import.
+
+    python benchmarks/bench_cloud_upload.py
+    python benchmarks/bench_cloud_upload.py --provider aws --sizes-mb 1,10,50 --concurrency 1,8,32
+"""
+import argparse
+import base64
+import logging
+import multiprocessing
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+import _apps
+from object_store_stubs import AzureBlobStub, FailingEndpoint, GcsStub, S3Stub
+
+_STUBS = {"aws": S3Stub, "azure": AzureBlobStub, "gcp": GcsStub}
+_CLIENTS = {
+    "aws": lambda cloud_upload: cloud_upload.s3_client(),
+    "azure": lambda cloud_upload: cloud_upload.azure_container_client(os.environ["AZURE_STORAGE_CONTAINER"]),
+    "gcp": lambda cloud_upload: cloud_upload.gcs_client(),
+}
+
+
+def _failing_env(provider: str, endpoint: str, env: dict) -> dict:
+    """`env` with the provider's endpoint replaced by `endpoint`."""
+    env = dict(env)
+    if provider == "aws":
+        env["AWS_ENDPOINT_URL"] = endpoint
+    elif provider == "azure":
+        env["AZURE_STORAGE_CONNECTION_STRING"] = env["AZURE_STORAGE_CONNECTION_STRING"].replace(
+            env["AZURE_STORAGE_CONNECTION_STRING"].split("BlobEndpoint=")[1].split("/devstoreaccount1")[0], endpoint)
+    else:
+        env["STORAGE_EMULATOR_HOST"] = endpoint
+    return env
+
+
+def _closed_port() -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:%d" % s.getsockname()[1]
+
+
+def _percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _timed(fn, timeout: float):
+    """(result, seconds) of fn() on a thread; result None if it has not returned within `timeout`."""
+    result = []
+    start = time.perf_counter()
+    worker = threading.Thread(target=lambda: result.append(fn()), daemon=True)
+    worker.start()
+    worker.join(timeout)
+    return (result[0] if result else None), time.perf_counter() - start
+
+
+def _bench_provider(provider: str, env: dict, error_envs: dict, args, conn) -> None:
+    """Child process: import cloud_upload for `provider` and run the sweep and error paths."""
+    os.environ.update(env)
+    workdir = tempfile.mkdtemp(prefix="bench-upload-")
+    os.environ["MANIFEST_FILE"] = os.path.join(workdir, "manifest.jsonl")
+    logging.disable(logging.CRITICAL)
+    checksum = _apps.import_module("fortigate", "checksum")
+    cloud_upload = _apps.import_module("fortigate", "cloud_upload")
+    lines = []
+
+    start = time.perf_counter()
+    _CLIENTS[provider](cloud_upload)
+    cold = time.perf_counter() - start
+    warm = []
+    for _ in range(20):
+        start = time.perf_counter()
+        _CLIENTS[provider](cloud_upload)
+        warm.append(time.perf_counter() - start)
+    lines.append(f"client construction: first {cold * 1000:.1f} ms, then median {statistics.median(warm) * 1000:.1f} ms")
+    lines.append(f"{'size':>8} {'conc':>5} {'uploads':>8} {'MB/s':>8} {'p50':>8} {'p95':>8}  errors")
+
+    for size_mb in args.sizes_mb:
+        # One file per size, written through HashingWriter like a collector's; each upload gets
+        # a hard link to it (upload_backup deletes what it uploaded) with the same digests.
+        source = os.path.join(workdir, f"source_{size_mb:g}.conf")
+        size = int(size_mb * 1e6)
+        block = base64.b64encode(os.urandom(3 << 18)).decode()
+        with checksum.open_backup(source) as f:
+            for offset in range(0, size, len(block)):
+                f.write(block[:size - offset])
+        recorded = checksum._digests[os.path.abspath(source)]
+        for concurrency in args.concurrency:
+            paths = []
+            for worker in range(concurrency):
+                for run in range(args.runs):
+                    path = os.path.join(workdir, f"bench_{worker}_{run}.conf")
+                    os.link(source, path)
+                    checksum._digests[os.path.abspath(path)] = recorded
+                    paths.append((worker, path))
+            latencies, errors = [], []
+            lock = threading.Lock()
+
+            def upload(worker: int) -> None:
+                for _, path in [p for p in paths if p[0] == worker]:
+                    begin = time.perf_counter()
+                    ok, _, error_type = cloud_upload.upload_backup(path, "bench", device=f"bench-{worker}")
+                    with lock:
+                        latencies.append(time.perf_counter() - begin)
+                        if not ok:
+                            errors.append(error_type)
+
+            threads = [threading.Thread(target=upload, args=(w,)) for w in range(concurrency)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            wall = time.perf_counter() - start
+            uploaded = size * (len(paths) - len(errors))
+            lines.append(f"{size_mb:>6g}MB {concurrency:>5} {len(paths):>8} {uploaded / 1e6 / wall:>8.1f} "
+                         f"{statistics.median(latencies) * 1000:>6.0f}ms {_percentile(latencies, 95) * 1000:>6.0f}ms  "
+                         f"{', '.join(sorted(set(errors))) or '-'}")
+
+    lines.append(f"{'error path':<16} {'error_type':<22} {'time':>8}")
+    for name, error_env in error_envs.items():
+        os.environ.update(error_env)
+        path = os.path.join(workdir, "bench_error.conf")
+        with checksum.open_backup(path) as f:
+            f.write("config system global\nend\n")
+        result, elapsed = _timed(lambda: cloud_upload.upload_backup(path, "bench", device="bench-error"),
+                                 args.error_timeout)
+        outcome = f"gave no answer in {args.error_timeout:g}s" if result is None else (result[2] or "uploaded")
+        lines.append(f"{name:<16} {outcome:<22} {elapsed:>7.2f}s")
+        os.environ.update(env)
+    conn.send(lines)
+    conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--provider", action="append", choices=sorted(_STUBS),
+                        help="benchmark only this provider (repeatable; default: all)")
+    parser.add_argument("--sizes-mb", type=lambda v: [float(x) for x in v.split(",")], default=[0.1, 1, 10, 50],
+                        help="comma-separated file sizes")
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[1, 4, 16],
+                        help="comma-separated numbers of concurrent uploads")
+    parser.add_argument("--runs", type=int, default=3, help="uploads per worker and setting")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every stand-in request")
+    parser.add_argument("--error-timeout", type=float, default=120, help="stop waiting for an error path after this")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("fork")
+    for provider in args.provider or sorted(_STUBS):
+        if provider == "aws":
+            stub = S3Stub().start()
+        else:
+            stub = _STUBS[provider](latency=args.latency_ms / 1000).start()
+        failing = FailingEndpoint(503).start()
+        env = stub.env()
+        error_envs = {
+            "missing bucket": stub.env("missing-bucket"),
+            "endpoint down": _failing_env(provider, _closed_port(), env),
+            "HTTP 503": _failing_env(provider, failing.endpoint, env),
+        }
+        receiver, sender = context.Pipe(duplex=False)
+        child = context.Process(target=_bench_provider, args=(provider, env, error_envs, args, sender))
+        child.start()
+        lines = receiver.recv()
+        child.join()
+        print(f"\n{provider} ({type(stub).__name__})")
+        for line in lines:
+            print(line)
+        print(f"503 stand-in saw {sum(failing.requests.values())} request(s) for one upload")
+        failing.stop()
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark: the SSH collectors' get_full_configuration against simulated devices.
+
+Drives the Fortigate or Juniper collector against ssh_device_stub.SshDeviceStub in a
+set of scenarios (slow line rate, tiny packets, command latency, split prompts,
+paging) and reports total and transfer time, throughput, time spent waiting for the
+end prompt, and whether every configuration line made it into the backup file.
+
+    python benchmarks/bench_collectors.py --app fortigate --config-mb 5
+    python benchmarks/bench_collectors.py --app juniper --config-mb 2 --scenario split-prompt
+"""
+import argparse
+import collections
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import _apps
+from ssh_device_stub import SshDeviceStub
+
+# name -> SshDeviceStub options (FortiOS paging only applies to the Fortigate collector;
+# the Juniper collector turns paging off with `set cli screen-length 0`).
+SCENARIOS = {
+    "baseline": {},
+    "slow-device": {"line_rate": 20000},
+    "small-packets": {"chunk_size": 512},
+    "latency": {"latency": 0.5},
+    "split-prompt": {"split_prompt": True},
+    "paging": {"page_lines": 60},
+}
+
+_VENDORS = {"fortigate": "fortios", "juniper": "junos"}
+
+
+def missing_lines(expected, backup_file: str) -> int:
+    """Configuration lines absent from the backup (pager prompts and erases ignored)."""
+    with open(backup_file, errors="replace") as f:
+        saved = collections.Counter(line.split("\r")[-1].strip() for line in f)
+    wanted = collections.Counter(line.strip() for line in expected)
+    return sum((wanted - saved).values())
+
+
+def _run(fn, timeout: float):
+    """fn() on a thread; None if it has not returned within `timeout` (e.g. it never saw the prompt)."""
+    result = []
+    worker = threading.Thread(target=lambda: result.append(fn()), daemon=True)
+    worker.start()
+    worker.join(timeout)
+    return result[0] if result else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=sorted(_VENDORS), default="fortigate")
+    parser.add_argument("--config-mb", type=float, default=2, help="size of the device configuration")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="run only this scenario (repeatable; default: all)")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120, help="give up on a run after this many seconds")
+    args = parser.parse_args()
+
+    os.environ.setdefault("CATALOG_DB", "")
+    main_module = _apps.APPS[args.app].main
+    backup = _apps.import_module(args.app, main_module)
+    inventory = _apps.import_module(args.app, "inventory")
+    tracing = _apps.import_module(args.app, "tracing")
+    spans = {}
+    tracing.add_listener(lambda trace: spans.update({s.name: s for s in trace}))
+    backup_file = os.path.join(tempfile.mkdtemp(prefix="bench-collect-"), "backup.conf")
+
+    print(f"{args.app} collector, {args.config_mb:g} MB configuration, {args.runs} run(s) per scenario")
+    print(f"{'scenario':<14} {'total':>8} {'transfer':>9} {'MB/s':>7} {'end wait':>9}  result")
+    for name in args.scenario or list(SCENARIOS):
+        stub = SshDeviceStub(vendor=_VENDORS[args.app], config_bytes=int(args.config_mb * 1e6),
+                             **SCENARIOS[name]).start()
+        host, port = stub.address
+        device = inventory.Device(f"bench-{args.app}", host, port, "admin", stub.password,
+                                  prompt=stub.prompt.strip())
+        expected = stub.config_lines()
+        totals, transfers, waits = [], [], []
+        result = "ok"
+        for _ in range(args.runs):
+            def collect():
+                with tracing.span("backup_run", device=device.name):
+                    return backup.get_full_configuration(device, backup_file)
+
+            spans.clear()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                ok = _run(collect, args.timeout)
+            totals.append(time.perf_counter() - start)
+            if ok is None:
+                result = f"no end prompt after {args.timeout:g}s"
+                break
+            if not ok:
+                result = "failed"
+                break
+            command = spans["command"]
+            transfers.append((command.end_ns - command.start_ns) / 1e9)
+            waits.append(command.attributes.get("end_detect_wait_seconds", 0.0))
+            missing = missing_lines(expected, backup_file)
+            if missing:
+                result = f"{missing} of {len(expected)} lines missing or mangled"
+        stub.stop()
+        if not transfers:
+            print(f"{name:<14} {statistics.median(totals):>7.2f}s {'-':>9} {'-':>7} {'-':>9}  {result}")
+            continue
+        transfer = statistics.median(transfers)
+        print(f"{name:<14} {statistics.median(totals):>7.2f}s {transfer:>8.2f}s "
+              f"{len(stub.config) / 1e6 / transfer:>7.2f} {statistics.median(waits):>8.2f}s  {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Benchmark: GIL stalls from transform work, inline vs. in offload worker processes.
+
+Runs --threads collector threads in one process, each pushing a configuration
+through transform.open_backup() in collector-sized chunks (normalize, redact, gzip,
+hash), while a probe thread sleeps 1 ms at a time the way an SSH reader waits in
+select(). How late the probe wakes up is how long a collector thread would leave data
+that has already arrived unread. Every combination of configuration size and
+BACKUP_OFFLOAD_WORKERS runs in a spawned child; reported are wall time, the probe's
+p50/p99/max delay and the CPU time of the collectors' process (without its workers).
+
+    python benchmarks/bench_offload.py --sizes-mb 1,5,20 --offload-workers 0,4
+    python benchmarks/bench_offload.py --vendor fortios --threads 32
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import threading
+import time
+
+import _apps
+from panos_api_stub import config_blocks
+from ssh_device_stub import fortios_config, junos_config
+
+_CONFIGS = {
+    "fortios": ("fortigate", lambda size: fortios_config(size).encode()),
+    "junos": ("juniper", lambda size: junos_config(size).encode()),
+    "panos": ("palo-alto", lambda size: b"".join(config_blocks(size))),
+}
+
+
+def _percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run(vendor: str, size: int, threads: int, chunk: int, env: dict, conn) -> None:
+    """Child process: `threads` collectors writing `size`-byte configurations while the probe measures delays."""
+    os.environ.update(env)
+    app, make_config = _CONFIGS[vendor]
+    transform = _apps.import_module(app, "transform")
+    offload = _apps.import_module(app, "offload")
+    data = make_config(size)
+    workdir = tempfile.mkdtemp(prefix="bench-offload-")
+
+    def collect(number: int) -> None:
+        with transform.open_backup(os.path.join(workdir, f"backup-{number}.conf.gz"), vendor) as f:
+            for offset in range(0, len(data), chunk):
+                f.write(data[offset:offset + chunk])
+
+    def collect_all() -> None:
+        collectors = [threading.Thread(target=collect, args=(i,)) for i in range(threads)]
+        for t in collectors:
+            t.start()
+        for t in collectors:
+            t.join()
+
+    collect_all()  # starts the offload workers (when there are any) before anything is timed
+    delays, done = [], threading.Event()
+
+    def probe() -> None:
+        while not done.is_set():
+            start = time.perf_counter()
+            time.sleep(0.001)
+            delays.append(time.perf_counter() - start - 0.001)
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    cpu, start = _cpu(), time.perf_counter()
+    collect_all()
+    wall = time.perf_counter() - start
+    done.set()
+    prober.join()
+    offload.shutdown()
+    conn.send({"wall": wall, "cpu": _cpu() - cpu, "delays": delays})
+    conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vendor", choices=sorted(_CONFIGS), default="junos")
+    parser.add_argument("--sizes-mb", default="1,5,20", help="configuration sizes (comma-separated)")
+    parser.add_argument("--offload-workers", default="0,4", help="BACKUP_OFFLOAD_WORKERS values (comma-separated)")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent collectors")
+    parser.add_argument("--chunk-kb", type=float, default=32, help="size of each write (a collector's read)")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{args.threads} {args.vendor} collector(s), redact + gzip; probe delay = oversleep of a 1 ms sleep")
+    print(f"{'MB':>6} {'workers':>7} {'wall':>8} {'p50':>8} {'p99':>8} {'max':>8} {'own CPU':>8}")
+    for size_mb in (float(value) for value in args.sizes_mb.split(",")):
+        for workers in (int(value) for value in args.offload_workers.split(",")):
+            env = {"BACKUP_OFFLOAD_WORKERS": str(workers), "BACKUP_REDACT_SECRETS": "true",
+                   "BACKUP_COMPRESSION": "gzip", "CATALOG_DB": ""}
+            receiver, sender = context.Pipe(duplex=False)
+            child = context.Process(target=_run, args=(args.vendor, int(size_mb * 1e6), args.threads,
+                                                       int(args.chunk_kb * 1024), env, sender))
+            child.start()
+            result = receiver.recv()
+            child.join()
+            delays = result["delays"]
+            print(f"{size_mb:>6g} {workers:>7} {result['wall']:>7.2f}s {_percentile(delays, 50) * 1000:>6.1f}ms "
+                  f"{_percentile(delays, 99) * 1000:>6.1f}ms {max(delays) * 1000:>6.1f}ms {result['cpu']:>7.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark: the Palo Alto collector's get_full_configuration against a local PAN-OS API.
+
+Drives palo_alto_backup.get_full_configuration against panos_api_stub.PanosApiStub
+(HTTPS, self-signed) across configuration sizes and a few awkward servers (latency,
+chunked transfer, rejected key, truncated XML), and reports latency, throughput,
+requests per run, the collector's peak RSS growth and the outcome. Each scenario runs
+in a forked child so peak RSS is the collector's own.
+
+    python benchmarks/bench_palo_alto.py
+    python benchmarks/bench_palo_alto.py --max-mb 200 --runs 3
+    python benchmarks/bench_palo_alto.py --scenario chunked --scenario malformed
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import resource
+import statistics
+import tempfile
+import time
+
+import _apps
+from panos_api_stub import PanosApiStub
+
+_SIZES_MB = (0.001, 1, 10, 50, 200)
+
+# name -> PanosApiStub options, run at --config-mb; the size sweep is added in main().
+SCENARIOS = {
+    "latency": {"latency": 0.2},
+    "chunked": {"chunked": True},
+    "keygen-401": {"error": "keygen-401"},
+    "op-401": {"error": "op-401"},
+    "malformed": {"error": "malformed"},
+}
+
+
+def _collect(address, password: str, runs: int, conn) -> None:
+    """Child process: run the collector `runs` times, send back timings and the outcome."""
+    os.environ.setdefault("CATALOG_DB", "")
+    backup = _apps.import_module("palo-alto", "palo_alto_backup")
+    inventory = _apps.import_module("palo-alto", "inventory")
+    tracing = _apps.import_module("palo-alto", "tracing")
+    offload = _apps.import_module("palo-alto", "offload")
+    spans = {}
+    tracing.add_listener(lambda trace: spans.update({s.name: s for s in trace}))
+    device = inventory.Device("bench-pa", address[0], address[1], "admin", password, verify_ssl=False)
+    backup_file = os.path.join(tempfile.mkdtemp(prefix="bench-palo-"), "palo_alto_backup.xml")
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    totals, result = [], "ok"
+    for _ in range(runs):
+        spans.clear()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with tracing.span("backup_run", device=device.name):
+                ok = backup.get_full_configuration(device, backup_file)
+        totals.append(time.perf_counter() - start)
+        if not ok:
+            result = spans["backup_run"].attributes.get("error_type", "failed")
+            break
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    size = os.path.getsize(backup_file) if result == "ok" else 0
+    offload.shutdown()
+    conn.send((totals, size, peak * 1024, result))
+    conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config-mb", type=float, default=10, help="configuration size for the non-sweep scenarios")
+    parser.add_argument("--max-mb", type=float, default=50, help="largest size in the sweep (up to 200)")
+    parser.add_argument("--scenario", action="append", help="run only this scenario (repeatable; default: all)")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    scenarios = {f"size-{mb:g}MB": {"config_bytes": int(mb * 1e6)} for mb in _SIZES_MB if mb <= args.max_mb}
+    scenarios.update({name: dict(options, config_bytes=int(args.config_mb * 1e6))
+                      for name, options in SCENARIOS.items()})
+    names = args.scenario or list(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        parser.error(f"unknown scenario(s) {', '.join(unknown)}; choose from: {', '.join(scenarios)}")
+
+    context = multiprocessing.get_context("fork")
+    print(f"Palo Alto collector, {args.runs} run(s) per scenario")
+    print(f"{'scenario':<16} {'size':>9} {'latency':>9} {'MB/s':>8} {'peak RSS':>10} {'requests':>9}  result")
+    for name in names:
+        stub = PanosApiStub(**scenarios[name]).start()
+        receiver, sender = context.Pipe(duplex=False)
+        child = context.Process(target=_collect, args=(stub.address, stub.password, args.runs, sender))
+        child.start()
+        totals, size, peak, result = receiver.recv()
+        child.join()
+        stub.stop()
+        latency = statistics.median(totals)
+        requests = sum(stub.requests.values()) / max(1, len(totals))
+        rate = f"{size / 1e6 / latency:>8.1f}" if size else f"{'-':>8}"
+        print(f"{name:<16} {size / 1e6:>7.2f}MB {latency:>8.3f}s {rate} {peak / 1e6:>8.1f}MB "
+              f"{requests:>9.1f}  {result}")
+
+
+if __name__ == "__main__":
+    main()
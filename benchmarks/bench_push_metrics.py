@@ -0,0 +1,114 @@
+"""Benchmark: counter accumulation in metrics.push_metrics against a busy Pushgateway.
+
+Compares the legacy approach (GET /metrics of the whole gateway + one regex search per
+metric name) with the current one (local state file; Pushgateway JSON API only on the
+first run), against a local stand-in gateway pre-filled with N groups.
+
+    python benchmarks/bench_push_metrics.py --groups 10000 --runs 5
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import requests
+from prometheus_client import push_to_gateway
+
+import _apps
+from pushgateway_stub import PushgatewayStub
+
+
+def legacy_lookup(gateway: str, job: str, instance: str, names) -> dict:
+    """The pre-state-file algorithm: full scrape + regex per metric name."""
+    metrics_text = requests.get(f"http://{gateway}/metrics", timeout=15).text
+    num = r'(\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)'
+    found = {}
+    for metric_name in names:
+        for order in (
+            rf'instance="{re.escape(instance)}",job="{re.escape(job)}"',
+            rf'job="{re.escape(job)}",instance="{re.escape(instance)}"',
+        ):
+            match = re.search(rf'{re.escape(metric_name)}\{{{order}\}}\s+{num}', metrics_text)
+            if match:
+                found[metric_name] = float(match.group(1))
+                break
+    return found
+
+
+def _timed(fn, runs: int, stub: PushgatewayStub):
+    times, sent = [], []
+    for _ in range(runs):
+        before = stub.bytes_sent
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        sent.append(stub.bytes_sent - before)
+    return times, sent
+
+
+def _report(label: str, times, sent) -> None:
+    print(f"{label:<36} median {statistics.median(times) * 1000:9.1f} ms   "
+          f"max {max(times) * 1000:9.1f} ms   {statistics.median(sent) / 1e6:8.2f} MB received per run")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=sorted(_apps.APPS), default="fortigate")
+    parser.add_argument("--groups", type=int, default=10000, help="groups pre-filled in the stand-in gateway")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    app = _apps.APPS[args.app]
+    state_dir = tempfile.mkdtemp(prefix="bench-metrics-")
+    os.environ["METRICS_STATE_FILE"] = os.path.join(state_dir, "state.prom")
+    metrics = _apps.import_module(args.app, "metrics")
+
+    job, instance = app.job, "device-00042"
+    stub = PushgatewayStub().start()
+    stub.prefill(args.groups, job, prefix=app.prefix)
+    print(f"Stand-in Pushgateway at {stub.address} with {args.groups} groups "
+          f"({len(stub._render_text()) / 1e6:.1f} MB text exposition)")
+
+    names = [f"{app.prefix}{n}" for n in (
+        "connection_success_total", "configuration_success_total", "storage_cloud_upload_success_total",
+        "storage_cloud_last_file_size_bytes", "storage_cloud_total_bytes_uploaded")]
+    def legacy_push():
+        legacy_lookup(stub.address, job, instance, names)
+        push_to_gateway(stub.address, job=job, registry=metrics.registry, grouping_key={"instance": instance})
+
+    legacy = _timed(legacy_push, args.runs, stub)
+
+    def fresh_push():
+        metrics._baseline_loaded = False
+        if os.path.exists(os.environ["METRICS_STATE_FILE"]):
+            os.remove(os.environ["METRICS_STATE_FILE"])
+        metrics.push_metrics(stub.address, job, instance)
+
+    def state_push():
+        metrics._baseline_loaded = False
+        metrics.push_metrics(stub.address, job, instance)
+
+    def cron_push():
+        metrics.push_metrics(stub.address, job, instance)
+
+    devnull = open(os.devnull, "w")
+    real_stdout, sys.stdout = sys.stdout, devnull
+    try:
+        first = _timed(fresh_push, args.runs, stub)
+        state = _timed(state_push, args.runs, stub)
+        cron = _timed(cron_push, args.runs, stub)
+    finally:
+        sys.stdout = real_stdout
+        devnull.close()
+    _report("legacy: GET /metrics + regex", *legacy)
+    _report("push_metrics, no state (JSON API)", *first)
+    _report("push_metrics, state file", *state)
+    _report("push_metrics, same process", *cron)
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
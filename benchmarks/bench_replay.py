@@ -0,0 +1,197 @@
+"""Benchmark: the collectors against recorded device sessions (session_capture).
+
+`record` runs a collector against a simulated device (the scenarios of
+bench_collectors.py and bench_palo_alto.py) with SESSION_CAPTURE_DIR set and keeps the
+capture; captures taken in production (SESSION_CAPTURE_DIR on the job) work the same.
+`replay` feeds captures back through the unchanged get_full_configuration with
+SESSION_REPLAY_FILE, at the recorded pace (--speed 1), faster, or without delays
+(--speed 0), and reports total and transfer time, throughput, how long the collector
+took to notice the end of the output after its last byte arrived (SSH), and whether
+every run saved the same bytes. A capture of a pathological session (slow device,
+split prompt, pager) then becomes a repeatable regression benchmark.
+
+The app is taken from the capture (HTTP: Palo Alto; SSH: `user@host>` prompt: Juniper,
+else Fortigate), as are the prompt and user name; --app, --prompt and --username
+override them. Each replay runs in a forked child.
+
+    python benchmarks/bench_replay.py record --app fortigate --scenario split-prompt --scenario paging
+    python benchmarks/bench_replay.py record --app palo-alto --scenario latency --config-mb 30
+    python benchmarks/bench_replay.py replay captures/*.cap --speed 1 --speed 0
+"""
+import argparse
+import contextlib
+import glob
+import io
+import multiprocessing
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import _apps
+import bench_collectors
+import bench_palo_alto
+from panos_api_stub import PanosApiStub
+from ssh_device_stub import SshDeviceStub
+
+
+def _collect(app: str, env: dict, device_fields: tuple, runs: int, conn) -> None:
+    """Child process: run get_full_configuration `runs` times with `env`; send back one result per run."""
+    os.environ.update(env)
+    os.environ.setdefault("CATALOG_DB", "")
+    # The parent may have imported session_capture to read captures; it reads its settings at import.
+    sys.modules.pop("session_capture", None)
+    backup = _apps.import_module(app, _apps.APPS[app].main)
+    inventory = _apps.import_module(app, "inventory")
+    tracing = _apps.import_module(app, "tracing")
+    session_capture = _apps.import_module(app, "session_capture")
+    offload = _apps.import_module(app, "offload")
+    spans = {}
+    tracing.add_listener(lambda trace: spans.update({s.name: s for s in trace}))
+    device = inventory.Device(*device_fields[:5], **device_fields[5])
+    backup_file = os.path.join(tempfile.mkdtemp(prefix="bench-replay-"), "backup.conf")
+    results = []
+    for _ in range(runs):
+        spans.clear()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with tracing.span("backup_run", device=device.name):
+                ok = backup.get_full_configuration(device, backup_file)
+        total = time.perf_counter() - start
+        if not ok:
+            results.append({"total": total, "error": spans["backup_run"].attributes.get("error_type", "failed")})
+            continue
+        command = spans["command"]
+        digest = (spans.get("write") or command).attributes.get("sha256")
+        result = {"total": total, "transfer": (command.end_ns - command.start_ns) / 1e9,
+                  "bytes": os.path.getsize(backup_file), "sha256": digest}
+        replay = session_capture.last_replay
+        if replay is not None and replay.finished_ns is not None:
+            result["end_detect"] = max(0, command.end_ns - replay.finished_ns) / 1e9
+        results.append(result)
+    offload.shutdown()
+    conn.send(results)
+    conn.close()
+
+
+def _in_child(app: str, env: dict, device_fields: tuple, runs: int = 1, timeout: float = 300):
+    """_collect() in a forked child; a single timeout result if it has not finished within `timeout` per run."""
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    child = context.Process(target=_collect, args=(app, env, device_fields, runs, sender))
+    child.start()
+    if not receiver.poll(timeout * runs):
+        # A replay waits for output the way the collector waits for a device, e.g. for a prompt it never sees.
+        child.kill()
+        child.join()
+        return [{"total": timeout * runs, "error": f"not finished after {timeout * runs:g}s"}]
+    results = receiver.recv()
+    child.join()
+    return results
+
+
+def record(args) -> None:
+    os.makedirs(args.out, exist_ok=True)
+    if args.app == "palo-alto":
+        scenarios = dict(bench_palo_alto.SCENARIOS, baseline={})
+    else:
+        scenarios = bench_collectors.SCENARIOS
+    for name in args.scenario or ["baseline"]:
+        if name not in scenarios:
+            raise SystemExit(f"unknown scenario {name!r}; choose from: {', '.join(sorted(scenarios))}")
+        size = int(args.config_mb * 1e6)
+        if args.app == "palo-alto":
+            stub = PanosApiStub(config_bytes=size, **scenarios[name]).start()
+            options = {"verify_ssl": False}
+        else:
+            stub = SshDeviceStub(vendor=bench_collectors._VENDORS[args.app], config_bytes=size,
+                                 **scenarios[name]).start()
+            options = {"prompt": stub.prompt.strip()}
+        capture_dir = tempfile.mkdtemp(prefix="capture-")
+        device_name = f"{args.app}-{name}"
+        results = _in_child(args.app, {"SESSION_CAPTURE_DIR": capture_dir},
+                            (device_name, *stub.address, "admin", stub.password, options))
+        stub.stop()
+        for path in glob.glob(os.path.join(capture_dir, "*.cap")):
+            target = os.path.join(args.out, os.path.basename(path))
+            os.replace(path, target)
+            outcome = results[0].get("error") or f"{results[0]['bytes'] / 1e6:.2f} MB saved"
+            print(f"{target}  ({outcome}, capture {os.path.getsize(target) / 1e6:.2f} MB)")
+
+
+def _device_for(path: str, args, session_capture):
+    """(app, Device fields) to replay `path` with."""
+    header, records = session_capture.read_capture(path)
+    if header["kind"] == "http":
+        return args.app or "palo-alto", (header["device"], "replay", 443, "admin", "replay", {"verify_ssl": False})
+    received = [data for kind, _, data in records if kind == b"r"]
+    last_line = b"".join(received[-4:]).decode(errors="replace").splitlines()[-1].strip()
+    juniper = re.fullmatch(r"(\S+)(@\S+>)", last_line)
+    app = args.app or ("juniper" if juniper else "fortigate")
+    if juniper:
+        username, prompt = juniper.groups()
+    else:
+        username, prompt = "admin", last_line
+    return app, (header["device"], "replay", 22, args.username or username, "replay",
+                 {"prompt": args.prompt or prompt})
+
+
+def replay(args) -> None:
+    session_capture = _apps.import_module("palo-alto", "session_capture")
+    print(f"{'capture':<40} {'speed':>5} {'recorded':>9} {'total':>8} {'transfer':>9} {'MB/s':>7} "
+          f"{'end detect':>11}  result")
+    for path in args.captures:
+        app, device_fields = _device_for(path, args, session_capture)
+        _, records = session_capture.read_capture(path)
+        recorded = records[-1][1] if records else 0.0
+        digests = set()
+        for speed in args.speed or [1.0]:
+            env = {"SESSION_REPLAY_FILE": os.path.abspath(path), "SESSION_REPLAY_SPEED": str(speed)}
+            results = _in_child(app, env, device_fields, args.runs, args.timeout)
+            label = f"{os.path.basename(path)[:40]:<40} {speed:>5g} {recorded:>8.2f}s"
+            errors = [r["error"] for r in results if "error" in r]
+            good = [r for r in results if "error" not in r]
+            digests.update(r["sha256"] for r in good)
+            total = statistics.median(r["total"] for r in results)
+            if not good:
+                print(f"{label} {total:>7.2f}s {'-':>9} {'-':>7} {'-':>11}  {errors[0]}")
+                continue
+            transfer = statistics.median(r["transfer"] for r in good)
+            size = good[0]["bytes"]
+            end = [r["end_detect"] for r in good if "end_detect" in r]
+            end_detect = f"{statistics.median(end) * 1000:>9.0f}ms" if end else f"{'-':>11}"
+            outcome = ", ".join(sorted(set(errors))) or f"{size / 1e6:.2f} MB"
+            print(f"{label} {total:>7.2f}s {transfer:>8.2f}s {size / 1e6 / transfer:>7.1f} {end_detect}  {outcome}")
+        print(f"{'':<40} same backup on every run: {'yes' if len(digests) <= 1 else f'no ({len(digests)} versions)'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    rec = commands.add_parser("record", help="capture sessions with simulated devices")
+    rec.add_argument("--app", choices=sorted(_apps.APPS), default="fortigate")
+    rec.add_argument("--scenario", action="append",
+                     help="stand-in scenario (repeatable; default: baseline), as in bench_collectors.py "
+                          "or bench_palo_alto.py")
+    rec.add_argument("--config-mb", type=float, default=2, help="size of the device configuration")
+    rec.add_argument("--out", default="captures", help="directory to keep the captures in")
+    rep = commands.add_parser("replay", help="run the collector against captures")
+    rep.add_argument("captures", nargs="+")
+    rep.add_argument("--speed", type=float, action="append",
+                     help="replay speed factor, 0 = no delays (repeatable; default: 1)")
+    rep.add_argument("--runs", type=int, default=3)
+    rep.add_argument("--timeout", type=float, default=120, help="give up on a run after this many seconds")
+    rep.add_argument("--app", choices=sorted(_apps.APPS), help="collector to replay with (default: from the capture)")
+    rep.add_argument("--prompt", help="device prompt (default: last line of the capture)")
+    rep.add_argument("--username", help="user name (Juniper prompt; default: from the capture)")
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+    else:
+        replay(args)
+
+
+if __name__ == "__main__":
+    main()
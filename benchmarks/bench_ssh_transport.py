@@ -0,0 +1,89 @@
+"""Benchmark: SSH transport profiles (ssh_session.TransportProfile) on a slow WAN link.
+
+Runs the Fortigate collector's get_full_configuration against a local SSH stand-in
+through an emulated link (bandwidth + latency) once per profile, and reports the
+transfer time of `show full-configuration`, the bytes that crossed the link and what
+was negotiated.
+
+    python benchmarks/bench_ssh_transport.py --config-mb 5 --link-mbps 10 --rtt-ms 40
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+
+import _apps
+from ssh_device_stub import SshDeviceStub
+from wan_link import WanLink
+
+
+def _profiles(ssh_session):
+    profile = ssh_session.TransportProfile
+    gcm = ("aes128-gcm@openssh.com", "aes256-gcm@openssh.com")
+    return [
+        ("paramiko defaults", profile()),
+        ("compression", profile(compression=True)),
+        ("AES-GCM first", profile(ciphers=gcm)),
+        ("window 256 KiB", profile(window_size=256 * 1024)),
+        ("window 8 MiB, packet 128 KiB", profile(window_size=8 * 1024 * 1024, max_packet_size=128 * 1024)),
+        ("compression + AES-GCM + 8 MiB", profile(compression=True, ciphers=gcm, window_size=8 * 1024 * 1024,
+                                                   max_packet_size=128 * 1024)),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config-mb", type=float, default=5, help="size of the device configuration")
+    parser.add_argument("--link-mbps", type=float, default=10, help="link bandwidth in Mbit/s (0 = unlimited)")
+    parser.add_argument("--rtt-ms", type=float, default=40, help="round-trip time of the link")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault("CATALOG_DB", "")
+    backup = _apps.import_module("fortigate", "fortigate_backup")
+    inventory = _apps.import_module("fortigate", "inventory")
+    ssh_session = _apps.import_module("fortigate", "ssh_session")
+    tracing = _apps.import_module("fortigate", "tracing")
+
+    stub = SshDeviceStub(config_bytes=int(args.config_mb * 1e6)).start()
+    link = WanLink(stub.address, bandwidth=args.link_mbps * 1e6 / 8, delay=args.rtt_ms / 2000).start()
+    host, port = link.address
+    device = inventory.Device("bench-fgt", host, port, "admin", stub.password, prompt=stub.prompt.strip())
+    bandwidth = f"{args.link_mbps:g} Mbit/s" if args.link_mbps else "unlimited bandwidth"
+    print(f"Config {len(stub.config) / 1e6:.1f} MB over {bandwidth}, RTT {args.rtt_ms:g} ms, "
+          f"{args.runs} run(s) per profile")
+
+    spans = {}
+    tracing.add_listener(lambda trace: spans.update({s.name: s for s in trace}))
+    backup_file = os.path.join(tempfile.mkdtemp(prefix="bench-ssh-"), "fortigate_backup.conf")
+
+    print(f"{'profile':<32} {'transfer':>10} {'total':>8} {'on wire':>9} {'eff. MB/s':>9}  negotiated")
+    for label, profile in _profiles(ssh_session):
+        ssh_session.TRANSPORT_PROFILE = profile
+        transfers, totals, wire = [], [], []
+        for _ in range(args.runs):
+            before = link.bytes_transferred
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                with tracing.span("backup_run", device=device.name):
+                    ok = backup.get_full_configuration(device, backup_file)
+            totals.append(time.perf_counter() - start)
+            wire.append(link.bytes_transferred - before)
+            command = spans["command"]
+            transfers.append((command.end_ns - command.start_ns) / 1e9)
+            if not ok or os.path.getsize(backup_file) < len(stub.config):
+                raise SystemExit(f"{label}: incomplete configuration ({os.path.getsize(backup_file)} bytes)")
+        handshake = spans["ssh_handshake"].attributes
+        transfer = statistics.median(transfers)
+        print(f"{label:<32} {transfer:>9.2f}s {statistics.median(totals):>7.2f}s "
+              f"{statistics.median(wire) / 1e6:>7.2f}MB {len(stub.config) / 1e6 / transfer:>9.2f}  "
+              f"{handshake['cipher']}, {handshake['mac']}, {handshake['compression']}")
+    stub.stop()
+    link.stop()
+
+
+if __name__ == "__main__":
+    main()
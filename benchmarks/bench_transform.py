@@ -0,0 +1,65 @@
+"""Benchmark: transform.Pipeline (normalize, redact, compress, hash, write) per vendor.
+
+Pushes a synthetic configuration (the simulated devices' FortiOS, Junos and PAN-OS
+output) through the pipeline in chunks the size of a collector's reads, once for
+each combination of the optional stages, and reports overall throughput, every
+stage's own throughput (bytes in / time in the stage) and the size of the file.
+
+    python benchmarks/bench_transform.py --config-mb 20
+    python benchmarks/bench_transform.py --vendor junos --chunk-kb 4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import _apps
+from panos_api_stub import config_blocks
+from ssh_device_stub import fortios_config, junos_config
+
+_CONFIGS = {
+    "fortios": lambda size: fortios_config(size).encode(),
+    "junos": lambda size: junos_config(size).encode(),
+    "panos": lambda size: b"".join(config_blocks(size)),
+}
+# name -> (redact, compress)
+_VARIANTS = {"default": (False, False), "+redact": (True, False), "+gzip": (False, True), "+redact+gzip": (True, True)}
+_STAGES = ("normalize", "redact", "compress", "hash", "write")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vendor", action="append", choices=sorted(_CONFIGS),
+                        help="benchmark only this vendor (repeatable; default: all)")
+    parser.add_argument("--config-mb", type=float, default=10)
+    parser.add_argument("--chunk-kb", type=float, default=32, help="size of each write (a collector's read)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("CATALOG_DB", "")
+    transform = _apps.import_module("fortigate", "transform")
+    workdir = tempfile.mkdtemp(prefix="bench-transform-")
+    chunk = int(args.chunk_kb * 1024)
+    print(f"{args.config_mb:g} MB configuration in {args.chunk_kb:g} KB writes; per-stage MB/s = bytes in / time in stage")
+    print(f"{'vendor':<8} {'stages':<13} {'MB/s':>7} " + " ".join(f"{name:>9}" for name in _STAGES) + f" {'file':>9}")
+    for vendor in args.vendor or sorted(_CONFIGS):
+        data = _CONFIGS[vendor](int(args.config_mb * 1e6))
+        for variant, (redact, compress) in _VARIANTS.items():
+            transform.BACKUP_REDACT_SECRETS = redact
+            path = os.path.join(workdir, "backup.conf.gz" if compress else "backup.conf")
+            start = time.perf_counter()
+            with transform.open_backup(path, vendor) as f:
+                for offset in range(0, len(data), chunk):
+                    f.write(data[offset:offset + chunk])
+            elapsed = time.perf_counter() - start
+            stats = f.stats()
+            rates = []
+            for name in _STAGES:
+                stage = stats.get(name)
+                rates.append(f"{stage['bytes_in'] / 1e6 / stage['seconds']:>9.0f}" if stage and stage["seconds"]
+                             else f"{'-':>9}")
+            print(f"{vendor:<8} {variant:<13} {len(data) / 1e6 / elapsed:>7.0f} {' '.join(rates)} "
+                  f"{os.path.getsize(path) / 1e6:>7.2f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Load test: complete fleet backup cycles against N simulated devices.
+
+Starts N simulated devices for the app (ssh_device_stub for Fortigate/Juniper,
+panos_api_stub for Palo Alto), an object-store stand-in (object_store_stubs) and a
+Pushgateway stand-in, then backs up every device on a pool of worker threads, the way
+FleetScheduler's workers do (without waiting for cron ticks): collection, single-pass
+hashing, upload and the batched metrics push. With --store-workers, uploads run on
+workers of their own behind a bounded queue (SCHEDULER_STORE_WORKERS), overlapping the
+next collections. With --engine asyncio, the collections are tasks of one event loop
+instead (async_engine; --workers is then SCHEDULER_ASYNC_SESSIONS). Per cycle it reports wall time, per-device p50/p99/max, failures, CPU
+and open file descriptors; at the end, peak RSS and what the stand-ins received.
+
+The fleet runs in a spawned child process, so RSS, file descriptors and CPU are its own
+and not the simulated devices'. Other settings pass through the environment (e.g.
+SSH_SESSION_POOL=true, SSH_COMPRESSION=true).
+
+    python benchmarks/loadtest_fleet.py --app fortigate --devices 1000 --workers 32
+    python benchmarks/loadtest_fleet.py --app palo-alto --devices 200 --cycles 3 --provider gcp
+    python benchmarks/loadtest_fleet.py --app juniper --devices 500 --workers 64 --store-workers 8
+    python benchmarks/loadtest_fleet.py --app palo-alto --devices 1000 --workers 1000 --engine asyncio
+"""
+import argparse
+import contextlib
+import functools
+import io
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import statistics
+import tempfile
+import threading
+import time
+
+import _apps
+from object_store_stubs import AzureBlobStub, GcsStub, S3Stub
+from panos_api_stub import PanosApiStub
+from pushgateway_stub import PushgatewayStub
+from ssh_device_stub import SshDeviceStub
+
+_STORES = {"aws": S3Stub, "azure": AzureBlobStub, "gcp": GcsStub}
+_VENDORS = {"fortigate": "fortios", "juniper": "junos"}
+
+
+def _open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+def _percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _fleet(app: str, devices, env: dict, engine: str, workers: int, store_workers: int, store_queue: int,
+           cycles: int, conn) -> None:
+    """
+    Child process: run `cycles` backup cycles over `devices` with `workers` (+ `store_workers`)
+    threads, or on the asyncio engine with `workers` sessions at a time.
+    """
+    os.environ.update(env)
+    os.chdir(tempfile.mkdtemp(prefix="loadtest-"))
+    logging.disable(logging.CRITICAL)
+    backup = _apps.import_module(app, _apps.APPS[app].main)
+    inventory = _apps.import_module(app, "inventory")
+    metrics_flusher = _apps.import_module(app, "metrics_flusher")
+    scheduling = _apps.import_module(app, "scheduling")
+    offload = _apps.import_module(app, "offload")
+    fleet = [inventory.Device(*fields[:5], **fields[5]) for fields in devices]
+
+    peak_fds = [_open_fds()]
+    sampling = threading.Event()
+
+    def sample_fds() -> None:
+        while not sampling.wait(0.1):
+            peak_fds[-1] = max(peak_fds[-1], _open_fds())
+
+    threading.Thread(target=sample_fds, daemon=True).start()
+    report = {"baseline_fds": peak_fds[0], "cycles": []}
+    cycle, lock = {}, threading.Lock()
+
+    def on_change(run) -> None:
+        if not run.finished:
+            return
+        with lock:
+            cycle["durations"].append(time.perf_counter() - cycle["started"][run.device.name])
+            if not run.result:
+                cycle["failures"].append(run.device.name)
+            if len(cycle["durations"]) == len(fleet):
+                cycle["all_done"].set()
+
+    if engine == "asyncio":
+        async_engine = _apps.import_module(app, "async_engine")
+        pipeline = async_engine.AsyncEngine(max_sessions=workers, store_workers=store_workers or workers,
+                                            store_queue_size=store_queue, on_change=on_change)
+        stages = functools.partial(backup.backup_stages, collect=backup.get_full_configuration_async)
+    else:
+        pipeline = scheduling.StagePipeline({"store": store_workers}, store_queue, on_change=on_change)
+        stages = backup.backup_stages
+    pipeline.start()
+    for _ in range(cycles):
+        work = queue.Queue()
+        for device in fleet:
+            work.put(device)
+        durations, failures, started = [], [], {}
+        all_done = threading.Event()
+        cycle.update(durations=durations, failures=failures, started=started, all_done=all_done)
+
+        def worker() -> None:
+            while True:
+                try:
+                    device = work.get_nowait()
+                except queue.Empty:
+                    return
+                started[device.name] = time.perf_counter()
+                pipeline.advance(scheduling.StagedRun(device, stages(device)))
+
+        peak_fds.append(_open_fds())
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            # The asyncio engine's advance() returns at once: one thread hands it the whole fleet.
+            threads = [threading.Thread(target=worker) for _ in range(1 if engine == "asyncio" else workers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            all_done.wait()
+        wall = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+        report["cycles"].append({"wall": wall, "durations": durations, "failures": len(failures),
+                                 "cpu": cpu, "peak_fds": peak_fds[-1]})
+    with contextlib.redirect_stdout(io.StringIO()):
+        metrics_flusher.stop()
+    offload.shutdown()
+    sampling.set()
+    report["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    conn.send(report)
+    conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=sorted(_apps.APPS), default="fortigate")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads", help="SCHEDULER_ENGINE")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="concurrent backups (SCHEDULER_WORKERS; SCHEDULER_ASYNC_SESSIONS with --engine asyncio)")
+    parser.add_argument("--store-workers", type=int, default=0,
+                        help="upload workers of their own (SCHEDULER_STORE_WORKERS; 0 = upload on the collecting worker)")
+    parser.add_argument("--store-queue", type=int, default=0,
+                        help="collected backups that may wait for a store worker (SCHEDULER_STORE_QUEUE_SIZE)")
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--config-kb", type=float, default=200, help="configuration size of each device")
+    parser.add_argument("--provider", choices=sorted(_STORES) + ["none"], default="aws",
+                        help="object-store stand-in to upload to")
+    args = parser.parse_args()
+
+    print(f"Starting {args.devices} simulated {args.app} device(s)...")
+    size = int(args.config_kb * 1000)
+    stubs, devices = [], []
+    for i in range(args.devices):
+        name = f"load-{args.app}-{i:05d}"
+        if args.app == "palo-alto":
+            stub = PanosApiStub(config_bytes=size).start()
+            options = {"verify_ssl": False}
+        else:
+            stub = SshDeviceStub(vendor=_VENDORS[args.app], config_bytes=size).start()
+            options = {"prompt": stub.prompt.strip()}
+        stubs.append(stub)
+        devices.append((name, *stub.address, "admin", stub.password, options))
+
+    gateway = PushgatewayStub().start()
+    env = {"metrics-pushgw": "true", "PUSHGATEWAY_ADDR": gateway.address, "CATALOG_DB": "",
+           "SCHEDULER_ENGINE": args.engine}
+    store = None
+    if args.provider != "none":
+        store = _STORES[args.provider]().start()
+        env.update(store.env())
+
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    child = context.Process(target=_fleet, args=(args.app, devices, env, args.engine, args.workers,
+                                                   args.store_workers, args.store_queue, args.cycles, sender))
+    child.start()
+    report = receiver.recv()
+    child.join()
+
+    stores = f" + {args.store_workers} store worker(s)" if args.store_workers else ""
+    concurrency = f"{args.workers} session(s) on asyncio" if args.engine == "asyncio" else f"{args.workers} worker(s)"
+    print(f"{args.devices} device(s), {args.config_kb:g} KB configurations, {concurrency}{stores}, "
+          f"upload to {args.provider}")
+    print(f"{'cycle':>5} {'wall':>9} {'dev/s':>7} {'p50':>8} {'p99':>8} {'max':>8} {'failed':>7} "
+          f"{'CPU':>8} {'CPU %':>6} {'fds':>6}")
+    for number, cycle in enumerate(report["cycles"], 1):
+        durations = cycle["durations"]
+        print(f"{number:>5} {cycle['wall']:>8.1f}s {len(durations) / cycle['wall']:>7.1f} "
+              f"{statistics.median(durations):>7.2f}s {_percentile(durations, 99):>7.2f}s {max(durations):>7.2f}s "
+              f"{cycle['failures']:>7} {cycle['cpu']:>7.1f}s {100 * cycle['cpu'] / cycle['wall']:>5.0f}% "
+              f"{cycle['peak_fds']:>6}")
+    print(f"peak RSS {report['peak_rss'] / 1e6:.0f} MB, open fds at start {report['baseline_fds']}")
+    if store is not None:
+        print(f"object store: {len(store.objects)} object(s)")
+    print(f"Pushgateway: {gateway.requests['PUT'] + gateway.requests['POST']} push(es), "
+          f"{len(gateway.groups)} group(s)")
+    for stub in stubs:
+        stub.stop()
+    gateway.stop()
+    if store is not None:
+        store.stop()
+
+
+if __name__ == "__main__":
+    main()
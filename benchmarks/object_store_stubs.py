@@ -0,0 +1,345 @@
+"""Local object-store stand-ins for S3, Azure Blob Storage and GCS, for benchmarks and tests.
+
+The apps reach them through endpoint overrides, with no code paths of their own:
+- S3: moto's server (`S3Stub`); `AWS_ENDPOINT_URL=<stub.endpoint>` (honoured by boto3).
+- Azure: an Azurite-compatible Blob endpoint (`AzureBlobStub`): Put Blob, Put Block and
+  Put Block List; `AZURE_STORAGE_CONNECTION_STRING=<stub.connection_string>`.
+- GCS: a fake-gcs-server-compatible JSON API (`GcsStub`): multipart and resumable
+  uploads; `STORAGE_EMULATOR_HOST=<stub.endpoint>` (honoured by google-cloud-storage).
+- `FailingEndpoint` answers every request with one status (e.g. 503), to see how each
+  SDK retries and how long a failing upload takes.
+
+Bodies are hashed and counted as they arrive, not kept, so large uploads cost the stubs
+no memory (except moto's). Each stub has `env()` (the variables to set) and `objects`
+(name -> size); the HTTP stand-ins also count `requests` per kind.
+"""
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import google_crc32c
+
+_READ_SIZE = 1 << 20
+
+# Azurite's well-known development account.
+AZURITE_ACCOUNT = "devstoreaccount1"
+AZURITE_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+
+class _HttpStub:
+    """ThreadingHTTPServer on a background thread, with per-request latency and counters."""
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.requests: Counter = Counter()
+        self.objects: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    @property
+    def endpoint(self) -> str:
+        return "http://%s:%d" % self.address
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, kind: str) -> None:
+        with self.lock:
+            self.requests[kind] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def handle(self, request: "_Handler") -> None:
+        raise NotImplementedError
+
+    def _handler(self):
+        stub = self
+
+        class Handler(_Handler):
+            def _dispatch(self):
+                stub.handle(self)
+
+            do_GET = do_PUT = do_POST = do_HEAD = do_DELETE = _dispatch
+
+        return Handler
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def read_body(self) -> Tuple[int, "hashlib._Hash", google_crc32c.Checksum]:
+        """Consume the request body; returns (size, md5, crc32c) without keeping it."""
+        md5, crc = hashlib.md5(), google_crc32c.Checksum()
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining:
+            data = self.rfile.read(min(remaining, _READ_SIZE))
+            if not data:
+                break
+            md5.update(data)
+            crc.update(data)
+            remaining -= len(data)
+        return int(self.headers.get("Content-Length") or 0) - remaining, md5, crc
+
+    def reply(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None,
+              content_type: str = "application/xml") -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class S3Stub:
+    """moto's S3 server with `buckets` created up front."""
+
+    def __init__(self, buckets=("backups",), host: str = "127.0.0.1", port: int = 0):
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self.buckets = tuple(buckets)
+        self._server = ThreadedMotoServer(ip_address=host, port=port, verbose=False)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.get_host_and_port()
+
+    @property
+    def endpoint(self) -> str:
+        return "http://%s:%d" % self.address
+
+    def env(self, bucket: Optional[str] = None) -> Dict[str, str]:
+        return {"aws": "true", "AWS_ENDPOINT_URL": self.endpoint, "AWS_ACCESS_KEY_ID": "bench",
+                "AWS_SECRET_ACCESS_KEY": "bench", "AWS_DEFAULT_REGION": "us-east-1",
+                "BUCKET_NAME": bucket or self.buckets[0]}
+
+    def _client(self):
+        import boto3
+
+        return boto3.client("s3", endpoint_url=self.endpoint, aws_access_key_id="bench",
+                            aws_secret_access_key="bench", region_name="us-east-1")
+
+    @property
+    def objects(self) -> Dict[str, int]:
+        """bucket/key -> size, listed from the server."""
+        s3, objects = self._client(), {}
+        for bucket in self.buckets:
+            for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket):
+                objects.update({f"{bucket}/{o['Key']}": o["Size"] for o in page.get("Contents", [])})
+        return objects
+
+    def start(self) -> "S3Stub":
+        self._server.start()
+        s3 = self._client()
+        for bucket in self.buckets:
+            s3.create_bucket(Bucket=bucket)
+        return self
+
+    def stop(self) -> None:
+        self._server.stop()
+
+
+class AzureBlobStub(_HttpStub):
+    """Azurite-compatible Blob endpoint for block blobs (`/devstoreaccount1/<container>/<blob>`)."""
+
+    def __init__(self, containers=("backups",), **kwargs):
+        super().__init__(**kwargs)
+        self.containers = set(containers)
+        self._blocks: Dict[Tuple[str, str], int] = {}
+
+    @property
+    def connection_string(self) -> str:
+        return (f"DefaultEndpointsProtocol=http;AccountName={AZURITE_ACCOUNT};AccountKey={AZURITE_KEY};"
+                f"BlobEndpoint={self.endpoint}/{AZURITE_ACCOUNT};")
+
+    def env(self, container: Optional[str] = None) -> Dict[str, str]:
+        return {"azure": "true", "AZURE_STORAGE_CONNECTION_STRING": self.connection_string,
+                "AZURE_STORAGE_CONTAINER": container or sorted(self.containers)[0]}
+
+    def _error(self, request: _Handler, status: int, code: str) -> None:
+        request.read_body()
+        body = (f'<?xml version="1.0" encoding="utf-8"?><Error><Code>{code}</Code>'
+                f'<Message>{code}</Message></Error>').encode()
+        request.reply(status, body, {"x-ms-error-code": code, "x-ms-request-id": str(uuid.uuid4())})
+
+    def handle(self, request: _Handler) -> None:
+        url = urlsplit(request.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = unquote(url.path).lstrip("/").split("/", 2)
+        comp = query.get("comp", "blob")
+        self.count(f"{request.command} {comp}")
+        if len(parts) < 3 or parts[0] != AZURITE_ACCOUNT or request.command != "PUT":
+            self._error(request, 400, "UnsupportedOperation")
+            return
+        container, blob = parts[1], parts[2]
+        if container not in self.containers:
+            self._error(request, 404, "ContainerNotFound")
+            return
+
+        size, md5, _ = request.read_body()
+        headers = {"x-ms-request-id": str(uuid.uuid4()), "x-ms-version": request.headers.get("x-ms-version", ""),
+                   "Date": formatdate(usegmt=True), "x-ms-request-server-encrypted": "true"}
+        if comp == "block":
+            with self.lock:
+                self._blocks[(f"{container}/{blob}", query.get("blockid", ""))] = size
+        elif comp == "blocklist":
+            # Block ids are not parsed; the blob is every staged block of this name.
+            key = f"{container}/{blob}"
+            with self.lock:
+                staged = [k for k in self._blocks if k[0] == key]
+                self.objects[key] = sum(self._blocks.pop(k) for k in staged)
+        elif comp == "blob":
+            transactional = request.headers.get("Content-MD5")
+            if transactional and transactional != base64.b64encode(md5.digest()).decode():
+                self._error(request, 400, "Md5Mismatch")
+                return
+            with self.lock:
+                self.objects[f"{container}/{blob}"] = size
+        else:
+            self._error(request, 400, "UnsupportedOperation")
+            return
+        headers.update({"ETag": f'"0x{uuid.uuid4().hex[:15].upper()}"', "Last-Modified": formatdate(usegmt=True),
+                        "Content-MD5": base64.b64encode(md5.digest()).decode()})
+        request.reply(201, headers=headers)
+
+
+class GcsStub(_HttpStub):
+    """fake-gcs-server-compatible JSON API uploads (multipart and resumable) into `buckets`."""
+
+    def __init__(self, buckets=("backups",), **kwargs):
+        super().__init__(**kwargs)
+        self.buckets = set(buckets)
+        # upload id -> [bucket, metadata, bytes received, md5, crc32c]
+        self._uploads: Dict[str, list] = {}
+
+    def env(self, bucket: Optional[str] = None) -> Dict[str, str]:
+        return {"gcp": "true", "STORAGE_EMULATOR_HOST": self.endpoint, "GOOGLE_CLOUD_PROJECT": "bench",
+                "GCP_BUCKET_NAME": bucket or sorted(self.buckets)[0]}
+
+    def _json(self, request: _Handler, status: int, payload: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        request.reply(status, json.dumps(payload).encode(), headers, content_type="application/json")
+
+    def _not_found(self, request: _Handler, bucket: str) -> None:
+        request.read_body()
+        self._json(request, 404, {"error": {"code": 404, "message": f"The specified bucket {bucket} does not exist.",
+                                            "errors": [{"reason": "notFound", "message": "Not Found"}]}})
+
+    def _resource(self, bucket: str, metadata: dict, size: int, md5, crc) -> dict:
+        name = metadata.get("name", "")
+        with self.lock:
+            self.objects[f"{bucket}/{name}"] = size
+        return {"kind": "storage#object", "id": f"{bucket}/{name}/1", "name": name, "bucket": bucket,
+                "generation": str(time.time_ns()), "metageneration": "1", "size": str(size),
+                "md5Hash": base64.b64encode(md5.digest()).decode(),
+                "crc32c": base64.b64encode(crc.digest()).decode(), "metadata": metadata.get("metadata", {}),
+                "contentType": metadata.get("contentType", "application/octet-stream")}
+
+    def handle(self, request: _Handler) -> None:
+        url = urlsplit(request.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        upload_type = query.get("uploadType", "")
+        self.count(f"{request.command} {upload_type or url.path.split('/')[-1]}")
+        path = unquote(url.path)
+        if request.command == "PUT" and "upload_id" in query:
+            self._resumable_chunk(request, query["upload_id"])
+            return
+        if not path.startswith("/upload/storage/v1/b/") or request.command != "POST":
+            request.read_body()
+            self._json(request, 400, {"error": {"code": 400, "message": "Unsupported request in stub"}})
+            return
+        bucket = path.split("/")[5]
+        if bucket not in self.buckets:
+            self._not_found(request, bucket)
+            return
+        if upload_type == "multipart":
+            self._multipart(request, bucket)
+        elif upload_type == "resumable":
+            length = int(request.headers.get("Content-Length") or 0)
+            metadata = json.loads(request.rfile.read(length) or b"{}")
+            upload_id = uuid.uuid4().hex
+            with self.lock:
+                self._uploads[upload_id] = [bucket, metadata, 0, hashlib.md5(), google_crc32c.Checksum()]
+            location = f"{self.endpoint}{url.path}?uploadType=resumable&upload_id={upload_id}"
+            request.reply(200, headers={"Location": location})
+        else:
+            request.read_body()
+            self._json(request, 400, {"error": {"code": 400, "message": f"uploadType {upload_type!r}"}})
+
+    def _multipart(self, request: _Handler, bucket: str) -> None:
+        # multipart/related: a JSON metadata part, then the data part.
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length)
+        boundary = request.headers.get_param("boundary", header="content-type").encode()
+        parts = [p for p in body.split(b"--" + boundary) if p.strip() not in (b"", b"--")]
+        metadata = json.loads(parts[0].split(b"\r\n\r\n", 1)[1])
+        data = parts[1].split(b"\r\n\r\n", 1)[1][:-2]
+        md5, crc = hashlib.md5(data), google_crc32c.Checksum(data)
+        expected = metadata.get("crc32c")
+        if expected and expected != base64.b64encode(crc.digest()).decode():
+            self._json(request, 400, {"error": {"code": 400, "message": "Provided CRC32C doesn't match"}})
+            return
+        self._json(request, 200, self._resource(bucket, metadata, len(data), md5, crc))
+
+    def _resumable_chunk(self, request: _Handler, upload_id: str) -> None:
+        with self.lock:
+            upload = self._uploads.get(upload_id)
+        if upload is None:
+            request.read_body()
+            self._json(request, 404, {"error": {"code": 404, "message": "No such upload"}})
+            return
+        remaining = int(request.headers.get("Content-Length") or 0)
+        while remaining:
+            data = request.rfile.read(min(remaining, _READ_SIZE))
+            if not data:
+                break
+            upload[3].update(data)
+            upload[4].update(data)
+            upload[2] += len(data)
+            remaining -= len(data)
+        # Content-Range: bytes a-b/total (total is * until the last chunk).
+        total = request.headers.get("Content-Range", "").rpartition("/")[2]
+        if total != "*" and upload[2] >= int(total or 0):
+            with self.lock:
+                self._uploads.pop(upload_id, None)
+            self._json(request, 200, self._resource(upload[0], upload[1], upload[2], upload[3], upload[4]))
+        else:
+            request.reply(308, headers={"Range": f"bytes=0-{upload[2] - 1}"} if upload[2] else {})
+
+
+class FailingEndpoint(_HttpStub):
+    """Answers every request with `status` (e.g. 503), counting them, to measure SDK retry behaviour."""
+
+    def __init__(self, status: int = 503, **kwargs):
+        super().__init__(**kwargs)
+        self.status = status
+
+    def handle(self, request: _Handler) -> None:
+        self.count(request.command)
+        request.read_body()
+        request.reply(self.status, b"<Error><Code>ServiceUnavailable</Code><Message>stub</Message></Error>",
+                      {"Retry-After": "0"})
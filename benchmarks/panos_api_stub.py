@@ -0,0 +1,236 @@
+"""Local HTTPS stand-in for the PAN-OS XML API, for benchmarks and tests.
+
+Implements what the Palo Alto collector uses, and what it may use later:
+- type=keygen (user/password -> key)
+- type=op with <show><config><running></running></config></show>
+- type=export&category=configuration (the bare <config> document)
+- target=<serial> on op/export, as Panorama proxies to a managed firewall
+
+Parameters may come in the query string or a form body (GET or POST); the key may
+also be sent as an X-PAN-KEY header. Responses are generated on the fly in 64 KiB
+blocks, so sizes from 1 KB to hundreds of MB cost the server no memory. Options:
+`latency` (before each response), `chunked` (Transfer-Encoding: chunked instead of
+Content-Length) and `error` injection:
+- "keygen-401": keygen answers 401 (bad credentials / locked account)
+- "op-401": op/export answer 401 (expired or revoked key)
+- "malformed": config responses are cut off mid-document
+"""
+import datetime
+import ipaddress
+import os
+import ssl
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+_BLOCK = 65536
+_RUNNING_CONFIG_CMD = "<show><config><running></running></config></show>"
+ERRORS = ("keygen-401", "op-401", "malformed")
+
+
+def _self_signed_context() -> ssl.SSLContext:
+    """Server TLS context with a throwaway certificate for localhost/127.0.0.1."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName(
+            [x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    directory = tempfile.mkdtemp(prefix="panos-stub-")
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+def config_blocks(size: int, hostname: str = "PA-BENCH", wrapped: bool = True) -> Iterator[bytes]:
+    """A synthetic running config of about `size` bytes, in blocks; `wrapped` adds the op <response>."""
+    head = (f'<config version="11.0.0" urldb="paloaltonetworks"><devices><entry name="localhost.localdomain">'
+            f'<deviceconfig><system><hostname>{hostname}</hostname></system></deviceconfig>'
+            f'<vsys><entry name="vsys1"><address>')
+    tail = "</address></entry></vsys></entry></devices></config>"
+    if wrapped:
+        head = '<response status="success"><result>' + head
+        tail += "</result></response>"
+    block = [head]
+    length = total = len(head)
+    i = 0
+    while total + len(tail) < size:
+        entry = (f'<entry name="addr-{i:07d}"><ip-netmask>10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}/32'
+                 f'</ip-netmask><description>managed by automation, ticket CHG{i * 7 % 100000:05d}</description>'
+                 f'<tag><member>bench</member></tag></entry>\n')
+        block.append(entry)
+        length += len(entry)
+        total += len(entry)
+        i += 1
+        if length >= _BLOCK:
+            yield "".join(block).encode()
+            block, length = [], 0
+    block.append(tail)
+    yield "".join(block).encode()
+
+
+class PanosApiStub:
+    """PAN-OS XML API (firewall or Panorama) over HTTPS, on a background thread."""
+
+    _context: Optional[ssl.SSLContext] = None
+
+    def __init__(self, config_bytes: int = 1_000_000, username: str = "admin", password: str = "bench",
+                 latency: float = 0.0, chunked: bool = False, error: Optional[str] = None,
+                 managed: Optional[Dict[str, int]] = None, host: str = "127.0.0.1", port: int = 0):
+        if error is not None and error not in ERRORS:
+            raise ValueError(f"unknown error injection {error!r}")
+        self.config_bytes = config_bytes
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.chunked = chunked
+        self.error = error
+        # Panorama: serial -> config size of each managed firewall reachable with target=.
+        self.managed = managed or {}
+        self.key = "LUFRPT1" + os.urandom(24).hex() + "=="
+        self.requests: Counter = Counter()
+        self._lengths: Dict[Tuple[int, bool], int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        if PanosApiStub._context is None:
+            PanosApiStub._context = _self_signed_context()
+        self._server.socket = PanosApiStub._context.wrap_socket(self._server.socket, server_side=True,
+                                                                do_handshake_on_connect=False)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> "PanosApiStub":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def config_length(self, size: int, wrapped: bool) -> int:
+        """Exact body length of config_blocks(size, wrapped), computed once."""
+        with self._lock:
+            if (size, wrapped) not in self._lengths:
+                self._lengths[(size, wrapped)] = sum(len(b) for b in config_blocks(size, wrapped=wrapped))
+            return self._lengths[(size, wrapped)]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, fmt, *args):
+                pass
+
+            def _params(self) -> Dict[str, str]:
+                url = urlsplit(self.path)
+                params = parse_qs(url.query)
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    params.update(parse_qs(self.rfile.read(length).decode()))
+                return {name: values[-1] for name, values in params.items()}
+
+            def _send(self, code: int, blocks, length: Optional[int] = None, cut_at: Optional[int] = None) -> None:
+                self.send_response(code)
+                self.send_header("Content-Type", "application/xml; charset=UTF-8")
+                if stub.chunked or length is None:
+                    self.send_header("Transfer-Encoding", "chunked")
+                else:
+                    self.send_header("Content-Length", str(cut_at if cut_at is not None else length))
+                self.end_headers()
+                sent = 0
+                for block in blocks:
+                    if cut_at is not None:
+                        block = block[:max(0, cut_at - sent)]
+                    if block:
+                        if stub.chunked or length is None:
+                            self.wfile.write(b"%x\r\n%s\r\n" % (len(block), block))
+                        else:
+                            self.wfile.write(block)
+                    sent += len(block)
+                    if cut_at is not None and sent >= cut_at:
+                        break
+                if stub.chunked or length is None:
+                    self.wfile.write(b"0\r\n\r\n")
+
+            def _error(self, code: int, message: str, api_code: int = 0) -> None:
+                body = (f'<response status="error" code="{api_code}"><result><msg>{message}</msg>'
+                        f'</result></response>').encode()
+                self._send(code, [body], len(body))
+
+            def _handle(self) -> None:
+                if urlsplit(self.path).path.rstrip("/") != "/api":
+                    self._error(404, "Not found")
+                    return
+                params = self._params()
+                kind = params.get("type", "")
+                with stub._lock:
+                    stub.requests[kind] += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if kind == "keygen":
+                    if stub.error == "keygen-401" or (params.get("user"), params.get("password")) != (
+                            stub.username, stub.password):
+                        self._error(401 if stub.error == "keygen-401" else 403, "Invalid Credential", 403)
+                        return
+                    body = f'<response status="success"><result><key>{stub.key}</key></result></response>'.encode()
+                    self._send(200, [body], len(body))
+                    return
+
+                if params.get("key", self.headers.get("X-PAN-KEY")) != stub.key or stub.error == "op-401":
+                    self._error(401 if stub.error == "op-401" else 403, "Invalid credentials.", 16)
+                    return
+                if kind == "op" and params.get("cmd") == _RUNNING_CONFIG_CMD:
+                    wrapped = True
+                elif kind == "export" and params.get("category") == "configuration":
+                    wrapped = False
+                else:
+                    self._error(400, "Unsupported request in stub", 17)
+                    return
+
+                size = stub.config_bytes
+                target = params.get("target")
+                if target is not None:
+                    if target not in stub.managed:
+                        self._error(400, f"Device {target} is not connected", 17)
+                        return
+                    size = stub.managed[target]
+                length = None if stub.chunked else stub.config_length(size, wrapped)
+                cut_at = None
+                if stub.error == "malformed":
+                    cut_at = int((length or stub.config_length(size, wrapped)) * 0.6)
+                self._send(200, config_blocks(size, wrapped=wrapped), length, cut_at)
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+        return Handler
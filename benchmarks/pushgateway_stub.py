@@ -0,0 +1,185 @@
+"""Local stand-in for Prometheus Pushgateway, for benchmarks and load tests.
+
+Implements the parts the backup apps use:
+- PUT/POST/DELETE /metrics/job/<job>[/<label>/<value>...]  (push / delete a group)
+- GET /metrics                                            (all groups, text format)
+- GET /api/v1/metrics                                     (all groups, JSON)
+
+It can be pre-filled with N synthetic groups so request cost scales the way a real,
+busy gateway does.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote
+
+from prometheus_client.parser import text_string_to_metric_families
+
+
+def _group_json(group_labels: Dict[str, str], text: str) -> str:
+    """Render one group the way /api/v1/metrics does (counters and gauges only)."""
+    entry = {"labels": group_labels, "last_push_successful": True}
+    for family in text_string_to_metric_families(text):
+        if family.type not in ("counter", "gauge"):
+            continue
+        metrics = []
+        for sample in family.samples:
+            labels = dict(sample.labels)
+            labels.update(group_labels)
+            metrics.append({"labels": labels, "value": repr(sample.value)})
+        name = family.name + ("_total" if family.type == "counter" else "")
+        entry[name] = {"type": family.type.upper(), "help": family.documentation, "metrics": metrics}
+    return json.dumps(entry)
+
+
+def _synthetic_group(prefix: str, instance: str, job: str) -> str:
+    labels = f'instance="{instance}",job="{job}"'
+    lines = []
+    for name, kind, value in (
+        (f"{prefix}connection_success_total", "counter", 42),
+        (f"{prefix}configuration_success_total", "counter", 41),
+        (f"{prefix}storage_cloud_upload_success_total", "counter", 40),
+        (f"{prefix}storage_cloud_last_file_size_bytes", "gauge", 123456),
+        (f"{prefix}storage_cloud_total_bytes_uploaded", "gauge", 4938240),
+    ):
+        lines += [f"# TYPE {name} {kind}", f"{name}{{{labels}}} {value}"]
+    lines.append(f"# TYPE {prefix}connection_failure_total counter")
+    for error_type in ("authentication_error", "ssh_error", "connection_error"):
+        lines.append(f'{prefix}connection_failure_total{{error_type="{error_type}",{labels}}} 0')
+    lines.append(f"# TYPE {prefix}last_success_timestamp gauge")
+    for op in ("configuration", "storage_upload", "total"):
+        lines.append(f'{prefix}last_success_timestamp{{operation="{op}",{labels}}} {time.time():.3f}')
+    lines.append(f"# TYPE {prefix}duration_seconds histogram")
+    for op in ("configuration", "storage_upload", "total"):
+        for le in ("1.0", "5.0", "10.0", "30.0", "60.0", "+Inf"):
+            lines.append(f'{prefix}duration_seconds_bucket{{le="{le}",operation="{op}",{labels}}} 40')
+        lines.append(f'{prefix}duration_seconds_count{{operation="{op}",{labels}}} 40')
+        lines.append(f'{prefix}duration_seconds_sum{{operation="{op}",{labels}}} 120.5')
+    return "\n".join(lines) + "\n"
+
+
+class PushgatewayStub:
+    """In-memory Pushgateway stand-in running on a background thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        # group key -> exposition text; JSON rendering is cached per group
+        self.groups: Dict[Tuple[Tuple[str, str], ...], str] = {}
+        self._group_json: Dict[Tuple[Tuple[str, str], ...], str] = {}
+        self.requests = {"GET": 0, "PUT": 0, "POST": 0, "DELETE": 0}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._text_cache: Optional[bytes] = None
+        self._json_cache: Optional[bytes] = None
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> "PushgatewayStub":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def prefill(self, n_groups: int, job: str, prefix: str = "backup_") -> None:
+        with self._lock:
+            template = _synthetic_group(prefix, "__INSTANCE__", job)
+            template_json = _group_json({"instance": "__INSTANCE__", "job": job}, template)
+            for i in range(n_groups):
+                instance = f"device-{i:05d}"
+                key = (("instance", instance), ("job", job))
+                self.groups[key] = template.replace("__INSTANCE__", instance)
+                self._group_json[key] = template_json.replace("__INSTANCE__", instance)
+            self._text_cache = self._json_cache = None
+
+    def _render_text(self) -> bytes:
+        if self._text_cache is None:
+            self._text_cache = "".join(self.groups.values()).encode()
+        return self._text_cache
+
+    def _render_json(self) -> bytes:
+        if self._json_cache is None:
+            for key, text in self.groups.items():
+                if key not in self._group_json:
+                    self._group_json[key] = _group_json(dict(key), text)
+            body = ",".join(self._group_json[key] for key in self.groups)
+            self._json_cache = ('{"status":"success","data":[' + body + ']}').encode()
+        return self._json_cache
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def _reply(self, code: int, body: bytes = b"", content_type: str = "text/plain") -> None:
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with stub._lock:
+                    stub.bytes_sent += len(body)
+
+            def _group_key(self):
+                parts = [unquote(p) for p in self.path.split("?")[0].strip("/").split("/")[1:]]
+                if len(parts) < 2 or len(parts) % 2:
+                    return None
+                return tuple(sorted(zip(parts[::2], parts[1::2])))
+
+            def do_GET(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                with stub._lock:
+                    stub.requests["GET"] += 1
+                    if self.path.startswith("/api/v1/metrics"):
+                        body, ctype = stub._render_json(), "application/json"
+                    elif self.path.startswith("/metrics"):
+                        body, ctype = stub._render_text(), "text/plain; version=0.0.4"
+                    else:
+                        body, ctype = None, None
+                if body is None:
+                    self._reply(404)
+                else:
+                    self._reply(200, body, ctype)
+
+            def _store(self, method: str):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = self.rfile.read(length).decode(errors="replace")
+                key = self._group_key()
+                with stub._lock:
+                    stub.requests[method] += 1
+                    if key is None:
+                        bad = True
+                    else:
+                        bad = False
+                        stub._group_json.pop(key, None)
+                        if method == "DELETE":
+                            stub.groups.pop(key, None)
+                        else:
+                            stub.groups[key] = payload
+                        stub._text_cache = stub._json_cache = None
+                self._reply(400 if bad else (202 if method == "DELETE" else 200))
+
+            def do_PUT(self):
+                self._store("PUT")
+
+            def do_POST(self):
+                self._store("POST")
+
+            def do_DELETE(self):
+                self._store("DELETE")
+
+        return Handler
@@ -0,0 +1,264 @@
+"""Local SSH stand-in for Fortigate and Juniper devices, for benchmarks and tests.
+
+A paramiko server that accepts any user with the configured password and emulates
+just enough of each CLI for the collectors:
+
+- FortiOS: `NAME # ` prompt; `show full-configuration` prints the configuration, with
+  `--More--` paging every `page_lines` lines (continues on a space).
+- Junos: starts in the shell (`user@NAME:RE:0% `); `cli` enters the CLI (`user@NAME> `);
+  `set cli screen-length 0` turns off `---(more)---` paging; `show configuration |
+  display set` prints the configuration as `set` commands.
+
+The output can be shaped to look like a slow or awkward device: `line_rate` (lines per
+second), `chunk_size` (bytes per SSH packet), `latency` (before each command's output)
+and `split_prompt` (the closing prompt sent in two packets, 50 ms apart). Like
+OpenSSH, the server offers zlib compression.
+"""
+import logging
+import socket
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import paramiko
+
+logging.getLogger("ssh_device_stub").setLevel(logging.CRITICAL)
+
+_FORTIOS_SECTIONS = ("firewall address", "firewall policy", "router static", "system interface", "user local")
+_FORTIOS_COMMAND = "show full-configuration"
+_JUNOS_COMMAND = "show configuration | display set"
+_FORTIOS_MORE = b"--More-- "
+_JUNOS_MORE = b"---(more)---"
+
+
+def fortios_config(size: int, hostname: str = "FGT-BENCH") -> str:
+    """Synthetic FortiOS configuration text of about `size` bytes (as repetitive as real ones)."""
+    parts = [f"#config-version=FGT60F-7.2.8-FW-build1639:opmode=0:vdom=0\nconfig system global\n"
+             f"    set hostname \"{hostname}\"\n    set timezone 28\nend\n"]
+    total = len(parts[0])
+    i = 0
+    while total < size:
+        section = _FORTIOS_SECTIONS[i // 200 % len(_FORTIOS_SECTIONS)]
+        block = (f"config {section}\n    edit {i + 1}\n        set name \"obj-{i:06d}\"\n"
+                 f"        set subnet 10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256} 255.255.255.255\n"
+                 f"        set comment \"managed by automation, ticket CHG{i * 7 % 100000:05d}\"\n"
+                 f"    next\nend\n")
+        parts.append(block)
+        total += len(block)
+        i += 1
+    return "".join(parts)
+
+
+def junos_config(size: int, hostname: str = "BENCH-SW") -> str:
+    """Synthetic Junos configuration in `display set` form, about `size` bytes."""
+    parts = [f"set version 21.4R3-S5\nset system host-name {hostname}\n"]
+    total = len(parts[0])
+    i = 0
+    while total < size:
+        port = f"ge-{i // 192}/{i // 48 % 4}/{i % 48}"
+        block = (f"set interfaces {port} unit 0 description \"access port {i:06d}\"\n"
+                 f"set interfaces {port} unit 0 family ethernet-switching interface-mode access\n"
+                 f"set interfaces {port} unit 0 family ethernet-switching vlan members VLAN{100 + i % 400}\n"
+                 f"set vlans VLAN{100 + i % 400} vlan-id {100 + i % 400}\n")
+        parts.append(block)
+        total += len(block)
+        i += 1
+    return "".join(parts)
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, password: str):
+        self.password = password
+        self.username = "admin"
+
+    def check_auth_password(self, username, password):
+        if password != self.password:
+            return paramiko.AUTH_FAILED
+        self.username = username
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        return True
+
+
+class SshDeviceStub:
+    """Fortigate- or Juniper-like SSH server on a background thread."""
+
+    _host_key: Optional[paramiko.RSAKey] = None
+
+    def __init__(self, vendor: str = "fortios", config_bytes: int = 1_000_000, hostname: Optional[str] = None,
+                 password: str = "bench", line_rate: float = 0, chunk_size: int = 0, latency: float = 0.0,
+                 split_prompt: bool = False, page_lines: int = 0, compression: bool = True,
+                 host: str = "127.0.0.1", port: int = 0):
+        if vendor not in ("fortios", "junos"):
+            raise ValueError(f"unknown vendor {vendor!r}")
+        self.vendor = vendor
+        self.hostname = hostname or ("FGT-BENCH" if vendor == "fortios" else "BENCH-SW")
+        self.password = password
+        self.line_rate = line_rate
+        self.chunk_size = chunk_size
+        self.latency = latency
+        self.split_prompt = split_prompt
+        self.page_lines = page_lines
+        self.compression = compression
+        text = fortios_config(config_bytes, self.hostname) if vendor == "fortios" else junos_config(config_bytes, self.hostname)
+        self.config = text.encode()
+        self.sessions = 0
+        if SshDeviceStub._host_key is None:
+            SshDeviceStub._host_key = paramiko.RSAKey.generate(2048)
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen(128)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._listener.getsockname()[:2]
+
+    @property
+    def prompt(self) -> str:
+        """FortiOS prompt; for Junos, the part after the user name (as in SW_NAME)."""
+        return f"{self.hostname} # " if self.vendor == "fortios" else f"@{self.hostname}> "
+
+    def config_lines(self) -> List[str]:
+        return self.config.decode().splitlines()
+
+    def start(self) -> "SshDeviceStub":
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._listener.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_transport, args=(sock,), daemon=True).start()
+
+    def _serve_transport(self, sock: socket.socket) -> None:
+        # Like sshd for interactive sessions: small writes (prompts) are not held back by Nagle.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(sock)
+        # Clients hanging up mid-session are expected; keep the server side out of the output.
+        transport.set_log_channel("ssh_device_stub")
+        transport.add_server_key(self._host_key)
+        transport.use_compression(self.compression)
+        server = _Server(self.password)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError, OSError):
+            return
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is not None:
+                self.sessions += 1
+                threading.Thread(target=self._serve_shell, args=(channel, server.username), daemon=True).start()
+
+    def _send_prompt(self, channel: paramiko.Channel, prompt: str) -> None:
+        data = f"\r\n{prompt}".encode()
+        if self.split_prompt:
+            middle = len(data) // 2
+            channel.sendall(data[:middle])
+            time.sleep(0.05)
+            data = data[middle:]
+        channel.sendall(data)
+
+    def _send_output(self, channel: paramiko.Channel, paging: bool) -> None:
+        """The configuration, paced and chunked as configured, paging if `paging`."""
+        if self.latency:
+            time.sleep(self.latency)
+        more = _FORTIOS_MORE if self.vendor == "fortios" else _JUNOS_MORE
+        page = self.page_lines if paging else 0
+        writer = _PacedWriter(channel, self.chunk_size, self.line_rate)
+        lines = self.config.splitlines(keepends=True)
+        for number, line in enumerate(lines, 1):
+            writer.write(line)
+            if page and number % page == 0 and number < len(lines):
+                writer.flush()
+                channel.sendall(more)
+                while channel.recv(1) not in (b" ", b""):
+                    pass
+                # Erase the pager prompt, as the devices do.
+                channel.sendall(b"\r" + b" " * len(more) + b"\r")
+        writer.flush()
+
+    def _serve_shell(self, channel: paramiko.Channel, username: str) -> None:
+        fortios = self.vendor == "fortios"
+        cli_prompt = f"{self.hostname} # " if fortios else f"{username}@{self.hostname}> "
+        in_cli = fortios
+        paging = True
+        try:
+            self._send_prompt(channel, cli_prompt if in_cli else f"{username}@{self.hostname}:RE:0% ")
+            buffer = b""
+            while True:
+                data = channel.recv(1024)
+                if not data:
+                    return
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    command = line.strip().decode(errors="replace")
+                    channel.sendall(f"{command}\r\n".encode())
+                    if fortios and command == _FORTIOS_COMMAND:
+                        self._send_output(channel, paging)
+                    elif not fortios and not in_cli and command == "cli":
+                        in_cli = True
+                    elif not fortios and in_cli and command == "set cli screen-length 0":
+                        paging = False
+                        channel.sendall(b"Screen length set to 0\r\n")
+                    elif not fortios and in_cli and command == _JUNOS_COMMAND:
+                        self._send_output(channel, paging)
+                    elif command:
+                        channel.sendall(b"unknown command.\r\n")
+                    self._send_prompt(channel, cli_prompt if in_cli else f"{username}@{self.hostname}:RE:0% ")
+        except (OSError, EOFError, paramiko.SSHException):
+            return
+        finally:
+            try:
+                channel.close()
+            except (OSError, EOFError, paramiko.SSHException):
+                pass
+
+
+class _PacedWriter:
+    """Buffers output into `chunk_size` packets (default: up to 32 KiB) at `line_rate` lines/s."""
+
+    def __init__(self, channel: paramiko.Channel, chunk_size: int, line_rate: float):
+        self.channel = channel
+        self.chunk_size = chunk_size
+        self.line_rate = line_rate
+        self.buffer = b""
+        self.lines = 0
+        self.started = time.perf_counter()
+
+    def write(self, line: bytes) -> None:
+        self.buffer += line
+        self.lines += 1
+        size = self.chunk_size or 32768
+        while len(self.buffer) >= size:
+            self.channel.sendall(self.buffer[:size])
+            self.buffer = self.buffer[size:]
+        # Pace in steps of 10 ms worth of lines.
+        if self.line_rate and self.lines % max(1, int(self.line_rate / 100)) == 0:
+            self.flush()
+            ahead = self.started + self.lines / self.line_rate - time.perf_counter()
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def flush(self) -> None:
+        size = self.chunk_size or len(self.buffer)
+        while self.buffer:
+            self.channel.sendall(self.buffer[:size])
+            self.buffer = self.buffer[size:]
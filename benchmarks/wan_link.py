@@ -0,0 +1,120 @@
+"""Emulated WAN link for benchmarks: a TCP proxy with bandwidth and latency.
+
+Each direction is paced like a serial link (bytes leave at `bandwidth` bytes/s) and
+delivered `delay` seconds later (one-way; RTT = 2 * delay). Nothing is dropped or
+reordered. Because the pacing applies to what is actually on the wire, SSH
+compression, window size and packet overhead show up in transfer times the way they
+do on a slow branch link.
+
+    link = WanLink(("127.0.0.1", device_port), bandwidth=10e6 / 8, delay=0.02).start()
+    ...connect to link.address...
+"""
+import collections
+import socket
+import threading
+import time
+from typing import Optional, Tuple
+
+_READ_SIZE = 16384
+
+
+class _Direction:
+    """One direction of one connection: reader thread -> timed queue -> writer thread."""
+
+    def __init__(self, source: socket.socket, target: socket.socket, link: "WanLink"):
+        self.source = source
+        self.target = target
+        self.link = link
+        self.queue = collections.deque()
+        self.ready = threading.Condition()
+        self.transmit_done = 0.0
+
+    def start(self) -> None:
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def _read(self) -> None:
+        while True:
+            try:
+                data = self.source.recv(_READ_SIZE)
+            except OSError:
+                data = b""
+            now = time.monotonic()
+            with self.ready:
+                if data:
+                    # Serialisation at link speed, then propagation delay.
+                    start = max(now, self.transmit_done)
+                    self.transmit_done = start + (len(data) / self.link.bandwidth if self.link.bandwidth else 0)
+                    self.queue.append((self.transmit_done + self.link.delay, data))
+                else:
+                    self.queue.append((now + self.link.delay, None))
+                self.ready.notify()
+            if not data:
+                return
+
+    def _write(self) -> None:
+        while True:
+            with self.ready:
+                while not self.queue:
+                    self.ready.wait()
+                deliver_at, data = self.queue.popleft()
+            pause = deliver_at - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            if data is None:
+                try:
+                    self.target.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                return
+            try:
+                self.target.sendall(data)
+            except OSError:
+                return
+            with self.link.lock:
+                self.link.bytes_transferred += len(data)
+
+
+class WanLink:
+    """Proxy from a local port to `upstream`, shaped to `bandwidth` (bytes/s, 0 = unlimited) and `delay` (s)."""
+
+    def __init__(self, upstream: Tuple[str, int], bandwidth: float = 0, delay: float = 0.0,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.upstream = upstream
+        self.bandwidth = bandwidth
+        self.delay = delay
+        self.bytes_transferred = 0
+        self.lock = threading.Lock()
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen(128)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._listener.getsockname()[:2]
+
+    def start(self) -> "WanLink":
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._listener.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            try:
+                server = socket.create_connection(self.upstream)
+            except OSError:
+                client.close()
+                continue
+            for s in (client, server):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _Direction(client, server, self).start()
+            _Direction(server, client, self).start()
@@ -0,0 +1,12 @@
+"""
+The apps share their common modules as identical copies (test_shared_modules.py checks
+that they stay so), and a module name can only be imported once per process, so the
+tests import them from one app: backup-fortgiate-fw.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = ("backup-fortgiate-fw", "backup-juniper-sw", "backup-palo-alto")
+
+sys.path.insert(0, os.path.join(ROOT, APPS[0]))
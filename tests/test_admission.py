@@ -0,0 +1,107 @@
+"""admission.Admission: all-or-nothing admission, slot release and token bucket refill."""
+import types
+
+import pytest
+
+import admission
+import inventory
+from inventory import Limit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def _device(name: str, site: str = None, aaa: str = None) -> inventory.Device:
+    return inventory.Device(name, "192.0.2.1", 22, "backup", "secret", site=site, aaa=aaa)
+
+
+def test_admitted_only_when_every_limit_has_room(clock):
+    control = admission.Admission("fortigate", {"site": {"*": Limit(concurrency=1)},
+                                                "aaa": {"*": Limit(concurrency=1)}})
+    holder, _ = control.try_acquire(_device("a", site="paris", aaa="tacacs"))
+    assert holder is not None
+    # Room at its site, none in its realm: refused, and nothing taken at the site.
+    ticket, refusal = control.try_acquire(_device("b", site="lyon", aaa="tacacs"))
+    assert ticket is None
+    assert refusal == admission.Refusal("aaa", "concurrency", None)
+    ticket, refusal = control.try_acquire(_device("c", site="lyon", aaa="radius"))
+    assert ticket is not None and refusal is None
+
+
+def test_release_gives_the_slots_back_and_wakes_waiters(clock):
+    control = admission.Admission("fortigate", {"site": {"paris": Limit(concurrency=1)}})
+    holder, _ = control.try_acquire(_device("a", site="paris"))
+    woken = []
+    ticket, refusal = control.try_acquire(_device("b", site="paris"), waiter=lambda: woken.append("b"))
+    assert ticket is None and refusal.limit == "site"
+    holder.release()
+    holder.release()  # a second release is a no-op
+    assert woken == ["b"]
+    ticket, _ = control.try_acquire(_device("b", site="paris"))
+    assert ticket is not None
+    assert control.try_acquire(_device("c", site="paris"))[0] is None
+
+
+def test_devices_without_a_matching_limit_are_admitted(clock):
+    control = admission.Admission("fortigate", {"site": {"paris": Limit(concurrency=1)}})
+    control.try_acquire(_device("a", site="paris"))
+    assert control.try_acquire(_device("b", site="lyon"))[0] is not None
+    assert control.try_acquire(_device("c"))[0] is not None
+
+
+def test_rate_limit_refills_at_its_rate(clock):
+    # 8/s: a token every 0.125 s, exact in binary floating point.
+    control = admission.Admission("fortigate", {"aaa": {"tacacs": Limit(rate=8, burst=2)}})
+    device = _device("a", aaa="tacacs")
+    assert control.try_acquire(device)[0] is not None
+    assert control.try_acquire(device)[0] is not None
+    ticket, refusal = control.try_acquire(device)
+    assert ticket is None
+    assert refusal.reason == "rate"
+    assert refusal.retry_after == 0.125
+    clock.now += 0.0625
+    assert control.try_acquire(device)[0] is None
+    clock.now += 0.0625
+    assert control.try_acquire(device)[0] is not None
+
+
+def test_bucket_never_holds_more_than_the_burst(clock):
+    control = admission.Admission("fortigate", {"aaa": {"*": Limit(rate=1, burst=3)}})
+    device = _device("a", aaa="tacacs")
+    control.try_acquire(device)
+    clock.now += 3600
+    admitted = sum(control.try_acquire(device)[0] is not None for _ in range(5))
+    assert admitted == 3
+
+
+def test_a_rate_refusal_takes_no_concurrency_slot(clock):
+    control = admission.Admission("fortigate", {"site": {"*": Limit(concurrency=1)},
+                                                "vendor": {"fortigate": Limit(rate=1, burst=1)}})
+    first, _ = control.try_acquire(_device("a", site="paris"))
+    assert first is not None
+    ticket, refusal = control.try_acquire(_device("b", site="lyon"))
+    assert ticket is None and refusal == admission.Refusal("vendor", "rate", pytest.approx(1.0))
+    clock.now += 1
+    assert control.try_acquire(_device("b", site="lyon"))[0] is not None
+
+
+def test_reconfigure_keeps_the_runs_holding_slots(clock):
+    control = admission.Admission("fortigate", {"site": {"*": Limit(concurrency=1)}})
+    holder, _ = control.try_acquire(_device("a", site="paris"))
+    control.configure({"site": {"*": Limit(concurrency=2)}})
+    assert control.try_acquire(_device("b", site="paris"))[0] is not None
+    assert control.try_acquire(_device("c", site="paris"))[0] is None
+    holder.release()
+    assert control.try_acquire(_device("c", site="paris"))[0] is not None
@@ -0,0 +1,106 @@
+"""plan_retention(): which backups the GFS policy keeps, at the edges of each tier; and the
+manifest rewrite after deletions, with a collector process appending at the same time."""
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import manifest
+import retention
+from tests.conftest import APPS, ROOT
+
+NOW = datetime(2024, 6, 15, 12, 0, tzinfo=timezone.utc).timestamp()
+DAY = 86400
+
+
+@pytest.fixture(autouse=True)
+def policy(monkeypatch):
+    monkeypatch.setattr(retention, "RETENTION_KEEP_ALL_DAYS", 7)
+    monkeypatch.setattr(retention, "RETENTION_DAILY_DAYS", 90)
+    monkeypatch.setattr(retention, "RETENTION_MONTHLY_MONTHS", 24)
+
+
+def _entry(ts: float, device: str = "fw1") -> dict:
+    return {"provider": "aws", "bucket": "backups", "device": device, "key": f"{device}/{ts:.0f}", "timestamp": ts}
+
+
+def _at(*fields) -> float:
+    return datetime(*fields, tzinfo=timezone.utc).timestamp()
+
+
+def _kept(entries) -> set:
+    keep, delete = retention.plan_retention(entries, now=NOW)
+    assert len(keep) + len(delete) == len(entries)
+    return {e["timestamp"] for e in keep}
+
+
+def test_newest_backup_is_kept_whatever_its_age():
+    old = NOW - 5 * 365 * DAY
+    assert _kept([_entry(old), _entry(old - DAY)]) == {old}
+
+
+def test_everything_within_keep_all_days_is_kept():
+    entries = [_entry(NOW - hours * 3600) for hours in range(0, 7 * 24 + 1, 6)]
+    assert _kept(entries) == {e["timestamp"] for e in entries}
+
+
+def test_daily_tier_keeps_the_newest_backup_of_each_day():
+    boundary = NOW - 7 * DAY                            # 2024-06-08 12:00, still in keep-all
+    same_day = boundary - 3600                          # its day is already represented
+    previous_day_newest = _at(2024, 6, 7, 23, 0)
+    previous_day_older = _at(2024, 6, 7, 22, 0)
+    entries = [_entry(ts) for ts in (NOW, boundary, same_day, previous_day_newest, previous_day_older)]
+    assert _kept(entries) == {NOW, boundary, previous_day_newest}
+
+
+def test_daily_tier_ends_at_retention_daily_days():
+    march = _at(2024, 3, 20)                            # within the daily tier; March is represented
+    last_daily = NOW - 90 * DAY
+    assert _kept([_entry(NOW), _entry(march), _entry(last_daily)]) == {NOW, march, last_daily}
+    past_daily = NOW - 90 * DAY - 1                     # same day, but no longer daily and March is taken
+    assert _kept([_entry(NOW), _entry(march), _entry(past_daily)]) == {NOW, march}
+
+
+def test_monthly_tier_keeps_the_newest_backup_of_each_month():
+    july_newest, july_older = _at(2022, 7, 31), _at(2022, 7, 1)   # 23 months before June 2024
+    june = _at(2022, 6, 30)                                       # 24 months: out of the monthly tier
+    assert _kept([_entry(NOW), _entry(july_newest), _entry(july_older), _entry(june)]) == {NOW, july_newest}
+
+
+def test_devices_are_planned_separately():
+    old = NOW - 800 * DAY                               # past every tier
+    entries = [_entry(NOW, "fw1"), _entry(old, "fw1"), _entry(old, "fw2"), _entry(old - DAY, "fw2")]
+    keep, delete = retention.plan_retention(entries, now=NOW)
+    assert {(e["device"], e["timestamp"]) for e in keep} == {("fw1", NOW), ("fw2", old)}
+    assert {(e["device"], e["timestamp"]) for e in delete} == {("fw1", old), ("fw2", old - DAY)}
+
+
+def test_entry_appended_by_another_process_during_a_rewrite_is_kept(tmp_path, monkeypatch):
+    path = str(tmp_path / "manifest.jsonl")
+    monkeypatch.setattr(manifest, "MANIFEST_FILE", path)
+    manifest.record_upload("fw1", "aws", "backups", "fw1/old", 10, timestamp=1.0)
+    manifest.record_upload("fw1", "aws", "backups", "fw1/kept", 10, timestamp=2.0)
+
+    # A collector (own process, as with `python retention.py` run as a separate job)
+    # uploads while the rewrite is between reading the manifest and replacing it.
+    collector = []
+    read = manifest._read
+
+    def read_then_let_the_collector_append():
+        entries = read()
+        env = dict(os.environ, MANIFEST_FILE=path, PYTHONPATH=os.path.join(ROOT, APPS[0]))
+        collector.append(subprocess.Popen(
+            [sys.executable, "-c", "import manifest; manifest.record_upload('fw1', 'aws', 'backups', 'fw1/new', 10)"],
+            env=env))
+        time.sleep(1)  # the append would land here without the lock
+        return entries
+
+    monkeypatch.setattr(manifest, "_read", read_then_let_the_collector_append)
+    assert manifest.remove_keys([("aws", "backups", "fw1/old")]) == 1
+    monkeypatch.setattr(manifest, "_read", read)
+    assert collector[0].wait(timeout=30) == 0
+    assert [e["key"] for e in manifest.load_entries()] == ["fw1/kept", "fw1/new"]
+    assert sorted(os.listdir(tmp_path)) == ["manifest.jsonl", "manifest.jsonl.lock"]
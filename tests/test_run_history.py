@@ -0,0 +1,70 @@
+"""run_history: P2Quantile against the quantiles of the sorted sample, and run records."""
+import bisect
+import random
+
+import pytest
+
+import run_history
+import tracing
+from run_history import P2Quantile
+
+_DISTRIBUTIONS = {
+    "uniform": lambda rng: rng.uniform(0, 10),
+    "exponential": lambda rng: rng.expovariate(1.0),
+    "lognormal": lambda rng: rng.lognormvariate(0, 1),   # long tail, like run durations
+}
+
+
+@pytest.mark.parametrize("distribution", sorted(_DISTRIBUTIONS))
+@pytest.mark.parametrize("p", [0.5, 0.95, 0.99])
+def test_estimate_is_close_to_the_sample_quantile(distribution, p):
+    rng = random.Random(42)
+    samples = [_DISTRIBUTIONS[distribution](rng) for _ in range(20000)]
+    estimator = P2Quantile(p)
+    for x in samples:
+        estimator.add(x)
+    ordered = sorted(samples)
+    # Compared by rank: the share of the sample below the estimate.
+    rank = bisect.bisect_left(ordered, estimator.value()) / len(ordered)
+    assert rank == pytest.approx(p, abs=0.01)
+
+
+def test_up_to_five_samples_are_exact():
+    estimator = P2Quantile(0.5)
+    assert estimator.value() is None
+    for x in (5.0, 1.0, 3.0):
+        estimator.add(x)
+    assert estimator.value() == 3.0
+    for x in (4.0, 2.0):
+        estimator.add(x)
+    assert estimator.value() == 3.0
+
+
+def test_markers_stay_ordered_and_within_the_sample():
+    rng = random.Random(7)
+    estimator = P2Quantile(0.95)
+    samples = []
+    for _ in range(5000):
+        samples.append(rng.expovariate(0.5))
+        estimator.add(samples[-1])
+        assert estimator.heights == sorted(estimator.heights)
+    assert estimator.heights[0] == min(samples)
+    assert estimator.heights[4] == max(samples)
+    assert estimator.count == len(samples)
+
+
+def _trace(*children: dict) -> list:
+    spans = [tracing.Span(f"stage{i}", "t" * 32, None, attributes, []) for i, attributes in enumerate(children)]
+    spans.append(tracing.Span("backup_run", "t" * 32, None, {"device": "fw1"}, []))
+    for span in spans:
+        span.end_ns = span.start_ns + 1000
+    return spans
+
+
+def test_retries_are_summed_from_the_spans():
+    assert run_history.summarize(_trace({"retries": 1}, {}))["retries"] == 1
+    assert run_history.summarize(_trace({"retries": 0}))["retries"] == 0
+
+
+def test_retries_are_unknown_without_a_retry_path():
+    assert run_history.summarize(_trace({}, {"bytes": 10}))["retries"] is None
@@ -0,0 +1,61 @@
+"""scheduling.CronTicker: jittered ticks, and missed ticks coalesced into one run."""
+from datetime import datetime, timezone
+
+from scheduling import CronTicker, jitter_for
+
+T0 = datetime(2024, 6, 15, 12, 1, tzinfo=timezone.utc).timestamp()
+TICK = datetime(2024, 6, 15, 12, 5, tzinfo=timezone.utc).timestamp()
+FIVE_MINUTES = 300
+
+
+def test_first_due_tick_is_the_next_cron_tick():
+    ticker = CronTicker("*/5 * * * *", "fw1", now=T0, max_jitter=0)
+    assert ticker.due == TICK
+    assert ticker.interval == FIVE_MINUTES
+
+
+def test_advance_past_before_the_tick_passes_nothing():
+    ticker = CronTicker("*/5 * * * *", "fw1", now=T0, max_jitter=0)
+    assert ticker.advance_past(TICK - 1) == 0
+    assert ticker.due == TICK
+
+
+def test_advance_past_coalesces_missed_ticks():
+    ticker = CronTicker("*/5 * * * *", "fw1", now=T0, max_jitter=0)
+    # 12:05, 12:10, 12:15 and 12:20 came due: one run for all of them.
+    assert ticker.advance_past(TICK + 3 * FIVE_MINUTES + 1) == 4
+    assert ticker.due == TICK + 4 * FIVE_MINUTES
+
+
+def test_a_tick_due_exactly_now_is_passed():
+    ticker = CronTicker("*/5 * * * *", "fw1", now=T0, max_jitter=0)
+    assert ticker.advance_past(TICK) == 1
+    assert ticker.due == TICK + FIVE_MINUTES
+
+
+def test_jitter_shifts_every_tick_by_the_same_offset():
+    ticker = CronTicker("*/5 * * * *", "fw1", now=T0, max_jitter=60)
+    jitter = jitter_for("fw1", 60)
+    assert 0 < jitter < 60
+    assert ticker.due == TICK + jitter
+    # The cron tick itself has passed, the device's jittered one has not.
+    assert ticker.advance_past(TICK + jitter / 2) == 0
+    assert ticker.advance_past(TICK + FIVE_MINUTES + jitter) == 2
+    assert ticker.due == TICK + 2 * FIVE_MINUTES + jitter
+
+
+def test_jitter_is_capped_to_a_quarter_of_the_interval():
+    ticker = CronTicker("* * * * *", "fw1", now=T0, max_jitter=3600)
+    assert ticker.jitter == jitter_for("fw1", 15)
+    assert ticker.jitter < 15
+
+
+def test_wait_reports_lateness_and_coalesced_ticks():
+    start = datetime.now(timezone.utc).timestamp() - 3600
+    ticker = CronTicker("*/5 * * * *", "fw1", now=start, max_jitter=0)
+    due = ticker.due
+    lateness, coalesced = ticker.wait()
+    assert lateness >= 3600 - FIVE_MINUTES
+    # The due tick runs; the ones that came due after it during the lateness are coalesced.
+    assert coalesced == int(lateness // FIVE_MINUTES)
+    assert ticker.due > due + lateness
@@ -0,0 +1,22 @@
+"""The modules the apps share are copies: a fix to one has to reach all of them."""
+import filecmp
+import os
+
+import pytest
+
+from tests.conftest import APPS, ROOT
+
+# Per app on purpose: cronjob.py, metrics.py (metric prefixes) and the collectors.
+_APP_SPECIFIC = {"cronjob.py", "metrics.py", "fortigate_backup.py", "juniper-sw.py", "palo_alto_backup.py"}
+
+
+def _modules(app: str) -> set:
+    return {name for name in os.listdir(os.path.join(ROOT, app)) if name.endswith(".py")} - _APP_SPECIFIC
+
+
+@pytest.mark.parametrize("app", APPS[1:])
+def test_shared_modules_are_identical(app):
+    reference = os.path.join(ROOT, APPS[0])
+    for name in sorted(_modules(app)):
+        assert filecmp.cmp(os.path.join(reference, name), os.path.join(ROOT, app, name), shallow=False), \
+            f"{app}/{name} differs from {APPS[0]}/{name}"